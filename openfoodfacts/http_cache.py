@@ -0,0 +1,168 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+
+
+class CacheEntry:
+    def __init__(self, path, content, etag=None, last_modified=None, stored_at=0.0):
+        self.path = path
+        self.content = content
+        self.etag = etag
+        self.last_modified = last_modified
+        self.stored_at = stored_at
+
+    def is_fresh(self, ttl) -> bool:
+        return time.time() - self.stored_at < ttl
+
+    def get_validators(self) -> dict:
+        """
+        Get the headers of a conditional request revalidating this entry
+
+        :return: dict of headers
+
+        """
+        headers = {}
+        if self.etag:
+            headers['If-None-Match'] = self.etag
+        if self.last_modified:
+            headers['If-Modified-Since'] = self.last_modified
+
+        return headers
+
+
+class HTTPCache:
+    """
+    Persistent cache of OFF responses, one file per url + params.
+    A file starts with one line of JSON metadata (etag, last_modified, stored_at) followed by the raw content.
+    Entries younger than ttl are served without any request, older ones are revalidated with
+    If-None-Match / If-Modified-Since. The least recently used entries are evicted over max_size bytes.
+
+    """
+    _TTL = 24 * 60 * 60
+    _MAX_SIZE = 500 * 1024 * 1024
+
+    def __init__(self, directory, ttl=_TTL, max_size=_MAX_SIZE):
+        self.directory = directory
+        self.ttl = ttl
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.revalidated = 0
+        self._lock = threading.Lock()
+
+        os.makedirs(self.directory, exist_ok=True)
+        self._size = sum(entry.stat().st_size for entry in os.scandir(self.directory) if entry.is_file())
+
+    @staticmethod
+    def _get_key(url: str, params: dict) -> str:
+        params = sorted((params or {}).items())
+        raw_key = json.dumps([url, params])
+
+        return hashlib.sha256(raw_key.encode("utf-8")).hexdigest()
+
+    def get(self, url: str, params: dict):
+        """
+        Get the cached response of url + params, fresh or not
+
+        :param url: url requested
+        :param params: dict of query params
+        :return: CacheEntry or None
+
+        """
+        path = os.path.join(self.directory, self._get_key(url, params))
+
+        try:
+            with open(path, "rb") as f:
+                metadata = json.loads(f.readline())
+                content = f.read()
+            # Most recently used is the most recently modified
+            os.utime(path)
+        except (OSError, ValueError):
+            return None
+
+        return CacheEntry(path, content, **metadata)
+
+    def set(self, url: str, params: dict, content: bytes, headers) -> None:
+        """
+        Store a 200 response
+
+        :param url: url requested
+        :param params: dict of query params
+        :param content: raw content of the response
+        :param headers: headers of the response
+        :return: None
+
+        """
+        metadata = {
+            'etag': headers.get('ETag'),
+            'last_modified': headers.get('Last-Modified'),
+            'stored_at': time.time()
+        }
+        path = os.path.join(self.directory, self._get_key(url, params))
+        self._write(path, metadata, content)
+
+    def refresh(self, entry: CacheEntry) -> None:
+        """
+        Restart the ttl of an entry confirmed by a 304
+
+        :param entry: CacheEntry revalidated
+        :return: None
+
+        """
+        metadata = {
+            'etag': entry.etag,
+            'last_modified': entry.last_modified,
+            'stored_at': time.time()
+        }
+        self._write(entry.path, metadata, entry.content)
+
+    def _write(self, path: str, metadata: dict, content: bytes) -> None:
+        try:
+            old_size = os.path.getsize(path)
+        except OSError:
+            old_size = 0
+
+        # Writing in a temporary file first so that a reader never sees half an entry
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            f.write(json.dumps(metadata).encode("utf-8") + b"\n")
+            f.write(content)
+        new_size = os.path.getsize(tmp_path)
+        os.replace(tmp_path, path)
+
+        with self._lock:
+            self._size += new_size - old_size
+            if self._size > self.max_size:
+                self._evict()
+
+    def _evict(self) -> None:
+        """
+        Remove the least recently used entries until the cache is back under 90% of max_size
+
+        :return: None
+
+        """
+        entries = [entry for entry in os.scandir(self.directory)
+                   if entry.is_file() and not entry.name.endswith(".tmp")]
+        entries.sort(key=lambda entry: entry.stat().st_mtime)
+
+        target_size = self.max_size * 0.9
+        for entry in entries:
+            if self._size <= target_size:
+                break
+            try:
+                size = entry.stat().st_size
+                os.remove(entry.path)
+            except OSError:
+                continue
+            self._size -= size
+
+    def count(self, stat: str) -> None:
+        with self._lock:
+            setattr(self, stat, getattr(self, stat) + 1)
+
+    def get_stats(self) -> str:
+        return f"{self.hits} hits, {self.revalidated} revalidated (304), {self.misses} misses"
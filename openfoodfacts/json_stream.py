@@ -0,0 +1,132 @@
+import codecs
+import json
+import re
+
+
+_DECODER = json.JSONDecoder()
+_WHITESPACE = re.compile(r"[ \t\n\r]*")
+# What can still follow the decoded part of a number
+_NUMBER_END = re.compile(r"[0-9.eE+-]*")
+
+
+class _ChunksReader:
+    """
+    Text buffer over an iterator of chunks (bytes or str), refilled only when a value is cut by the end of a chunk
+
+    """
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._utf8_decoder = codecs.getincrementaldecoder("utf-8")()
+        self.buffer = ""
+        self.pos = 0
+
+    def fill(self) -> bool:
+        """
+        Append the next chunk to the buffer, dropping what was already read
+
+        :return: bool - False when there is no chunk left
+
+        """
+        for chunk in self._chunks:
+            if isinstance(chunk, bytes):
+                chunk = self._utf8_decoder.decode(chunk)
+            self.buffer = self.buffer[self.pos:] + chunk
+            self.pos = 0
+            return True
+
+        return False
+
+    def next_char(self) -> str:
+        """
+        Consume and return the next non whitespace char, "" at the end of the stream
+
+        """
+        while True:
+            self.pos = _WHITESPACE.match(self.buffer, self.pos).end()
+            if self.pos < len(self.buffer):
+                char = self.buffer[self.pos]
+                self.pos += 1
+                return char
+            if not self.fill():
+                return ""
+
+    def expect(self, expected: str) -> None:
+        char = self.next_char()
+        if char != expected:
+            raise ValueError(f"Expecting '{expected}', got '{char}' at char {self.pos}")
+
+    def peek_char(self) -> str:
+        char = self.next_char()
+        if char:
+            self.pos -= 1
+        return char
+
+    def decode(self):
+        """
+        Consume and return the next complete JSON value
+
+        """
+        self.peek_char()
+
+        while True:
+            try:
+                value, end = _DECODER.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError:
+                # The value goes on in the next chunk
+                if not self.fill():
+                    raise
+                continue
+
+            # A number at the end of the buffer may go on in the next chunk too, e.g. "1500." or "12e" cut
+            # before their digits are decoded as 1500 and 12 followed by what looks like garbage
+            if isinstance(value, (int, float)) and not isinstance(value, bool) \
+                    and _NUMBER_END.fullmatch(self.buffer, end) and self.fill():
+                continue
+
+            self.pos = end
+            return value
+
+
+def iter_array(chunks, key: str):
+    """
+    Get generator of the items of the array `key` of a top level JSON object, decoded while the chunks arrive.
+    The chunks after the end of the array are not read.
+
+    :param chunks: iterator of bytes or str
+    :param key: name of the array in the top level object
+    :return: items of the array
+    :raise ValueError: malformed JSON, KeyError: key not found
+
+    """
+    reader = _ChunksReader(chunks)
+    reader.expect("{")
+
+    if reader.peek_char() == "}":
+        raise KeyError(key)
+
+    while True:
+        name = reader.decode()
+        reader.expect(":")
+
+        if name == key:
+            reader.expect("[")
+            if reader.peek_char() == "]":
+                return
+
+            while True:
+                yield reader.decode()
+
+                char = reader.next_char()
+                if char == "]":
+                    return
+                if char != ",":
+                    raise ValueError(f"Expecting ',' or ']' in '{key}', got '{char}'")
+
+        # Not the array we are looking for
+        reader.decode()
+
+        char = reader.next_char()
+        if char == "}":
+            raise KeyError(key)
+        if char != ",":
+            raise ValueError(f"Expecting ',' or '}}', got '{char}'")
@@ -0,0 +1,164 @@
+import threading
+import time
+from contextlib import contextmanager
+
+
+class Histogram:
+    """
+    Counts of values by bucket, the upper bounds of the buckets being given in BUCKETS
+
+    """
+    # Milliseconds, the last bucket holds everything above
+    BUCKETS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+    def __init__(self):
+        self.counts = [0] * (len(self.BUCKETS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, value: float) -> None:
+        index = next((index for index, bound in enumerate(self.BUCKETS) if value <= bound), len(self.BUCKETS))
+        self.counts[index] += 1
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+
+    def get_percentile(self, percentile: float) -> float:
+        """
+        Get the upper bound of the bucket holding the percentile, self.max for the last bucket
+
+        :param percentile: between 0 and 100
+        :return: float
+
+        """
+        if not self.count:
+            return 0.0
+
+        rank = percentile / 100 * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return min(self.BUCKETS[index], self.max) if index < len(self.BUCKETS) else self.max
+
+        return self.max
+
+    def merge(self, data: dict) -> None:
+        self.counts = [count + other for count, other in zip(self.counts, data['counts'])]
+        self.count += data['count']
+        self.total += data['total']
+        self.max = max(self.max, data['max'])
+
+    def to_dict(self) -> dict:
+        return {
+            'buckets': list(self.BUCKETS),
+            'counts': self.counts,
+            'count': self.count,
+            'total': self.total,
+            'max': self.max,
+            'mean': self.total / self.count if self.count else 0.0,
+            'p50': self.get_percentile(50),
+            'p95': self.get_percentile(95),
+            'p99': self.get_percentile(99),
+        }
+
+
+class Metrics:
+    """
+    Instrumentation of an ingestion run, shared by the threads of the OFF client and the commands:
+    time spent by stage (http, parse, validate, db_write...), HTTP latency histogram and counters
+    (e.g. the products rejected by rule). to_dict() gives the JSON report, merge() adds a worker's one.
+
+    """
+    def __init__(self):
+        self.stages = {}
+        self.counters = {}
+        self.http_latency = Histogram()
+        self._lock = threading.Lock()
+
+    def add_time(self, stage: str, seconds: float, count=1) -> None:
+        with self._lock:
+            stage_seconds, stage_count = self.stages.get(stage, (0.0, 0))
+            self.stages[stage] = (stage_seconds + seconds, stage_count + count)
+
+    @contextmanager
+    def timer(self, stage: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(stage, time.perf_counter() - start)
+
+    def timed(self, iterable, stage: str):
+        """
+        Get generator of the items of iterable, the time spent getting each one being added to stage
+
+        :param iterable: e.g. a generator reading and decoding a file
+        :param stage: name of the stage
+        :return: items of iterable
+
+        """
+        seconds = 0.0
+        count = 0
+        iterator = iter(iterable)
+
+        try:
+            while True:
+                start = time.perf_counter()
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+                finally:
+                    seconds += time.perf_counter() - start
+                count += 1
+                yield item
+        finally:
+            self.add_time(stage, seconds, count)
+
+    def count(self, counter: str, number=1) -> None:
+        with self._lock:
+            self.counters[counter] = self.counters.get(counter, 0) + number
+
+    def add_http_latency(self, seconds: float) -> None:
+        with self._lock:
+            self.http_latency.add(seconds * 1000)
+        self.add_time('http', seconds)
+
+    def merge(self, data: dict) -> None:
+        """
+        Add the metrics of another run, e.g. of a worker process
+
+        :param data: dict given by to_dict()
+        :return: None
+
+        """
+        for stage, values in data['stages'].items():
+            self.add_time(stage, values['seconds'], values['count'])
+
+        for counter, number in data['counters'].items():
+            self.count(counter, number)
+
+        with self._lock:
+            self.http_latency.merge(data['http_latency_ms'])
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            return {
+                'stages': {stage: {'seconds': seconds, 'count': count}
+                           for stage, (seconds, count) in self.stages.items()},
+                'counters': dict(self.counters),
+                'http_latency_ms': self.http_latency.to_dict(),
+            }
+
+    def get_stats(self) -> str:
+        with self._lock:
+            stages = ", ".join(f"{stage} {seconds:.1f}s" for stage, (seconds, _) in sorted(self.stages.items()))
+            rejected = ", ".join(f"{counter.replace('rejected_', '')} {number}"
+                                 for counter, number in sorted(self.counters.items())
+                                 if counter.startswith('rejected_'))
+            latency = f"p50 {self.http_latency.get_percentile(50):.0f}ms, " \
+                      f"p99 {self.http_latency.get_percentile(99):.0f}ms"
+
+        return f"{stages or 'no stage'} | HTTP latency {latency} | rejected : {rejected or 'none'}"
@@ -1,24 +1,190 @@
 import json
-import re
 import html
+import time
+from collections import Counter, deque, namedtuple
+from itertools import islice
+from concurrent.futures import ThreadPoolExecutor
 
 import requests
+from requests.adapters import HTTPAdapter
+
+from .json_stream import iter_array
+from .metrics import Metrics
+from .scheduler import RequestScheduler
 
 
 class OpenFoodFactsException(Exception):
     pass
 
 
+# A requested search.pl page of a category: products [offset, offset + page_size[ of the search
+Page = namedtuple('Page', ['offset', 'page_size', 'future'])
+# Where get_products() is in a category: next offset in the search, products yielded, category done
+Progress = namedtuple('Progress', ['offset', 'products_added', 'completed'])
+
+
 class OpenFoodFactsAPI:
     _OFF_URL = "https://fr.openfoodfacts.org/"
     _PRODUCTS_BY_PAGE = 250
+    # Each size divides the previous one, so that shrinking the pages keeps them aligned on the offset
+    _PAGE_SIZES = (250, 50, 25, 5)
+    # Products of a page validated together, pulled from the page while it streams in
+    _VALIDATE_BATCH_SIZE = 50
     _PRODUCTS_URL = "https://fr.openfoodfacts.org/cgi/search.pl"
-
-    def __init__(self, number_categories, number_products_by_category, categories=None):
+    _PRODUCT_URL = "https://fr.openfoodfacts.org/api/v0/product/"
+    _PRODUCT_FIELDS = 'code,product_name_fr,image_url,' \
+                      'nutriscore_score,nutriscore_grade,selected_images,' \
+                      'countries_lc,categories_lc,labels_lc,last_modified_t'
+    _GRADES = frozenset('abcdeABCDE')
+    _MAX_WORKERS = 4
+    _CHUNK_SIZE = 64 * 1024
+    _TIMEOUT = 60
+
+    def __init__(self, number_categories, number_products_by_category, categories=None, max_workers=_MAX_WORKERS,
+                 cache=None, stream_json=False, scheduler=None, off_url=None, modified_since=None, metrics=None):
         self._number_categories = number_categories
         self._number_products_by_category = number_products_by_category
+        self._modified_since = modified_since
+        # Most recent last_modified_t of the products seen by get_products()
+        self.last_modified_t = None
+        self._max_workers = max_workers
+        self._stream_json = stream_json
+        self.cache = cache
+        self.metrics = metrics or Metrics()
+        # The workers send the requests, one more connection is pooled for a streamed page
+        # whose content is still read by the main thread
+        self.scheduler = scheduler or RequestScheduler(max_concurrency=max_workers + 1)
+
+        if off_url is not None:
+            self._OFF_URL = off_url
+            self._PRODUCTS_URL = off_url + "cgi/search.pl"
+            self._PRODUCT_URL = off_url + "api/v0/product/"
+
+        self._session = self._get_session()
         self.categories = categories or self._get_categories()
 
+    def _get_session(self) -> requests.Session:
+        """
+        Get a keep-alive session with a pooled connection for every request allowed at once by self.scheduler
+
+        :return: requests.Session
+
+        """
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_maxsize=self.scheduler.max_concurrency)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+
+        return session
+
+    def _request(self, url: str, params: dict, stream=False, revalidate=False) -> tuple:
+        """
+        GET url through self.cache if any. A fresh cached response costs no request,
+        a stale one is revalidated with a conditional request
+
+        :param url: url to get
+        :param params: dict of query params
+        :param stream: get an iterator of the chunks of the content instead of the whole content
+        :param revalidate: send a conditional request even if the cached response is fresh
+        :return: tuple of the status code and the raw content of the response
+
+        """
+        entry = None
+        if self.cache is not None:
+            entry = self.cache.get(url, params)
+            if entry is not None and not revalidate and entry.is_fresh(self.cache.ttl):
+                self.cache.count('hits')
+                return 200, self._iter_cached(entry.content) if stream else entry.content
+
+        headers = entry.get_validators() if entry is not None else {}
+        response = self._send(url, params, headers, stream)
+
+        if response.status_code == 304 and entry is not None:
+            response.close()
+            self.cache.count('revalidated')
+            self.cache.refresh(entry)
+            return 200, self._iter_cached(entry.content) if stream else entry.content
+
+        if self.cache is not None:
+            self.cache.count('misses')
+
+        if stream:
+            return response.status_code, self._iter_content(response, url, params)
+
+        if self.cache is not None and response.status_code == 200 and response.content:
+            self.cache.set(url, params, response.content, response.headers)
+
+        return response.status_code, response.content
+
+    def _send(self, url: str, params: dict, headers: dict, stream: bool) -> requests.Response:
+        """
+        GET url under self.scheduler. 429, 5xx and network errors are retried after a backoff,
+        the last response is returned if they keep failing
+
+        :param url: url to get
+        :param params: dict of query params
+        :param headers: dict of headers
+        :param stream: don't download the content now
+        :return: requests.Response
+        :raise OpenFoodFactsException: network error on every attempt
+
+        """
+        for attempt in range(self.scheduler.max_retries + 1):
+            self.scheduler.acquire()
+            retry_after = None
+            # Until the whole content is received, or the headers only when streamed
+            start = time.perf_counter()
+
+            try:
+                response = self._session.get(url, params=params, headers=headers, stream=stream,
+                                             timeout=self._TIMEOUT)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                self.metrics.add_http_latency(time.perf_counter() - start)
+                self.metrics.count('http_errors')
+                self.scheduler.release(success=False)
+                if attempt == self.scheduler.max_retries:
+                    raise OpenFoodFactsException(f"Error when requesting {url} : {e!r}")
+            else:
+                self.metrics.add_http_latency(time.perf_counter() - start)
+                is_failure = response.status_code == 429 or response.status_code >= 500
+                self.scheduler.release(success=not is_failure)
+
+                if not is_failure or attempt == self.scheduler.max_retries:
+                    return response
+
+                retry_after = response.headers.get('Retry-After')
+                response.close()
+                self.metrics.count('http_retries')
+
+            time.sleep(self.scheduler.get_backoff(attempt, retry_after))
+
+    @staticmethod
+    def _iter_cached(content: bytes):
+        yield content
+
+    def _iter_content(self, response, url: str, params: dict):
+        """
+        Get generator of the chunks of a streamed response. The response is cached only if it is read until the end
+
+        :param response: requests.Response opened with stream=True
+        :param url: url requested
+        :param params: dict of query params
+        :return: bytes
+
+        """
+        chunks = []
+
+        try:
+            for chunk in response.iter_content(self._CHUNK_SIZE):
+                if self.cache is not None:
+                    chunks.append(chunk)
+                yield chunk
+        finally:
+            response.close()
+
+        if self.cache is not None and response.status_code == 200 and chunks:
+            self.cache.set(url, params, b"".join(chunks), response.headers)
+
     def _get_categories(self) -> list:
         """
         Get self.number_categories categories from OFF
@@ -30,17 +196,33 @@ class OpenFoodFactsAPI:
             "json": "true"
         }
 
-        response = requests.get(self._OFF_URL + "categories", params=params)
+        if self._stream_json:
+            status_code, chunks = self._request(self._OFF_URL + "categories", params, stream=True)
+            return self._parse_categories_stream(status_code, chunks)
+
+        status_code, content = self._request(self._OFF_URL + "categories", params)
+
+        with self.metrics.timer('parse'):
+            return self._parse_categories(status_code, content)
 
-        if not response.content or response.status_code != 200:
-            raise OpenFoodFactsException(f"Error when retrieving categories : Status code - {response.status_code}, "
-                                         f"response.content - {response.content}")
+    def _parse_categories(self, status_code: int, content) -> list:
+        """
+        Check the response of the categories endpoint and keep the self.number_categories first names
+
+        :param status_code: HTTP status code of the response
+        :param content: raw content of the response
+        :return: list of categories names
+
+        """
+        if not content or status_code != 200:
+            raise OpenFoodFactsException(f"Error when retrieving categories : Status code - {status_code}, "
+                                         f"response.content - {content}")
 
         try:
-            response_json = json.loads(response.content)
+            response_json = json.loads(content)
             categories = response_json['tags'][:self._number_categories]
         except (TypeError, KeyError):
-            raise OpenFoodFactsException(f"Error when retrieving categories : response.content = {response.content}")
+            raise OpenFoodFactsException(f"Error when retrieving categories : response.content = {content}")
 
         list_categories = []
         for category in categories:
@@ -48,95 +230,571 @@ class OpenFoodFactsAPI:
 
         return list_categories
 
-    def get_products(self) -> dict:
+    def _parse_categories_stream(self, status_code: int, chunks) -> list:
+        """
+        Same as _parse_categories, but the names are decoded while the chunks arrive
+        and the download stops once self.number_categories names are collected
+
+        :param status_code: HTTP status code of the response
+        :param chunks: iterator of the chunks of the response
+        :return: list of categories names
+
+        """
+        if status_code != 200:
+            chunks.close()
+            raise OpenFoodFactsException(f"Error when retrieving categories : Status code - {status_code}")
+
+        list_categories = []
+
+        try:
+            if self._number_categories:
+                for category in iter_array(chunks, 'tags'):
+                    list_categories.append(category['name'])
+                    if len(list_categories) >= self._number_categories:
+                        break
+        except (TypeError, KeyError, ValueError) as e:
+            raise OpenFoodFactsException(f"Error when retrieving categories : {e!r}")
+        finally:
+            chunks.close()
+
+        return list_categories
+
+    def _get_page(self, category: str, page_number: int, page_size=_PRODUCTS_BY_PAGE) -> list:
+        """
+        Get one page of raw products of a category from OFF. Called from the workers threads.
+
+        :param category: name of the category
+        :param page_number: number of the page, starting at 1
+        :param page_size: number of products by page
+        :return: list of products dict as sent by OFF, or a generator of them if self._stream_json
+
+        """
+        params = self._get_search_params(category, page_number, page_size)
+        # Since a watermark, a cached page of the most recently modified products would hide the newer changes
+        revalidate = self._modified_since is not None
+
+        if self._stream_json:
+            status_code, chunks = self._request(self._PRODUCTS_URL, params, stream=True, revalidate=revalidate)
+            return self._iter_products(category, status_code, chunks)
+
+        status_code, content = self._request(self._PRODUCTS_URL, params, revalidate=revalidate)
+
+        with self.metrics.timer('parse'):
+            return self._parse_products(category, status_code, content)
+
+    def _get_search_params(self, category: str, page_number: int, page_size=_PRODUCTS_BY_PAGE) -> dict:
+        """
+        Get the search.pl parameters of one page of French products of a category
+
+        :param category: name of the category
+        :param page_number: number of the page, starting at 1
+        :param page_size: number of products by page
+        :return: dict of params
+
+        """
+        # Most recently modified first, to stop at the products not modified since the last sync
+        sort_by = 'unique_scans_n' if self._modified_since is None else 'last_modified_t'
+
+        # Filtering products
+        params = {
+            'action': 'process',
+            'tagtype_0': 'countries',
+            'tag_contains_0': 'contains',
+            'tag_0': 'fr',
+            'tagtype_1': 'languages',
+            'tag_contains_1': 'contains',
+            'tag_1': 'fr',
+            'tagtype_2': 'categories',
+            'tag_contains_2': 'contains',
+            'tag_2': category,
+            'sort_by': sort_by,
+            'page_size': str(page_size),
+            'page': str(page_number),
+            'json': 'true',
+            'fields': self._PRODUCT_FIELDS
+        }
+
+        return params
+
+    @staticmethod
+    def _parse_products(category: str, status_code: int, content) -> list:
+        """
+        Check a search.pl response and get its raw products
+
+        :param category: name of the category
+        :param status_code: HTTP status code of the response
+        :param content: raw content of the response
+        :return: list of products dict as sent by OFF
+
         """
-        Get generator of products dictionary with name/category/image_url/nutriscore/ingredients_image_url/code
+        if not content or status_code != 200:
+            raise OpenFoodFactsException(f"Error when retrieving products from category : {category}, "
+                                         f"status_code - {status_code}")
+
+        try:
+            response_json = json.loads(content)
+            products = response_json['products']
+        except (TypeError, KeyError):
+            raise OpenFoodFactsException(f"Error when retrieving products from category : {category}, "
+                                         f"response.content - {content}")
+
+        return products
 
+    def get_products(self, resume=None, known_names=(), on_progress=None) -> dict:
+        """
+        Get generator of products dictionary with name/category/image_url/nutriscore/ingredients_image_url/code.
+        With modified_since, only the products modified after it, by category until the first older one.
+
+        The first page of the upcoming categories is fetched by a pool of self._max_workers threads
+        while the current category is processed. Products are still yielded category by category,
+        in the same order and with the same deduplication as a sequential run.
+
+        :param resume: dict of category name -> Progress saved by a previous run, to start from
+        :param known_names: names already in the DB, never yielded
+        :param on_progress: called with the category name and its Progress once every product
+                            of a page has been yielded, to checkpoint the run
         :return: product dict
 
         """
-        unique_products = set()
-
-        for category in self.categories:
-            products_added = 0
-            page_number = 1
-
-            while products_added < self._number_products_by_category:
-                # Filtering products
-                params = {
-                    'action': 'process',
-                    'tagtype_0': 'countries',
-                    'tag_contains_0': 'contains',
-                    'tag_0': 'fr',
-                    'tagtype_1': 'languages',
-                    'tag_contains_1': 'contains',
-                    'tag_1': 'fr',
-                    'tagtype_2': 'categories',
-                    'tag_contains_2': 'contains',
-                    'tag_2': category,
-                    'sort_by': 'unique_scans_n',
-                    'page_size': str(self._PRODUCTS_BY_PAGE),
-                    'page': str(page_number),
-                    'json': 'true',
-                    'fields': 'code,product_name_fr,image_url,'
-                              'nutriscore_score,nutriscore_grade,selected_images,'
-                              'countries_lc,categories_lc,labels_lc'
-                }
-
-                response = requests.get(self._PRODUCTS_URL, params=params)
-
-                if not response.content or response.status_code != 200:
-                    raise OpenFoodFactsException(f"Error when retrieving products from category : {category}, "
-                                                 f"status_code - {response.status_code}")
-
-                try:
-                    response_json = json.loads(response.content)
-                    products = response_json['products']
-                except (TypeError, KeyError):
-                    raise OpenFoodFactsException(f"Error when retrieving products from category : {category}, "
-                                                 f"response.content - {response.content}")
-
-                for product in products:
-                    if not self._check_product_is_fr(product):
-                        continue
-
-                    try:
-                        product_dict = {
-                            'code': product['code'],
-                            'name': html.unescape(product['product_name_fr']),
-                            'image_url': product['image_url'],
-                            'nutriscore': int(product['nutriscore_score']),
-                            'nutriscore_grade': product['nutriscore_grade'],
-                            'ingredients_image': product['selected_images']['ingredients']['display']['fr'],
-                            'category': category
-                        }
-                    except (KeyError, ValueError):
-                        continue
-
-                    # One value is missing or the grade is not valid
-                    # or product name is breaking 150 chars long constraint
-                    product_values = set(product_dict.values())
-                    if "" in product_values or not re.fullmatch("[a-eA-E]", product_dict['nutriscore_grade'])\
-                            or len(product_dict['name']) > 150:
-                        continue
-
-                    # Checking that the product is unique based on his name
-                    # To avoid breaking unicity constraint SQL side
-                    product_name = product_dict['name']
-                    if product_name in unique_products:
-                        continue
-                    else:
-                        unique_products.add(product_name)
-
-                    yield product_dict
-
-                    # To stop if we reach the number of products required
-                    products_added += 1
-                    if products_added == self._number_products_by_category:
+        unique_products = set(known_names)
+        resume = resume or {}
+        # Share of the products passing the filters, feeding the size of the pages
+        self._products_seen = 0
+        self._products_accepted = 0
+
+        if self._number_products_by_category <= 0:
+            return
+
+        categories = [category for category in self.categories
+                      if category not in resume or not resume[category].completed]
+
+        executor = ThreadPoolExecutor(max_workers=self._max_workers)
+        first_pages = deque()
+        upcoming_categories = iter(categories)
+
+        for category in upcoming_categories:
+            first_pages.append(self._submit_first_page(executor, category, resume.get(category)))
+            if len(first_pages) == self._max_workers:
+                break
+
+        try:
+            for category in categories:
+                page = first_pages.popleft()
+
+                # Keeping the workers busy with the next category
+                for next_category in upcoming_categories:
+                    first_pages.append(self._submit_first_page(executor, next_category, resume.get(next_category)))
+                    break
+
+                products_added = resume[category].products_added if category in resume else 0
+                yield from self._get_category_products(category, page, executor, unique_products,
+                                                       products_added, on_progress)
+        finally:
+            # The consumer may stop before the end, pending pages are not needed anymore
+            for page in first_pages:
+                page.future.cancel()
+            executor.shutdown(wait=False)
+
+    def get_products_by_code(self, codes) -> dict:
+        """
+        Get generator of the products dictionary of some barcodes, in the order of the codes,
+        from the OFF product endpoint and validated like get_products(). The products
+        not found or not valid are skipped, 'category' is None as it is not searched.
+
+        The codes are consumed while the products are fetched by self._max_workers threads,
+        never more than twice that number of products being requested in advance.
+
+        :param codes: iterable of barcodes, e.g. the codes of the products in the DB
+        :return: product dict
+
+        """
+        executor = ThreadPoolExecutor(max_workers=self._max_workers)
+        futures = deque()
+
+        try:
+            for code in codes:
+                futures.append(executor.submit(self._get_product, code))
+                if len(futures) >= 2 * self._max_workers:
+                    yield from self._get_product_result(futures.popleft())
+
+            while futures:
+                yield from self._get_product_result(futures.popleft())
+        finally:
+            for future in futures:
+                future.cancel()
+            executor.shutdown(wait=False)
+
+    def _get_product_result(self, future):
+        product = future.result()
+        if product is None:
+            return
+
+        start = time.perf_counter()
+        product_dict, reason = self._validate_product(product, None)
+        self._add_validation_metrics(time.perf_counter() - start, 1, Counter([reason] if reason else []))
+
+        if product_dict is not None:
+            yield product_dict
+
+    def _get_product(self, code):
+        """
+        Get one raw product from the OFF product endpoint. Called from the workers threads.
+
+        :param code: barcode of the product
+        :return: product dict as sent by OFF or None if OFF doesn't know it
+
+        """
+        status_code, content = self._request(f"{self._PRODUCT_URL}{code}.json", {'fields': self._PRODUCT_FIELDS})
+
+        if status_code == 404:
+            return None
+
+        if not content or status_code != 200:
+            raise OpenFoodFactsException(f"Error when retrieving product : {code}, status_code - {status_code}")
+
+        try:
+            with self.metrics.timer('parse'):
+                response_json = json.loads(content)
+            # status 0: product not found
+            return response_json['product'] if response_json.get('status') == 1 else None
+        except (TypeError, KeyError, AttributeError):
+            raise OpenFoodFactsException(f"Error when retrieving product : {code}, response.content - {content}")
+
+    def _submit_first_page(self, executor, category: str, progress=None) -> Page:
+        """
+        Request the first page of a category, or the first page after a saved Progress
+
+        :param executor: ThreadPoolExecutor fetching the pages
+        :param category: name of the category
+        :param progress: Progress of the category saved by a previous run, if any
+        :return: Page
+
+        """
+        offset, products_added = (progress.offset, progress.products_added) if progress else (0, 0)
+
+        # The biggest page size aligned on the offset
+        max_page_size = next((size for size in self._PAGE_SIZES if offset % size == 0), 1)
+
+        # Before any product is filtered, the rate of the whole run is the only estimate
+        products_to_request = (self._number_products_by_category - products_added) / self._get_acceptance_rate(0, 0)
+
+        return self._submit_page(executor, category, offset, products_to_request, max_page_size)
+
+    def _get_category_products(self, category: str, page: Page, executor, unique_products: set,
+                               products_added=0, on_progress=None) -> dict:
+        """
+        Get generator of the valid and unique products of a category, until self._number_products_by_category.
+        The next page is requested before the current one is filtered when the current one is not likely enough.
+
+        :param category: name of the category
+        :param page: first Page of the category
+        :param executor: ThreadPoolExecutor fetching the pages
+        :param unique_products: set of the names already yielded
+        :param products_added: products of the category yielded by a previous run
+        :param on_progress: callback of get_products()
+        :return: product dict
+
+        """
+        products_seen = 0
+        products_accepted = 0
+        next_page = None
+        # Incremental runs: any page may be the last one, the next one is only requested once this one is full
+        is_unbounded = self._number_products_by_category == float('inf')
+        # Added to self.metrics once the category is over, the loop stays cheap
+        products_validated = 0
+        validate_seconds = 0.0
+        rejections = Counter()
+
+        try:
+            while True:
+                remaining = self._number_products_by_category - products_added
+                if remaining <= 0:
+                    page.future.cancel()
+                    break
+
+                acceptance_rate = self._get_acceptance_rate(products_seen, products_accepted)
+                expected = acceptance_rate * page.page_size
+
+                # Pipelining the next page if this one is not likely to be enough, unless it is already the last one
+                if remaining > expected and not is_unbounded and not self._is_last_page(page):
+                    next_page = self._submit_page(executor, category, page.offset + page.page_size,
+                                                  (remaining - expected) / acceptance_rate, page.page_size)
+
+                page_length = 0
+                is_up_to_date = False
+                is_quota_reached = False
+                page_products = iter(page.future.result())
+
+                while not (is_up_to_date or is_quota_reached):
+                    products = list(islice(page_products, self._VALIDATE_BATCH_SIZE))
+                    if not products:
                         break
+                    page_length += len(products)
+                    if is_unbounded and next_page is None and page_length >= page.page_size:
+                        next_page = self._submit_page(executor, category, page.offset + page.page_size,
+                                                      page.page_size, page.page_size)
+
+                    # The batch is validated at once, up to the first product not modified since the watermark
+                    last_modified = [self._get_last_modified_t(product) for product in products]
+                    number_modified = len(products) if self._modified_since is None else \
+                        next((index for index, last_modified_t in enumerate(last_modified)
+                              if last_modified_t <= self._modified_since), len(products))
+                    start = time.perf_counter()
+                    validated = self._validate_page(products[:number_modified], [category] * number_modified)
+                    validate_seconds += time.perf_counter() - start
+                    products_validated += number_modified
+                    rejections.update(reason for _, reason in validated if reason is not None)
+
+                    for index, last_modified_t in enumerate(last_modified):
+                        products_seen += 1
+                        self._products_seen += 1
+
+                        if last_modified_t > (self.last_modified_t or 0):
+                            self.last_modified_t = last_modified_t
+                        if index == number_modified:
+                            is_up_to_date = True
+                            break
+
+                        product_dict = validated[index][0]
+                        if product_dict is None:
+                            continue
+
+                        # Checking that the product is unique based on his name
+                        # To avoid breaking unicity constraint SQL side
+                        product_name = product_dict['name']
+                        if product_name in unique_products:
+                            rejections['duplicate'] += 1
+                            continue
+                        else:
+                            unique_products.add(product_name)
+
+                        products_accepted += 1
+                        self._products_accepted += 1
+
+                        yield product_dict
+
+                        # To stop if we reach the number of products required
+                        products_added += 1
+                        if products_added == self._number_products_by_category:
+                            is_quota_reached = True
+                            break
+
+                # A page not full is the last one of the category
+                if products_added >= self._number_products_by_category or page_length < page.page_size \
+                        or is_up_to_date:
+                    break
+
+                if on_progress is not None:
+                    on_progress(category, Progress(page.offset + page.page_size, products_added, False))
 
                 # We don't reach the target number of products so we go to the next page
-                page_number += 1
+                if next_page is None:
+                    remaining = self._number_products_by_category - products_added
+                    acceptance_rate = self._get_acceptance_rate(products_seen, products_accepted)
+                    next_page = self._submit_page(executor, category, page.offset + page.page_size,
+                                                  remaining / acceptance_rate, page.page_size)
+                page, next_page = next_page, None
+        finally:
+            if next_page is not None:
+                next_page.future.cancel()
+            self._add_validation_metrics(validate_seconds, products_validated, rejections)
+
+        if on_progress is not None:
+            on_progress(category, Progress(page.offset + page.page_size, products_added, True))
+
+    @staticmethod
+    def _is_last_page(page: Page) -> bool:
+        """
+        Return True if the page is already received with less products than its size, ending its category
+
+        :param page: Page
+        :return: bool - last page
+
+        """
+        if not page.future.done() or page.future.exception() is not None:
+            return False
+
+        products = page.future.result()
+
+        return isinstance(products, list) and len(products) < page.page_size
+
+    @staticmethod
+    def _get_last_modified_t(product: dict) -> int:
+        """
+        Get the last modification timestamp of a raw product, 0 if unknown
+
+        :param product: dict of the product as sent by OFF
+        :return: int - timestamp
+
+        """
+        try:
+            return int(product.get('last_modified_t') or 0)
+        except (TypeError, ValueError):
+            return 0
+
+    def _get_acceptance_rate(self, products_seen: int, products_accepted: int) -> float:
+        """
+        Estimate the share of the products of a category passing the filters.
+        The rate of the whole run so far is used as a prior for the categories barely seen
+
+        :param products_seen: products of the category already filtered
+        :param products_accepted: products of the category yielded
+        :return: float between 0 and 1
+
+        """
+        prior = (self._products_accepted + 1) / (self._products_seen + 2)
+
+        return (products_accepted + 2 * prior) / (products_seen + 2)
+
+    def _submit_page(self, executor, category: str, offset: int, products_to_request: float,
+                     max_page_size=_PRODUCTS_BY_PAGE) -> Page:
+        """
+        Request the page of a category starting at offset, the smallest one holding products_to_request
+
+        :param executor: ThreadPoolExecutor fetching the pages
+        :param category: name of the category
+        :param offset: number of products of the category already requested
+        :param products_to_request: products needed divided by the acceptance rate
+        :param max_page_size: size of the previous page of the category, the pages never grow
+        :return: Page
+
+        """
+        page_size = max_page_size
+        for size in self._PAGE_SIZES:
+            if products_to_request <= size <= max_page_size:
+                page_size = size
+
+        future = executor.submit(self._get_page, category, offset // page_size + 1, page_size)
+
+        return Page(offset, page_size, future)
+
+    @staticmethod
+    def _iter_products(category: str, status_code: int, chunks):
+        """
+        Same as _parse_products, but the products are yielded while the chunks of the page arrive
+
+        :param category: name of the category
+        :param status_code: HTTP status code of the response
+        :param chunks: iterator of the chunks of the response
+        :return: products dict as sent by OFF
+
+        """
+        try:
+            if status_code != 200:
+                raise OpenFoodFactsException(f"Error when retrieving products from category : {category}, "
+                                             f"status_code - {status_code}")
+
+            try:
+                yield from iter_array(chunks, 'products')
+            except (TypeError, KeyError, ValueError) as e:
+                raise OpenFoodFactsException(f"Error when retrieving products from category : {category}, "
+                                             f"{e!r}")
+
+            # Reading the end of the page so that it can be cached
+            for _ in chunks:
+                pass
+        finally:
+            chunks.close()
+
+    def _add_validation_metrics(self, seconds: float, number_products: int, rejections: Counter) -> None:
+        """
+        Add products validated to the 'validate' stage of self.metrics, and their rejections by rule
+
+        :param seconds: time spent validating
+        :param number_products: number of products validated
+        :param rejections: Counter of rule -> number of products rejected
+        :return: None
+
+        """
+        self.metrics.add_time('validate', seconds, number_products)
+
+        for reason, number in rejections.items():
+            self.metrics.count(f'rejected_{reason}', number)
+
+    @classmethod
+    def _get_product_dict(cls, product: dict, category: str):
+        """
+        Get the product dict as saved in the DB from a raw OFF product, if the product is valid
+
+        :param product: dict of the product as sent by OFF
+        :param category: name of the category
+        :return: product dict or None if the product is not valid
+
+        """
+        return cls._validate_product(product, category)[0]
+
+    @classmethod
+    def _validate_product(cls, product: dict, category: str) -> tuple:
+        """
+        Same as _get_product_dict, along with the rule rejecting the product. A product breaking
+        several rules is rejected by the first one of 'missing_field', 'bad_grade', 'name_too_long'
+        and 'not_french', the costly French check coming last
+
+        :param product: dict of the product as sent by OFF
+        :param category: name of the category
+        :return: tuple of the product dict and None, or None and the rule
+
+        """
+        # One value is missing
+        get = product.get
+        code, name, image_url, score, grade = get('code', ""), get('product_name_fr', ""), \
+            get('image_url', ""), get('nutriscore_score', ""), get('nutriscore_grade', "")
+        ingredients_image = cls._get_ingredients_image(product)
+        if "" in (code, name, image_url, score, grade, ingredients_image, category) or type(name) is not str:
+            return None, 'missing_field'
+        if type(score) is not int:
+            score = cls._get_int(score)
+            if score is None:
+                return None, 'missing_field'
+
+        # The grade is not valid
+        if grade not in cls._GRADES:
+            return None, 'bad_grade'
+
+        # Product name is breaking 150 chars long constraint
+        name = html.unescape(name)
+        if len(name) > 150:
+            return None, 'name_too_long'
+
+        if not cls._check_product_is_fr(product):
+            return None, 'not_french'
+
+        return {
+            'code': code,
+            'name': name,
+            'image_url': image_url,
+            'nutriscore': score,
+            'nutriscore_grade': grade,
+            'ingredients_image': ingredients_image,
+            'category': category
+        }, None
+
+    @classmethod
+    def _validate_page(cls, products: list, categories: list) -> list:
+        """
+        Validate a batch of raw OFF products in a single pass, see _validate_product
+
+        :param products: list of products dict as sent by OFF
+        :param categories: name of the category of each product
+        :return: list of tuples of the product dict and None, or None and the rule, in the order of products
+
+        """
+        validate = cls._validate_product
+        return [validate(product, category) for product, category in zip(products, categories)]
+
+    @staticmethod
+    def _get_int(value):
+        try:
+            return int(value)
+        except (TypeError, ValueError):
+            return None
+
+    @staticmethod
+    def _get_ingredients_image(product: dict):
+        try:
+            return product['selected_images']['ingredients']['display']['fr']
+        except (KeyError, TypeError):
+            return ""
 
     @staticmethod
     def _check_product_is_fr(product: dict) -> bool:
@@ -154,12 +812,3 @@ class OpenFoodFactsAPI:
 
         return True
 
-
-if __name__ == "__main__":
-    import timeit
-    api = OpenFoodFactsAPI(number_categories=10, number_products_by_category=100)
-
-    print(timeit.timeit("for prod in api.get_products(): print(prod)", globals=globals(), number=1))
-    # for prod in api.get_products():
-    #     print(prod)
-
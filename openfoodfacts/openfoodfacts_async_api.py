@@ -0,0 +1,142 @@
+import asyncio
+from collections import deque
+
+import aiohttp
+
+from .openfoodfacts_api import OpenFoodFactsAPI
+
+
+class AsyncOpenFoodFactsAPI(OpenFoodFactsAPI):
+    """
+    Asyncio version of OpenFoodFactsAPI. All the search.pl requests are multiplexed on one event loop,
+    with at most self._concurrency requests in flight. Products are validated exactly like the sync client.
+
+    Categories are retrieved when get_products() starts if none are given:
+
+        api = AsyncOpenFoodFactsAPI(10, 100)
+        async for product in api.get_products():
+            ...
+
+    """
+    _CONCURRENCY = 20
+
+    def __init__(self, number_categories, number_products_by_category, categories=None, concurrency=_CONCURRENCY):
+        self._number_categories = number_categories
+        self._number_products_by_category = number_products_by_category
+        self._modified_since = None
+        self._concurrency = concurrency
+        self._semaphore = None
+        self._session = None
+        self.categories = categories
+
+    async def _fetch(self, url: str, params: dict) -> tuple:
+        """
+        GET url, never more than self._concurrency at the same time
+
+        :param url: url to get
+        :param params: dict of query params
+        :return: tuple of the status code and the raw content of the response
+
+        """
+        async with self._semaphore:
+            async with self._session.get(url, params=params) as response:
+                content = await response.read()
+
+        return response.status, content
+
+    async def _get_categories(self) -> list:
+        """
+        Get self.number_categories categories from OFF
+
+        :return: list of categories names
+
+        """
+        params = {
+            "json": "true"
+        }
+
+        status_code, content = await self._fetch(self._OFF_URL + "categories", params)
+
+        return self._parse_categories(status_code, content)
+
+    async def _get_page(self, category: str, page_number: int) -> list:
+        """
+        Get one page of raw products of a category from OFF
+
+        :param category: name of the category
+        :param page_number: number of the page, starting at 1
+        :return: list of products dict as sent by OFF
+
+        """
+        params = self._get_search_params(category, page_number)
+
+        status_code, content = await self._fetch(self._PRODUCTS_URL, params)
+
+        return self._parse_products(category, status_code, content)
+
+    async def get_products(self) -> dict:
+        """
+        Get async generator of products dictionary with name/category/image_url/nutriscore/ingredients_image_url/code
+
+        The first pages of the next self._concurrency categories are requested while the current one is processed.
+        Products are yielded category by category, with the same order and deduplication as OpenFoodFactsAPI.
+
+        :return: product dict
+
+        """
+        unique_products = set()
+        self._semaphore = asyncio.Semaphore(self._concurrency)
+        connector = aiohttp.TCPConnector(limit=self._concurrency)
+
+        async with aiohttp.ClientSession(connector=connector) as self._session:
+            if not self.categories:
+                self.categories = await self._get_categories()
+
+            first_pages = deque()
+            upcoming_categories = iter(self.categories)
+
+            for category in upcoming_categories:
+                first_pages.append(asyncio.ensure_future(self._get_page(category, 1)))
+                if len(first_pages) == self._concurrency:
+                    break
+
+            try:
+                for category in self.categories:
+                    products_added = 0
+                    page_number = 1
+                    products = await first_pages.popleft()
+
+                    for next_category in upcoming_categories:
+                        first_pages.append(asyncio.ensure_future(self._get_page(next_category, 1)))
+                        break
+
+                    while products_added < self._number_products_by_category:
+                        if page_number > 1:
+                            products = await self._get_page(category, page_number)
+
+                        # No more products in this category
+                        if not products:
+                            break
+
+                        for product_dict, _ in self._validate_page(products, [category] * len(products)):
+                            if product_dict is None:
+                                continue
+
+                            # Same unicity on the name as the sync client
+                            product_name = product_dict['name']
+                            if product_name in unique_products:
+                                continue
+                            else:
+                                unique_products.add(product_name)
+
+                            yield product_dict
+
+                            products_added += 1
+                            if products_added == self._number_products_by_category:
+                                break
+
+                        page_number += 1
+            finally:
+                for future in first_pages:
+                    future.cancel()
+                await asyncio.gather(*first_pages, return_exceptions=True)
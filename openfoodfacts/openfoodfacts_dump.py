@@ -0,0 +1,194 @@
+import bz2
+import csv
+import gzip
+import json
+import time
+from collections import Counter
+from itertools import islice
+
+from .metrics import Metrics
+from .openfoodfacts_api import OpenFoodFactsAPI, OpenFoodFactsException
+
+
+class OpenFoodFactsDump:
+    """
+    Same interface as OpenFoodFactsAPI (categories and get_products()) over a local OFF export,
+    JSONL (one product by line) or CSV (tab separated), compressed with gzip or bz2 or not.
+    The file is read line by line so the memory used doesn't depend on its size.
+
+    """
+    _CSV_FIELD_SIZE_LIMIT = 10 * 1024 * 1024
+    # Products read and validated at once
+    _BATCH_SIZE = 1000
+
+    def __init__(self, path, categories=None, number_products_by_category=None, modified_since=None,
+                 metrics=None):
+        self.path = path
+        self.metrics = metrics or Metrics()
+        self._number_products_by_category = number_products_by_category
+        self._modified_since = modified_since
+        # Most recent last_modified_t of the products read by get_products()
+        self.last_modified_t = None
+        self._filters = {category.lower(): category for category in categories or []}
+        self.categories = list(categories or [])
+
+    def _open(self):
+        if self.path.endswith(".gz"):
+            return gzip.open(self.path, "rt", encoding="utf-8", newline="")
+        if self.path.endswith(".bz2"):
+            return bz2.open(self.path, "rt", encoding="utf-8", newline="")
+
+        return open(self.path, "r", encoding="utf-8", newline="")
+
+    def _is_csv(self) -> bool:
+        path = self.path.rsplit(".", 1)[0] if self.path.endswith((".gz", ".bz2")) else self.path
+        return path.endswith((".csv", ".tsv"))
+
+    def _iter_raw_products(self):
+        """
+        Get generator of the products of the dump, with the same keys as the search.pl products
+
+        :return: product dict
+
+        """
+        with self._open() as f:
+            if self._is_csv():
+                csv.field_size_limit(self._CSV_FIELD_SIZE_LIMIT)
+                for row in csv.DictReader(f, delimiter="\t", quoting=csv.QUOTE_NONE):
+                    yield self._csv_row_to_product(row)
+            else:
+                for line_number, line in enumerate(f, start=1):
+                    if not line.strip():
+                        continue
+                    try:
+                        yield json.loads(line)
+                    except ValueError:
+                        raise OpenFoodFactsException(f"Error when reading {self.path} : line {line_number} "
+                                                     f"is not valid JSON")
+
+    @staticmethod
+    def _csv_row_to_product(row: dict) -> dict:
+        """
+        Get a CSV export row in the shape of a search.pl product. The CSV export has no *_lc columns,
+        the French check relies on the countries tags and the language of the product instead
+
+        :param row: dict of the row
+        :return: product dict
+
+        """
+        lang = row.get('lang') or ""
+        is_sold_in_france = "en:france" in (row.get('countries_tags') or "").split(",")
+
+        return {
+            'code': row.get('code') or "",
+            'product_name_fr': row.get('product_name_fr') or (row.get('product_name') if lang == "fr" else ""),
+            'image_url': row.get('image_url') or "",
+            'nutriscore_score': row.get('nutriscore_score') or "",
+            'nutriscore_grade': row.get('nutriscore_grade') or "",
+            'selected_images': {'ingredients': {'display': {'fr': row.get('image_ingredients_url') or ""}}},
+            'countries_lc': lang if is_sold_in_france else "",
+            'categories_lc': lang,
+            'labels_lc': lang,
+            'categories': row.get('categories') or "",
+            'last_modified_t': row.get('last_modified_t') or "",
+        }
+
+    def _get_category(self, product: dict):
+        """
+        Get the category of a product: the first of the filters it belongs to,
+        or its most specific category if there is no filter
+
+        :param product: product dict
+        :return: name of the category or None
+
+        """
+        categories = [category.strip() for category in (product.get('categories') or "").split(",")
+                      if category.strip()]
+
+        if not self._filters:
+            return categories[-1] if categories else None
+
+        for category in categories:
+            category_filter = self._filters.get(category.lower())
+            if category_filter is not None:
+                return category_filter
+
+        return None
+
+    def get_products(self, known_names=()) -> dict:
+        """
+        Get generator of products dictionary with name/category/image_url/nutriscore/ingredients_image_url/code,
+        validated and deduplicated like OpenFoodFactsAPI.get_products().
+        With modified_since, only the products modified after it.
+        The products are read and validated by batches of self._BATCH_SIZE.
+
+        :param known_names: names already in the DB, never yielded
+        :return: product dict
+
+        """
+        unique_products = set(known_names)
+        products_added = Counter()
+        known_categories = set(self.categories)
+
+        # Reading, decompression and decoding of the lines
+        raw_products = self.metrics.timed(self._iter_raw_products(), 'parse')
+
+        while True:
+            batch = list(islice(raw_products, self._BATCH_SIZE))
+            if not batch:
+                break
+
+            products = []
+            categories = []
+            for product in batch:
+                # Codes are stored as bigint
+                if not str(product.get('code', "")).isdigit():
+                    continue
+
+                # The export is not sorted, every product is read
+                last_modified_t = OpenFoodFactsAPI._get_last_modified_t(product)
+                if last_modified_t > (self.last_modified_t or 0):
+                    self.last_modified_t = last_modified_t
+                if self._modified_since is not None and last_modified_t <= self._modified_since:
+                    continue
+
+                category = self._get_category(product)
+                if category is None:
+                    continue
+
+                if self._number_products_by_category is not None \
+                        and products_added[category] >= self._number_products_by_category:
+                    continue
+
+                products.append(product)
+                categories.append(category)
+
+            start = time.perf_counter()
+            validated = OpenFoodFactsAPI._validate_page(products, categories)
+            self.metrics.add_time('validate', time.perf_counter() - start, len(products))
+
+            for product_dict, reason in validated:
+                if product_dict is None:
+                    self.metrics.count(f'rejected_{reason}')
+                    continue
+
+                # The quota may be reached by the previous products of the batch
+                category = product_dict['category']
+                if self._number_products_by_category is not None \
+                        and products_added[category] >= self._number_products_by_category:
+                    continue
+
+                product_name = product_dict['name']
+                if product_name in unique_products:
+                    self.metrics.count('rejected_duplicate')
+                    continue
+                else:
+                    unique_products.add(product_name)
+
+                if category not in known_categories:
+                    known_categories.add(category)
+                    self.categories.append(category)
+
+                yield product_dict
+
+                products_added[category] += 1
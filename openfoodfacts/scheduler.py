@@ -0,0 +1,131 @@
+import random
+import threading
+import time
+
+
+class CircuitBreaker:
+    """
+    Opens after failure_threshold consecutive failures: no request is sent for reset_timeout seconds,
+    then a single trial request decides whether it closes again (success) or reopens (failure).
+
+    """
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self.times_opened = 0
+
+    def is_open(self) -> bool:
+        return self.opened_at is not None
+
+    def get_wait(self) -> float:
+        """
+        Get the seconds left before a trial request can be sent, 0 if closed
+
+        """
+        if self.opened_at is None:
+            return 0.0
+
+        return max(0.0, self.opened_at + self.reset_timeout - time.monotonic())
+
+    def record(self, success: bool) -> None:
+        if success:
+            self.consecutive_failures = 0
+            self.opened_at = None
+            return
+
+        self.consecutive_failures += 1
+        if self.opened_at is not None or self.consecutive_failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+            self.times_opened += 1
+
+
+class RequestScheduler:
+    """
+    Adaptive limit of the number of OFF requests in flight, shared by every thread of an OpenFoodFactsAPI.
+
+    AIMD: the limit grows by one request for every `limit` successes and is halved on each 429/5xx/network error.
+    Failed requests are retried after an exponential backoff with full jitter (or the Retry-After header).
+    A CircuitBreaker stops all the requests while the server keeps failing.
+
+    """
+    _MAX_RETRIES = 5
+    _BACKOFF_BASE = 0.5
+    _BACKOFF_MAX = 30.0
+
+    def __init__(self, max_concurrency, min_concurrency=1, max_retries=_MAX_RETRIES, backoff_base=_BACKOFF_BASE,
+                 backoff_max=_BACKOFF_MAX, circuit_breaker=None):
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = min_concurrency
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.circuit_breaker = circuit_breaker or CircuitBreaker()
+        self.limit = float(max_concurrency)
+        self.retries = 0
+        self._in_flight = 0
+        self._condition = threading.Condition()
+
+    def acquire(self) -> None:
+        """
+        Wait for a free slot under the current limit, and for the circuit to be closed or half open
+
+        :return: None
+
+        """
+        with self._condition:
+            while True:
+                wait = self.circuit_breaker.get_wait()
+                # Half open: only one trial request at a time
+                limit = 1 if self.circuit_breaker.is_open() else int(self.limit)
+
+                if not wait and self._in_flight < limit:
+                    self._in_flight += 1
+                    return
+
+                self._condition.wait(timeout=wait or None)
+
+    def release(self, success: bool) -> None:
+        """
+        Free the slot of a finished request and adapt the limit to its outcome
+
+        :param success: False for a 429/5xx response or a network error
+        :return: None
+
+        """
+        with self._condition:
+            self._in_flight -= 1
+            self.circuit_breaker.record(success)
+
+            if success:
+                self.limit = min(self.max_concurrency, self.limit + 1 / self.limit)
+            else:
+                self.limit = max(self.min_concurrency, self.limit / 2)
+
+            self._condition.notify_all()
+
+    def get_backoff(self, attempt: int, retry_after=None) -> float:
+        """
+        Get the seconds to wait before retrying
+
+        :param attempt: number of the failed attempt, starting at 0
+        :param retry_after: value of the Retry-After header if any
+        :return: float - seconds
+
+        """
+        with self._condition:
+            self.retries += 1
+
+        delay = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+        try:
+            delay = max(delay, min(self.backoff_max, float(retry_after)))
+        except (TypeError, ValueError):
+            pass
+
+        return delay
+
+    def get_stats(self) -> str:
+        return f"{self.retries} retries, concurrency limit {self.limit:.1f}/{self.max_concurrency}, " \
+               f"circuit opened {self.circuit_breaker.times_opened} times"
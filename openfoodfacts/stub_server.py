@@ -0,0 +1,248 @@
+import gzip
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+
+class _StubHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        stub = self.server.stub
+        status, body = stub.get_response(self.path)
+
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        if status == 429:
+            self.send_header("Retry-After", "0")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class OFFStubServer:
+    """
+    Local HTTP server answering /categories, /cgi/search.pl and /api/v0/product/ like OpenFoodFacts,
+    with injected latency and errors.
+    Use it as a context manager and give its url to OpenFoodFactsAPI(off_url=...).
+    It replays the responses recorded by record_fixtures() with OFFStubServer.from_fixtures().
+
+    :param categories: list of categories names
+    :param products: dict of category name -> list of products dict as sent by OFF
+    :param latency: seconds added to every response
+    :param fail_first: number of first requests answered with error_status
+    :param error_rate: probability of answering any other request with error_status
+    :param error_status: HTTP status of the injected errors
+
+    """
+    def __init__(self, categories=(), products=None, latency=0.0, fail_first=0, error_rate=0.0, error_status=503,
+                 seed=0):
+        self.categories = list(categories)
+        self.products = products or {}
+        self.latency = latency
+        self.fail_first = fail_first
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.requests_count = 0
+        self.errors_count = 0
+        self.search_requests = []
+        self._products_by_code = None
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server = None
+        self._thread = None
+
+    @classmethod
+    def from_fixtures(cls, path: str, **kwargs):
+        """
+        Get a server replaying the fixtures file saved by save_fixtures()
+
+        :param path: path of the fixtures file
+        :param kwargs: other arguments of OFFStubServer
+        :return: OFFStubServer
+
+        """
+        fixtures = load_fixtures(path)
+
+        return cls(fixtures['categories'], fixtures['products'], **kwargs)
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/"
+
+    def __enter__(self):
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), _StubHandler)
+        self._server.daemon_threads = True
+        self._server.stub = self
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+
+    def get_response(self, path: str) -> tuple:
+        """
+        Get the status and the body answering a GET path
+
+        :param path: path and query string of the request
+        :return: tuple of the status code and the body bytes
+
+        """
+        with self._lock:
+            self.requests_count += 1
+            is_error = self.requests_count <= self.fail_first or self._random.random() < self.error_rate
+            if is_error:
+                self.errors_count += 1
+
+        if self.latency:
+            time.sleep(self.latency)
+
+        if is_error:
+            return self.error_status, json.dumps({"error": "injected"}).encode()
+
+        url = urlparse(path)
+        params = {key: values[0] for key, values in parse_qs(url.query).items()}
+
+        if url.path == "/categories":
+            body = {"count": len(self.categories), "tags": [{"name": name} for name in self.categories]}
+        elif url.path == "/cgi/search.pl":
+            body = self.get_search_page(params)
+        elif url.path.startswith("/api/v0/product/"):
+            body = self.get_product(url.path[len("/api/v0/product/"):].replace(".json", ""))
+        else:
+            return 404, b"{}"
+
+        return 200, json.dumps(body).encode()
+
+    def get_search_page(self, params: dict) -> dict:
+        products = self.products.get(params.get('tag_2'), [])
+        if params.get('sort_by') == 'last_modified_t':
+            products = sorted(products, key=lambda product: product.get('last_modified_t', 0), reverse=True)
+        page_size = int(params.get('page_size', 24))
+        page = int(params.get('page', 1))
+
+        with self._lock:
+            self.search_requests.append((params.get('tag_2'), page, page_size))
+
+        skip = (page - 1) * page_size
+
+        return {
+            "count": len(products),
+            "page": page,
+            "page_size": page_size,
+            "skip": skip,
+            "products": products[skip:skip + page_size],
+        }
+
+    def get_product(self, code: str) -> dict:
+        with self._lock:
+            if self._products_by_code is None:
+                self._products_by_code = {str(product.get('code')): product
+                                          for products in self.products.values() for product in products}
+
+        product = self._products_by_code.get(code)
+        if product is None:
+            return {"code": code, "status": 0, "status_verbose": "product not found"}
+
+        return {"code": code, "status": 1, "status_verbose": "product found", "product": product}
+
+
+def save_fixtures(path: str, categories: list, products: dict) -> None:
+    """
+    Save categories and raw products in a gzipped JSON file replayable by OFFStubServer.from_fixtures()
+
+    :param path: path of the fixtures file
+    :param categories: list of categories names
+    :param products: dict of category name -> list of products dict as sent by OFF
+    :return: None
+
+    """
+    with gzip.open(path, "wt", encoding="utf-8") as f:
+        json.dump({"categories": categories, "products": products}, f)
+
+
+def load_fixtures(path: str) -> dict:
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def record_fixtures(path: str, number_categories: int, number_raw_products: int, off_url=None) -> None:
+    """
+    Record the search.pl responses of the live OpenFoodFacts API, filters not applied
+
+    :param path: path of the fixtures file
+    :param number_categories: number of categories to record
+    :param number_raw_products: number of raw products to record by category
+    :param off_url: url of the API if not the default one
+    :return: None
+
+    """
+    # Imported here so that the server can run without requests
+    from .openfoodfacts_api import OpenFoodFactsAPI
+
+    api = OpenFoodFactsAPI(number_categories, 0, off_url=off_url)
+    products = {}
+
+    for category in api.categories:
+        products[category] = []
+        page_number = 1
+
+        while len(products[category]) < number_raw_products:
+            page = api._get_page(category, page_number)
+            products[category].extend(page)
+            if len(page) < api._PRODUCTS_BY_PAGE:
+                break
+            page_number += 1
+
+    save_fixtures(path, api.categories, products)
+
+
+def make_synthetic_fixtures(number_categories: int, number_raw_products: int, invalid_rate=0.2, seed=0) -> dict:
+    """
+    Get generated categories and raw products, invalid_rate of them being rejected by the filters
+
+    :param number_categories: number of categories
+    :param number_raw_products: number of raw products by category
+    :param invalid_rate: share of products not French or with a missing/invalid value
+    :param seed: seed of the generation
+    :return: dict with the categories and products keys of a fixtures file
+
+    """
+    generator = random.Random(seed)
+    categories = [f"Catégorie {number}" for number in range(number_categories)]
+    products = {}
+
+    for category_number, category in enumerate(categories):
+        products[category] = []
+        for number in range(number_raw_products):
+            code = category_number * number_raw_products + number + 1
+            product = {
+                "code": str(code),
+                "product_name_fr": f"Produit {code} de la {category.lower()}",
+                "image_url": f"https://static.openfoodfacts.org/images/products/{code}/front_fr.jpg",
+                "nutriscore_score": generator.randint(-15, 40),
+                "nutriscore_grade": generator.choice("abcde"),
+                "countries_lc": "fr",
+                "categories_lc": "fr",
+                "labels_lc": "fr",
+                "selected_images": {"ingredients": {"display": {
+                    "fr": f"https://static.openfoodfacts.org/images/products/{code}/ingredients_fr.jpg"
+                }}},
+            }
+
+            if generator.random() < invalid_rate:
+                invalid_key, invalid_value = generator.choice([("countries_lc", "en"), ("nutriscore_grade", "z"),
+                                                               ("image_url", ""), ("nutriscore_score", "?")])
+                product[invalid_key] = invalid_value
+
+            products[category].append(product)
+
+    return {"categories": categories, "products": products}
@@ -0,0 +1,236 @@
+import os
+import re
+import sys
+import threading
+import time
+from array import array
+
+from django.conf import settings
+from django.db import connection
+
+from products.manager import ProductManager
+from products.text import normalize
+from products.models import CatalogVersion, Product
+
+
+class AutocompleteIndex:
+    """
+    In memory autocomplete over the normalized product names, a search matching the names
+    with a word starting with it. Ranked like ProductManager.search_autocomplete(): the names starting
+    with the search first, then the shortest ones, the worst nutriscores and the codes.
+
+    Every word start of every name is an entry of a sorted array, the entries starting with a search
+    being found by bisection. The top results of the prefixes matching more than _MAX_SCAN entries
+    are computed at build time, so that a search never ranks more than _MAX_SCAN entries.
+
+    """
+    _MAX_SCAN = 128
+    # Entries are product number * _OFFSETS + offset of the word in the normalized name (names <= 150 chars)
+    _OFFSETS = 256
+
+    def __init__(self, rows, min_length=ProductManager.AUTOCOMPLETE_MIN_LENGTH,
+                 limit=ProductManager.AUTOCOMPLETE_LIMIT):
+        """
+        Build the index
+
+        :param rows: iterable of (name, nutriscore, code) of the products, or (name, nutriscore, code, search_key)
+        :param min_length: nothing is searched under min_length characters
+        :param limit: number of names returned by a search
+
+        """
+        start = time.perf_counter()
+        self.min_length = min_length
+        self.limit = limit
+
+        rows = sorted(rows, key=lambda row: (len(row[0]), -row[1], row[2]))
+        # Products are numbered by rank, the lower the better
+        self._names = [row[0] for row in rows]
+        self._normalized = [row[3] if len(row) > 3 else normalize(row[0]) for row in rows]
+
+        entries = [number * self._OFFSETS + match.start()
+                   for number, name in enumerate(self._normalized)
+                   for match in re.finditer(r"\S+", name) if match.start() < self._OFFSETS]
+        entries.sort(key=self._get_key)
+        self._entries = array('Q', entries)
+        # The names starting with the search first
+        number_products = len(self._names)
+        self._values = array('Q', [entry // self._OFFSETS + (number_products if entry % self._OFFSETS else 0)
+                                   for entry in entries])
+        self._top = {}
+        self._compute_tops()
+
+        self.seconds = time.perf_counter() - start
+
+    @classmethod
+    def from_db(cls):
+        return cls(Product.objects.values_list('name', 'nutriscore', 'code', 'search_key')
+                                  .iterator(chunk_size=10000))
+
+    def _get_key(self, entry: int) -> str:
+        return self._normalized[entry // self._OFFSETS][entry % self._OFFSETS:]
+
+    def _bisect(self, text: str, low: int, high: int) -> int:
+        """
+        Get the first entry of [low, high[ whose key is not lower than text
+
+        """
+        while low < high:
+            middle = (low + high) // 2
+            if self._get_key(self._entries[middle]) < text:
+                low = middle + 1
+            else:
+                high = middle
+
+        return low
+
+    def _get_range(self, prefix: str, low=0, high=None) -> tuple:
+        high = len(self._entries) if high is None else high
+        low = self._bisect(prefix, low, high)
+
+        return low, self._bisect(prefix + "\U0010ffff", low, high)
+
+    def _rank(self, low: int, high: int) -> tuple:
+        """
+        Get the numbers of the best products of the entries [low, high[
+
+        """
+        number_products = len(self._names)
+        products = []
+        for value in sorted(self._values[low:high]):
+            number = value % number_products
+            if number not in products:
+                products.append(number)
+                if len(products) == self.limit:
+                    break
+
+        return tuple(products)
+
+    def _compute_tops(self) -> None:
+        """
+        Rank the prefixes of more than _MAX_SCAN entries, the longer prefixes being only looked for
+        inside the ranges of the shorter ones
+
+        """
+        ranges = [(0, len(self._entries), self.min_length)]
+
+        while ranges:
+            low, high, length = ranges.pop()
+            while low < high:
+                prefix = self._get_key(self._entries[low])[:length]
+                if len(prefix) < length:
+                    low += 1
+                    continue
+
+                _, end = self._get_range(prefix, low, high)
+                if end - low > self._MAX_SCAN:
+                    self._top[prefix] = self._rank(low, end)
+                    ranges.append((low, end, length + 1))
+                low = end
+
+    def search(self, user_search: str) -> list:
+        """
+        Get the names of the best products with a word starting with the search
+
+        :param user_search: text typed
+        :return: list of names
+
+        """
+        prefix = normalize(user_search)
+        if len(prefix) < self.min_length:
+            return []
+
+        products = self._top.get(prefix)
+        if products is None:
+            products = self._rank(*self._get_range(prefix))
+
+        return [self._names[number] for number in products]
+
+    def get_memory(self) -> int:
+        """
+        Get an estimate of the bytes used by the index
+
+        :return: int
+
+        """
+        size = sys.getsizeof(self._entries) + sys.getsizeof(self._values) + sys.getsizeof(self._top)
+        size += sys.getsizeof(self._names) + sum(sys.getsizeof(name) for name in self._names)
+        size += sys.getsizeof(self._normalized) + sum(sys.getsizeof(name) for name in self._normalized)
+        size += sum(sys.getsizeof(prefix) + sys.getsizeof(top) for prefix, top in self._top.items())
+
+        return size
+
+    def get_stats(self) -> str:
+        return f"{len(self._names)} products, {len(self._entries)} entries, {len(self._top)} ranked prefixes, " \
+               f"built in {self.seconds:.1f}s, {self.get_memory() / 1024 / 1024:.1f} MB"
+
+
+# Index of the current version of the catalog, replaced as a whole so that the searches never see a partial one
+_current = (None, None)
+_refresh_lock = threading.Lock()
+# Process running the refresh thread: threads do not survive a fork, e.g. of the workers of gunicorn --preload
+_started_pid = None
+_start_lock = threading.Lock()
+
+
+def get_index():
+    """
+    Get the index of the catalog, None until it is built. The first call of each process starts
+    the thread building it, if settings.AUTOCOMPLETE_INDEX
+
+    :return: AutocompleteIndex or None
+
+    """
+    if _started_pid != os.getpid() and settings.AUTOCOMPLETE_INDEX:
+        with _start_lock:
+            if _started_pid != os.getpid():
+                start(settings.AUTOCOMPLETE_INDEX_REFRESH_INTERVAL)
+
+    return _current[0]
+
+
+def refresh() -> bool:
+    """
+    Build a new index if the catalog changed since the current one, then swap it with the current one
+
+    :return: bool - index rebuilt
+
+    """
+    global _current
+
+    with _refresh_lock:
+        version = CatalogVersion.get_version()
+        if _current[0] is not None and _current[1] == version:
+            return False
+
+        _current = (AutocompleteIndex.from_db(), version)
+
+    return True
+
+
+def start(interval: float) -> threading.Thread:
+    """
+    Build the index in a background thread, then check the version of the catalog every interval seconds,
+    e.g. after a db_init or db_update. The searches use the DB until the first index is built.
+
+    :param interval: seconds between two checks
+    :return: threading.Thread
+
+    """
+    global _started_pid
+
+    def run():
+        while True:
+            try:
+                if refresh():
+                    print(f"Autocomplete index : {_current[0].get_stats()}")
+            except Exception as e:
+                print(f"Autocomplete index not refreshed : {e!r}")
+            finally:
+                connection.close()
+            time.sleep(interval)
+
+    _started_pid = os.getpid()
+    thread = threading.Thread(target=run, name="autocomplete-index", daemon=True)
+    thread.start()
+
+    return thread
@@ -0,0 +1,446 @@
+import csv
+import io
+import time
+
+from django.db import connection, transaction
+from django.utils import timezone
+from django.db.utils import IntegrityError
+
+from products.models import Category, Product
+from products.text import normalize
+
+
+class ProductLoader:
+    """
+    Batched writes of the products dict yielded by OpenFoodFactsAPI.get_products():
+    categories are resolved once and products are inserted by batch_size, a product whose code or name
+    is already in the DB being skipped by the batch instead of by its own IntegrityError.
+
+    """
+    _BATCH_SIZE = 1000
+
+    def __init__(self, batch_size=None):
+        self.batch_size = batch_size or self._BATCH_SIZE
+        self.categories = Category.objects.in_bulk(field_name='name')
+        self.batches = 0
+        # Rows sent to the DB, and rows actually written, the conflicts being skipped
+        self.sent = 0
+        self.rows = 0
+        self.seconds = 0.0
+        self._products = []
+        self._after_flush = []
+
+    def get_category(self, name: str) -> Category:
+        """
+        Get a category from its name, created the first time it is seen
+
+        :param name: name of the category
+        :return: Category
+
+        """
+        category = self.categories.get(name)
+        if category is None:
+            category = self.categories[name] = Category.objects.get_or_create(name=name)[0]
+
+        return category
+
+    def add(self, product: dict) -> None:
+        """
+        Buffer a product dict, the buffer is written once it holds batch_size products
+
+        :param product: product dict with the name of its category
+        :return: None
+
+        """
+        self._products.append(self._get_product(product, self.get_category(product['category'])))
+
+        if len(self._products) >= self.batch_size:
+            self.flush()
+
+    @staticmethod
+    def _get_product(product: dict, category: Category) -> Product:
+        """
+        Get the Product of a product dict, with the content_hash and search_key save() would give it
+
+        """
+        product = Product(**dict(product, category=category))
+        product.content_hash = Product.get_content_hash(product.__dict__)
+        product.search_key = normalize(product.name)
+
+        return product
+
+    @staticmethod
+    def _get_db_values(product: Product) -> list:
+        """
+        Get the values of the columns of a product as bulk_create() would insert them (e.g. updated_at)
+
+        """
+        return [field.get_db_prep_save(field.pre_save(product, add=True), connection)
+                for field in Product._meta.concrete_fields]
+
+    def after_flush(self, callback, *args) -> None:
+        """
+        Call callback(*args) once the products buffered until now are written
+
+        :return: None
+
+        """
+        self._after_flush.append((callback, args))
+
+    def flush(self) -> None:
+        if self._products:
+            start = time.perf_counter()
+            self.rows += self._write(self._products)
+            self.seconds += time.perf_counter() - start
+            self.sent += len(self._products)
+            self.batches += 1
+            self._products = []
+
+        after_flush, self._after_flush = self._after_flush, []
+        for callback, args in after_flush:
+            callback(*args)
+
+    def _write(self, products: list) -> int:
+        """
+        Insert a batch of products, the ones whose code or name is taken being skipped
+
+        :param products: list of Product
+        :return: int - number of rows inserted
+
+        """
+        # bulk_create() can't tell the rows skipped by ON CONFLICT DO NOTHING, the codes are counted on the pk index
+        codes = Product.objects.filter(code__in=[product.code for product in products])
+        codes_before = codes.count()
+        Product.objects.bulk_create(products, batch_size=self.batch_size, ignore_conflicts=True)
+
+        return codes.count() - codes_before
+
+    def get_stats(self) -> str:
+        rows_per_second = self.rows / self.seconds if self.seconds else 0.0
+        skipped = f", {self.sent - self.rows} skipped" if self.sent != self.rows else ""
+        return f"{self.rows} rows written in {self.batches} batches{skipped}, {rows_per_second:.0f} rows/s"
+
+
+class CopyProductLoader(ProductLoader):
+    """
+    ProductLoader for big catalogs, PostgreSQL only: each batch is sent with COPY FROM STDIN
+    to a temporary staging table, then merged into the products table by a single INSERT ... SELECT
+    skipping the rows whose code or name is already taken.
+
+    """
+    _BATCH_SIZE = 20000
+    _STAGING_TABLE = "products_product_staging"
+
+    def __init__(self, batch_size=None):
+        super().__init__(batch_size)
+        self._fields = Product._meta.concrete_fields
+        self._columns = ", ".join(connection.ops.quote_name(field.column) for field in self._fields)
+
+    def _write(self, products: list) -> int:
+        rows = io.StringIO()
+        writer = csv.writer(rows)
+        for product in products:
+            writer.writerow(self._get_db_values(product))
+        rows.seek(0)
+
+        table = connection.ops.quote_name(Product._meta.db_table)
+        staging_table = connection.ops.quote_name(self._STAGING_TABLE)
+
+        with transaction.atomic(), connection.cursor() as cursor:
+            # Kept by the connection for the next batches
+            cursor.execute(f"CREATE TEMPORARY TABLE IF NOT EXISTS {staging_table} "
+                           f"(LIKE {table} INCLUDING DEFAULTS) ON COMMIT DELETE ROWS")
+            cursor.execute(f"TRUNCATE {staging_table}")
+            cursor.copy_expert(f"COPY {staging_table} ({self._columns}) FROM STDIN WITH (FORMAT csv)", rows)
+            # A name or code taken by the DB or by a previous row of the batch is skipped
+            cursor.execute(f"INSERT INTO {table} ({self._columns}) "
+                           f"SELECT {self._columns} FROM {staging_table} "
+                           f"ON CONFLICT DO NOTHING")
+
+            return cursor.rowcount
+
+
+class ProductUpserter(ProductLoader):
+    """
+    Batched upserts keyed on the product code, PostgreSQL only: a batch creates its missing categories
+    and inserts or updates its products in one transaction, with a single INSERT ... ON CONFLICT (code)
+    DO UPDATE only touching the rows whose values changed. Running it again with the same products changes nothing.
+
+    A product whose name is already taken by another code, in the DB or earlier in the batch, is rejected.
+    A name taken by a concurrent writer between this check and the upsert makes the batch retried.
+    The category of a product already in the DB is kept, like ProductUpdater does.
+
+    """
+    # Compared through content_hash
+    _UPDATE_FIELDS = Product.CONTENT_FIELDS + ('content_hash', 'search_key', 'updated_at')
+    _RETRIES = 3
+
+    def __init__(self, batch_size=None):
+        super().__init__(batch_size)
+        self.inserted = 0
+        self.updated = 0
+        self.unchanged = 0
+        self.rejected = 0
+        self._fields = Product._meta.concrete_fields
+
+    def add(self, product: dict) -> None:
+        # Categories are resolved by the transaction of the batch
+        self._products.append(product)
+
+        if len(self._products) >= self.batch_size:
+            self.flush()
+
+    def _write(self, products: list) -> int:
+        # A code must appear once in an upsert, the most recent values are kept
+        products = list({int(product['code']): product for product in products}.values())
+
+        for attempt in range(1, self._RETRIES + 1):
+            try:
+                rows, inserted, categories = self._write_batch(products)
+                break
+            except IntegrityError:
+                # A concurrent writer (e.g. another catalog_sync) took one of the names after the check,
+                # the names are checked again by the next attempt
+                if attempt == self._RETRIES:
+                    raise
+
+        # Only known once the transaction is committed
+        self.categories.update(categories)
+        self.rejected += len(products) - len(rows)
+        self.inserted += inserted.count(True)
+        self.updated += inserted.count(False)
+        self.unchanged += len(rows) - len(inserted)
+
+        return len(inserted)
+
+    def _write_batch(self, products: list) -> tuple:
+        """
+        Create the missing categories and upsert the products whose name is not taken, in one transaction
+
+        :param products: list of product dicts, one by code
+        :return: tuple of the Product upserted, the list returned by _upsert() and the categories created
+
+        """
+        with transaction.atomic():
+            categories = dict(self.categories)
+            names = {product['category'] for product in products} - set(categories)
+            if names:
+                Category.objects.bulk_create([Category(name=name) for name in names], ignore_conflicts=True)
+                categories.update(Category.objects.in_bulk(list(names), field_name='name'))
+
+            products = self._reject_taken_names(products)
+            if not products:
+                return [], [], categories
+
+            rows = [self._get_product(product, categories[product['category']]) for product in products]
+
+            return rows, self._upsert(rows), categories
+
+    def _reject_taken_names(self, products: list) -> list:
+        """
+        Get the products whose name is free or already theirs
+
+        :param products: list of product dicts
+        :return: list of product dicts
+
+        """
+        owners = dict(Product.objects.filter(name__in=[product['name'] for product in products])
+                                     .values_list('name', 'code'))
+
+        accepted = []
+        for product in products:
+            if owners.setdefault(product['name'], int(product['code'])) != int(product['code']):
+                continue
+            accepted.append(product)
+
+        return accepted
+
+    def _upsert(self, rows: list) -> list:
+        """
+        INSERT ... ON CONFLICT (code) DO UPDATE the rows
+
+        :param rows: list of Product
+        :return: list of bool, True for an inserted row and False for an updated one, none for an unchanged one
+
+        """
+        quote_name = connection.ops.quote_name
+        table = quote_name(Product._meta.db_table)
+        columns = ", ".join(quote_name(field.column) for field in self._fields)
+        update_columns = [quote_name(Product._meta.get_field(name).column) for name in self._UPDATE_FIELDS]
+
+        placeholders = ", ".join(["(" + ", ".join(["%s"] * len(self._fields)) + ")"] * len(rows))
+        params = [value for row in rows for value in self._get_db_values(row)]
+
+        assignments = ", ".join(f"{column} = EXCLUDED.{column}" for column in update_columns)
+        content_hash = quote_name(Product._meta.get_field('content_hash').column)
+
+        with connection.cursor() as cursor:
+            # xmax is 0 for a row inserted by the statement
+            cursor.execute(f"INSERT INTO {table} ({columns}) VALUES {placeholders} "
+                           f"ON CONFLICT ({quote_name(Product._meta.pk.column)}) DO UPDATE SET {assignments} "
+                           f"WHERE {table}.{content_hash} IS DISTINCT FROM EXCLUDED.{content_hash} "
+                           f"RETURNING (xmax = 0)", params)
+
+            return [inserted for inserted, in cursor.fetchall()]
+
+
+LOADERS = {
+    'orm': ProductLoader,
+    'copy': CopyProductLoader,
+}
+
+
+class ProductUpdater:
+    """
+    Batched updates of the products already in the DB from the products dict of get_products():
+    each batch loads the content hashes of its DB rows with one narrow query, then only the changed rows,
+    compares their mutable fields in memory and writes them with one bulk_update by set of changed fields.
+    No product is added.
+
+    A new name already taken by another product, in the DB or earlier in the batch, is not applied,
+    the other changes of the product are.
+
+    """
+    _BATCH_SIZE = 1000
+    _FIELDS = Product.CONTENT_FIELDS
+    # Written along with the changed fields
+    _DERIVED_FIELDS = ('content_hash', 'search_key', 'updated_at')
+    _RETRIES = 3
+
+    def __init__(self, batch_size=None):
+        self.batch_size = batch_size or self._BATCH_SIZE
+        self.updated = 0
+        self.unchanged = 0
+        self.name_conflicts = 0
+        self.batches = 0
+        self.seconds = 0.0
+        self._products = {}
+
+    def add(self, product: dict) -> None:
+        """
+        Buffer a product dict, the buffer is compared to the DB once it holds batch_size products
+
+        :param product: product dict
+        :return: None
+
+        """
+        # Codes are strings in the OFF responses
+        self._products[int(product['code'])] = product
+
+        if len(self._products) >= self.batch_size:
+            self.flush()
+
+    def flush(self) -> None:
+        if not self._products:
+            return
+
+        api_products, self._products = self._products, {}
+        start = time.perf_counter()
+
+        try:
+            self._write(api_products)
+        finally:
+            self.seconds += time.perf_counter() - start
+            self.batches += 1
+
+    def _write(self, api_products: dict) -> None:
+        # Most products are unchanged, they only cost a narrow query on the hashes
+        hashes = Product.objects.get_content_hashes(codes=list(api_products))
+        changed_codes = [code for code, content_hash in hashes.items()
+                         if content_hash != Product.get_content_hash(api_products[code])]
+        self.unchanged += len(hashes) - len(changed_codes)
+        if not changed_codes:
+            return
+
+        db_products = Product.objects.in_bulk(changed_codes)
+        old_names = {code: db_product.name for code, db_product in db_products.items()}
+
+        changes = {}
+        for code, db_product in db_products.items():
+            api_product = api_products[code]
+            # Empty for a product whose stored hash is out of date, only its hash is rewritten
+            changes[code] = {field for field in self._FIELDS if getattr(db_product, field) != api_product[field]}
+
+        self._drop_name_conflicts(api_products, changes)
+
+        by_fields = {}
+        for code, changed_fields in changes.items():
+            self._apply(db_products[code], api_products[code], changed_fields)
+            by_fields.setdefault(tuple(sorted(changed_fields)), []).append(db_products[code])
+
+        for fields, products in by_fields.items():
+            name_conflicts = 0
+            for attempt in range(1, self._RETRIES + 1):
+                try:
+                    with transaction.atomic():
+                        Product.objects.bulk_update(products, fields + self._DERIVED_FIELDS)
+                    break
+                except IntegrityError:
+                    # A concurrent writer (e.g. another worker process) took some of the new names meanwhile,
+                    # only these are not applied by the next attempt
+                    reverted = self._revert_taken_names(products, old_names) if 'name' in fields else 0
+                    if not reverted or attempt == self._RETRIES:
+                        raise
+                    name_conflicts += reverted
+
+            self.name_conflicts += name_conflicts
+            # The products whose only change was a name taken meanwhile are left unchanged
+            if fields == ('name',):
+                self.updated += len(products) - name_conflicts
+            elif fields:
+                self.updated += len(products)
+
+    @staticmethod
+    def _apply(product: Product, values: dict, fields: set) -> None:
+        for field in fields:
+            setattr(product, field, values[field])
+        product.content_hash = Product.get_content_hash(product.__dict__)
+        product.search_key = normalize(product.name)
+        product.updated_at = timezone.now()
+
+    def _revert_taken_names(self, products: list, old_names: dict) -> int:
+        """
+        Give back their DB name to the products whose new name is now taken by another product
+
+        :param products: list of Product, updated in place
+        :param old_names: dict of code -> name in the DB
+        :return: number of products whose name was reverted
+
+        """
+        owners = dict(Product.objects.filter(name__in=[product.name for product in products])
+                                     .values_list('name', 'code'))
+
+        reverted = 0
+        for product in products:
+            if owners.get(product.name, product.code) != product.code:
+                self._apply(product, {'name': old_names[product.code]}, {'name'})
+                reverted += 1
+
+        return reverted
+
+    def _drop_name_conflicts(self, api_products: dict, changes: dict) -> None:
+        """
+        Remove from changes the new names already taken by another product
+
+        :param api_products: dict of code -> product dict of the batch
+        :param changes: dict of code -> set of the changed fields, updated in place
+        :return: None
+
+        """
+        renamed = [code for code, changed_fields in changes.items() if 'name' in changed_fields]
+        if not renamed:
+            return
+
+        # A name stays taken by its product even if it is renamed in the same batch
+        owners = dict(Product.objects.filter(name__in=[api_products[code]['name'] for code in renamed])
+                                     .values_list('name', 'code'))
+
+        for code in renamed:
+            name = api_products[code]['name']
+            if owners.setdefault(name, code) == code:
+                continue
+
+            self.name_conflicts += 1
+            changes[code].discard('name')
+            if not changes[code]:
+                del changes[code]
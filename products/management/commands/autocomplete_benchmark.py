@@ -0,0 +1,175 @@
+import json
+import random
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from products.autocomplete import AutocompleteIndex
+from products.models import Product
+from products.loaders import ProductLoader
+
+# Words of the generated product names
+_WORDS = ("saucisson", "jambon", "fromage", "yaourt", "biscuit", "chocolat", "confiture", "compote", "pain",
+          "brioche", "céréales", "lait", "beurre", "crème", "pâtes", "riz", "soupe", "sauce", "huile", "thé",
+          "café", "jus", "sirop", "miel", "rillettes", "pâté", "terrine", "quiche", "pizza", "tarte")
+_QUALIFIERS = ("bio", "sec", "nature", "allégé", "complet", "fumé", "fermier", "aux noix", "au lait",
+               "à l'ancienne", "de campagne", "sans sucre", "extra", "fin", "doux", "noir", "blanc")
+
+
+class Command(BaseCommand):
+    help = "Benchmark the products autocomplete against the previous unindexed query on a generated catalog. " \
+           "The catalog is created in a transaction rolled back at the end, the database is left unchanged."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=100000, help="Number of products generated")
+        parser.add_argument('--queries', type=int, default=200, help="Number of searches timed by implementation")
+        parser.add_argument('--seed', type=int, default=0, help="Seed of the generation")
+        parser.add_argument('--index-sizes', default="10000,100000",
+                            help="Comma separated catalog sizes of the in memory index build, e.g. 10000,1000000")
+        parser.add_argument('--output', help="Write the results in this JSON file")
+
+    def handle(self, *args, **options):
+        generator = random.Random(options['seed'])
+        results = []
+
+        with transaction.atomic():
+            print(f"Generating {options['products']} products...")
+            names = self.create_catalog(generator, options['products'])
+            with connection.cursor() as cursor:
+                cursor.execute("ANALYZE products_product")
+
+            searches = self.get_searches(generator, names, options['queries'])
+            results.append(self.bench("icontains", self.search_icontains, searches))
+            results.append(self.bench("trigram", Product.objects.search_autocomplete, searches))
+            results[-1]['index'] = self.has_trigram_index()
+            has_trigram_index = results[-1]['index']
+            results.append(self.bench("memory", AutocompleteIndex.from_db().search, searches))
+
+            transaction.set_rollback(True)
+
+        print(f"{'Query':<12}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+        for result in results:
+            print(f"{result['query']:<12}{result['p50_ms']:>10.2f}{result['p95_ms']:>10.2f}"
+                  f"{result['p99_ms']:>10.2f}{result['max_ms']:>10.2f}")
+
+        if not has_trigram_index:
+            print("No trigram index (pg_trgm is not available), the autocomplete scans the table.")
+
+        builds = [self.bench_index(generator, int(size), options['queries'])
+                  for size in options['index_sizes'].split(",") if size]
+
+        print(f"\n{'Index':<12}{'build s':>10}{'MB':>10}{'p50 ms':>10}{'p99 ms':>10}")
+        for build in builds:
+            print(f"{build['products']:<12}{build['build_seconds']:>10.1f}{build['memory_mb']:>10.1f}"
+                  f"{build['p50_ms']:>10.3f}{build['p99_ms']:>10.3f}")
+
+        if options['output']:
+            with open(options['output'], "w", encoding="utf-8") as f:
+                json.dump({'queries': results, 'index_builds': builds}, f, indent=2)
+
+    @staticmethod
+    def generate_name(generator, code: int) -> str:
+        return f"{generator.choice(_WORDS).capitalize()} {generator.choice(_QUALIFIERS)} " \
+               f"{generator.choice(_QUALIFIERS)} {code}"
+
+    @classmethod
+    def create_catalog(cls, generator, number_products: int) -> list:
+        """
+        Insert number_products products with generated names, spread over 50 categories
+
+        :param generator: random.Random
+        :param number_products: number of products
+        :return: list of the names
+
+        """
+        loader = ProductLoader(batch_size=5000)
+        names = []
+        start = Product.objects.order_by('-code').values_list('code', flat=True).first() or 0
+
+        for number in range(number_products):
+            code = start + number + 1
+            name = cls.generate_name(generator, code)
+            loader.add({
+                'code': code,
+                'name': name,
+                'image_url': "",
+                'nutriscore': generator.randint(-15, 40),
+                'nutriscore_grade': generator.choice("abcde"),
+                'ingredients_image': "",
+                'category': f"Catégorie de benchmark {number % 50}",
+            })
+            names.append(name)
+
+        loader.flush()
+
+        return names
+
+    @staticmethod
+    def get_searches(generator, names: list, number_searches: int) -> list:
+        """
+        Get searches as typed in the search bar: the beginning of one of the words of a name
+
+        """
+        searches = []
+        for _ in range(number_searches):
+            word = generator.choice(generator.choice(names).split())
+            searches.append(word[:generator.randint(3, max(3, len(word)))])
+
+        return searches
+
+    @staticmethod
+    def search_icontains(user_search: str) -> list:
+        # Implementation before the trigram index
+        results = Product.objects.filter(name__icontains=user_search).order_by('-nutriscore')[:10]
+
+        return [product.name for product in results]
+
+    @staticmethod
+    def bench(query: str, search, searches: list) -> dict:
+        timings = []
+        for user_search in searches:
+            start = time.perf_counter()
+            search(user_search)
+            timings.append((time.perf_counter() - start) * 1000)
+
+        timings.sort()
+
+        return {
+            'query': query,
+            'searches': len(timings),
+            'p50_ms': timings[len(timings) // 2],
+            'p95_ms': timings[min(len(timings) - 1, int(len(timings) * 0.95))],
+            'p99_ms': timings[min(len(timings) - 1, int(len(timings) * 0.99))],
+            'max_ms': timings[-1],
+        }
+
+    @classmethod
+    def bench_index(cls, generator, number_products: int, number_searches: int) -> dict:
+        """
+        Build the in memory index of number_products generated products, without the DB
+
+        :param generator: random.Random
+        :param number_products: size of the catalog
+        :param number_searches: number of searches timed
+        :return: dict with the build time, the memory and the search percentiles
+
+        """
+        rows = [(cls.generate_name(generator, code), generator.randint(-15, 40), code)
+                for code in range(1, number_products + 1)]
+        print(f"Building the index of {number_products} products...")
+        index = AutocompleteIndex(rows)
+        searches = cls.get_searches(generator, [row[0] for row in rows], number_searches)
+
+        return {
+            'products': number_products,
+            'build_seconds': index.seconds,
+            'memory_mb': index.get_memory() / 1024 / 1024,
+            **cls.bench("memory", index.search, searches),
+        }
+
+    @staticmethod
+    def has_trigram_index() -> bool:
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT 1 FROM pg_indexes WHERE indexname = 'products_search_key_trgm'")
+            return cursor.fetchone() is not None
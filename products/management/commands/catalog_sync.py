@@ -0,0 +1,72 @@
+import datetime as dt
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from products.models import Category, Product, CatalogVersion
+from products.loaders import ProductUpserter
+from products.pipeline import IngestPipeline
+from products.management.options import add_api_arguments, get_source
+from products.management.report import add_report_argument, get_run_metrics, write_report
+
+
+class Command(BaseCommand):
+    help = "Insert the new Openfoodfacts products and update the changed ones in a single pass. " \
+           "It can be run again at any time, the unchanged products are not written."
+
+    def add_arguments(self, parser):
+        parser.add_argument('-c', nargs='?', type=int, help="Number of categories to be synced")
+        parser.add_argument('-p', nargs="?", type=int, help="Number of products synced in each categories")
+        parser.add_argument('--batch-size', type=int, default=ProductUpserter._BATCH_SIZE,
+                            help="Number of products upserted by query")
+        parser.add_argument('--queue-size', type=int, default=IngestPipeline._QUEUE_SIZE,
+                            help="Max number of products fetched in advance of the DB writes")
+        # The cached responses are only used once revalidated, an update must see the upstream changes
+        add_api_arguments(parser, cache_ttl=0)
+        add_report_argument(parser)
+
+    def handle(self, *args, **options):
+        if not options['dump'] and (options['c'] is None or options['p'] is None):
+            raise CommandError("-c and -p are required when the products come from the API")
+
+        if connection.vendor != 'postgresql':
+            raise CommandError("catalog_sync needs a PostgreSQL database")
+
+        api = get_source(options, options['c'], options['p'])
+
+        date_begin = dt.datetime.now()
+        print(f"Beginning : {date_begin.strftime('%A %d %B %Y at %H:%M:%S')}")
+        print(f"Syncing the products of {len(api.categories) or 'every'} categories...")
+
+        # Each batch is its own short transaction, the site keeps reading the other rows meanwhile
+        upserter = ProductUpserter(options['batch_size'])
+        pipeline = IngestPipeline(options['queue_size'])
+        pipeline.run(api.get_products(), upserter.add)
+        upserter.flush()
+        metrics = get_run_metrics(api, pipeline, upserter)
+        if upserter.inserted or upserter.updated:
+            CatalogVersion.bump()
+
+        time_end = dt.datetime.now() - date_begin
+        number_synced = upserter.inserted + upserter.updated + upserter.unchanged
+
+        print(f"Inserted {upserter.inserted}, updated {upserter.updated}, unchanged {upserter.unchanged} and "
+              f"rejected {upserter.rejected} (name of another product) products. Took {time_end.seconds} seconds "
+              f"({number_synced / (time_end.total_seconds() or 1):.0f} products/s).")
+        print(f"{Product.objects.count()} products and {Category.objects.count()} categories in the database.")
+        print(f"Upserts : {upserter.get_stats()}")
+        print(f"Pipeline : {pipeline.get_stats()}")
+        print(f"Stages : {api.metrics.get_stats()}")
+
+        if getattr(api, 'cache', None) is not None:
+            print(f"OpenFoodFacts cache : {api.cache.get_stats()}")
+
+        if getattr(api, 'scheduler', None) is not None:
+            print(f"OpenFoodFacts requests : {api.scheduler.get_stats()}")
+
+        if options['report']:
+            write_report(options['report'], 'catalog_sync', date_begin, number_synced, [{'metrics': metrics}],
+                         inserted=upserter.inserted, updated=upserter.updated, unchanged=upserter.unchanged,
+                         rejected=upserter.rejected, batch_size=options['batch_size'],
+                         queue_size=options['queue_size'])
+            print(f"Report written to {options['report']}")
@@ -1,44 +1,181 @@
+import datetime as dt
+
 from django.core.management.base import BaseCommand, CommandError
-from django.db.utils import IntegrityError
+from django.db import connection
 
-from products.models import Category, Product
-from openfoodfacts.openfoodfacts_api import OpenFoodFactsAPI
+from products.models import Category, Product, IngestCheckpoint, CatalogVersion
+from products.loaders import LOADERS
+from products.pipeline import IngestPipeline
+from products.management.options import add_api_arguments, get_source
+from products.management.report import add_report_argument, get_run_metrics, write_report
+from products.management.workers import get_worker_options, run_in_processes, split
+from openfoodfacts.openfoodfacts_api import Progress
 
 
 class Command(BaseCommand):
-    help = "Populate DB with Openfoodfacts categories and products"
+    help = "Populate DB with Openfoodfacts categories and products. " \
+           "A run that failed is resumed from its last checkpoint."
 
     def add_arguments(self, parser):
-        parser.add_argument('-c', nargs='?', type=int, help="Number of categories to be added", required=True)
-        parser.add_argument('-p', nargs="?", type=int, help="Number of products added in each categories", required=True)
+        parser.add_argument('-c', nargs='?', type=int, help="Number of categories to be added")
+        parser.add_argument('-p', nargs="?", type=int, help="Number of products added in each categories")
+        parser.add_argument('--restart', action='store_true',
+                            help="Forget the checkpoints of a failed run instead of resuming it")
+        parser.add_argument('--loader', choices=sorted(LOADERS), default='orm',
+                            help="Write the products with the ORM or with PostgreSQL COPY (big catalogs)")
+        parser.add_argument('--batch-size', type=int,
+                            help="Number of products inserted by query, 1000 with the ORM and 20000 with COPY")
+        parser.add_argument('--queue-size', type=int, default=IngestPipeline._QUEUE_SIZE,
+                            help="Max number of products fetched in advance of the DB writes")
+        parser.add_argument('--workers', type=int, default=1,
+                            help="Number of processes sharing the categories, API only")
+        add_api_arguments(parser)
+        add_report_argument(parser)
 
     def handle(self, *args, **options):
         number_categories = options['c']
         number_products = options['p']
 
-        api = OpenFoodFactsAPI(number_categories, number_products)
+        if not options['dump'] and (number_categories is None or number_products is None):
+            raise CommandError("-c and -p are required when the products come from the API")
+
+        if options['loader'] == 'copy' and connection.vendor != 'postgresql':
+            raise CommandError("The copy loader needs a PostgreSQL database")
+
+        if options['workers'] > 1 and options['dump']:
+            raise CommandError("--workers can't be used with --dump")
+
+        if options['restart']:
+            IngestCheckpoint.objects.all().delete()
+
+        # Checkpoints are only kept while a run isn't over
+        checkpoints = IngestCheckpoint.objects.select_related('category').order_by('position')
+        resume = {}
+
+        if checkpoints and not options['dump']:
+            options['categories'] = [checkpoint.category.name for checkpoint in checkpoints]
+            number_categories = len(checkpoints)
+            # Only the products added by the run count, not the ones of the category saved by other runs
+            for checkpoint in checkpoints:
+                resume[checkpoint.category.name] = Progress(checkpoint.offset, checkpoint.products_added,
+                                                            checkpoint.completed)
+            print(f"Resuming the previous run from its checkpoints ({len(resume)} categories)")
+
+        api = get_source(options, number_categories, number_products)
 
         # Adding categories
-        print(f"Adding {number_categories} categories", end="")
-        for api_category in api.categories:
-            category = Category(name=api_category)
-            category.save()
-            print(".", end="")
+        print(f"Adding {len(api.categories)} categories")
+        Category.objects.bulk_create([Category(name=name) for name in api.categories], ignore_conflicts=True)
+
+        if not options['dump']:
+            categories = Category.objects.in_bulk(api.categories, field_name='name')
+            checkpoints = [IngestCheckpoint(category=categories[name], position=position)
+                           for position, name in enumerate(api.categories)]
+            IngestCheckpoint.objects.bulk_create(checkpoints, ignore_conflicts=True)
 
         # Adding products
-        print(f"\nAdding {number_categories * number_products} products, it can take a little while...")
+        print("Adding products, it can take a little while...")
+        products_before = Product.objects.count()
+        date_begin = dt.datetime.now()
+
+        if options['workers'] > 1:
+            # Each worker has its own categories, names taken by another one are skipped by the inserts
+            shards = split(api.categories, options['workers'])
+            print(f"Sharing the categories between {len(shards)} processes")
+            results = run_in_processes(ingest_shard, shards, resume, get_worker_options(options),
+                                       workers=options['workers'])
+        else:
+            results = [self.ingest(api, resume, options)]
+
+        # The run is over, the next one starts from scratch
+        IngestCheckpoint.objects.all().delete()
+
+        time_end = dt.datetime.now() - date_begin
+        number_products = Product.objects.count()
+        products_added = number_products - products_before
+        if products_added:
+            CatalogVersion.bump()
+        print(f"Successfully added {products_added} products, {number_products} products and "
+              f"{Category.objects.count()} categories in the database. Took {time_end.seconds} seconds "
+              f"({products_added / (time_end.total_seconds() or 1):.0f} products/s).")
+
+        for number, result in enumerate(results, start=1):
+            if len(results) > 1:
+                print(f"Process {number} :")
+            for line in result['report']:
+                print(line)
+
+        if options['report']:
+            batch_size = options['batch_size'] or LOADERS[options['loader']]._BATCH_SIZE
+            write_report(options['report'], 'db_init', date_begin, products_added, results,
+                         loader=options['loader'], batch_size=batch_size, queue_size=options['queue_size'])
+            print(f"Report written to {options['report']}")
+
+    def ingest(self, api, resume: dict, options: dict) -> dict:
+        """
+        Write the products of api in the DB
+
+        :param api: OpenFoodFactsAPI or OpenFoodFactsDump
+        :param resume: dict of category name -> Progress of the previous run
+        :param options: options of the command
+        :return: dict with the lines of the report and the metrics of the run
+
+        """
+        loader = LOADERS[options['loader']](options['batch_size'])
+
+        # The products are fetched in another thread while the previous ones are written
+        pipeline = IngestPipeline(options['queue_size'])
+        known_names = set(Product.objects.values_list('name', flat=True))
+        if options['dump']:
+            api_products = api.get_products(known_names=known_names)
+        else:
+            # A page is only done once its products are written
+            api_products = api.get_products(resume=resume, known_names=known_names,
+                                            on_progress=lambda *args: pipeline.defer(loader.after_flush,
+                                                                                     self.save_progress, *args))
+
+        # Products whose code or name is already in the DB are skipped by the batch
+        pipeline.run(api_products, loader.add)
+        loader.flush()
+        metrics = get_run_metrics(api, pipeline, loader)
+
+        report = [f"Products {options['loader'].upper()} loader : {loader.get_stats()}",
+                  f"Pipeline : {pipeline.get_stats()}",
+                  f"Stages : {api.metrics.get_stats()}"]
+
+        if getattr(api, 'cache', None) is not None:
+            report.append(f"OpenFoodFacts cache : {api.cache.get_stats()}")
+
+        if getattr(api, 'scheduler', None) is not None:
+            report.append(f"OpenFoodFacts requests : {api.scheduler.get_stats()}")
+
+        return {'report': report, 'metrics': metrics}
+
+    @staticmethod
+    def save_progress(category_name: str, progress: Progress) -> None:
+        """
+        Checkpoint a category once every product of a page has been saved
+
+        :param category_name: name of the category
+        :param progress: Progress of the category
+        :return: None
+
+        """
+        IngestCheckpoint.objects.filter(category__name=category_name) \
+                                .update(offset=progress.offset, products_added=progress.products_added,
+                                        completed=progress.completed)
 
-        for api_product in api.get_products():
-            api_product['category'] = Category.objects.get(name=api_product['category'])
-            product = Product(**api_product)
 
-            # Taking care of duplicates if any (sanity check even with a set() in api.get_products())
-            try:
-                product.save()
-            except IntegrityError:  # Unicity constraint
-                continue
+def ingest_shard(categories: list, resume: dict, options: dict) -> list:
+    """
+    Write the products of some categories from a worker process
 
-        print(f"\nSuccessfully added {len(Product.objects.all())} products and "
-              f"{len(Category.objects.all())} categories. Differences may be duplicates.")
+    :param categories: names of the categories of the worker
+    :param resume: dict of category name -> Progress of the previous run
+    :param options: options of the command
+    :return: dict returned by Command.ingest()
 
+    """
+    api = get_source(dict(options, categories=categories), len(categories), options['p'])
 
+    return Command().ingest(api, {name: resume[name] for name in categories if name in resume}, options)
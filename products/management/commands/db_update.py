@@ -1,68 +1,205 @@
 import datetime as dt
 
-from django.core.management.base import BaseCommand
-from django.db.utils import IntegrityError
+from django.core.management.base import BaseCommand, CommandError
 
-from products.models import Category, Product
-from openfoodfacts.openfoodfacts_api import OpenFoodFactsAPI
+from favorites.models import Favorite
+from products.models import Category, Product, SyncState, CatalogVersion
+from products.loaders import ProductUpdater
+from products.pipeline import IngestPipeline
+from products.management.options import add_api_arguments, get_source
+from products.management.report import add_report_argument, get_run_metrics, write_report
+from products.management.workers import get_worker_options, run_in_processes, split
 
 
 class Command(BaseCommand):
     help = "Update the products that are present in the DB. None will be added."
+    _SYNC_NAME = "db_update"
+    # Seconds before the start of a run, covering the clock skew with OFF
+    _WATERMARK_MARGIN = 10 * 60
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=ProductUpdater._BATCH_SIZE,
+                            help="Number of products compared to the DB by query")
+        parser.add_argument('--incremental', action='store_true',
+                            help="Only get the products modified upstream since the last incremental run")
+        parser.add_argument('--by-code', action='store_true',
+                            help="Get the products of the DB by barcode, the favorites first, "
+                                 "instead of searching the categories")
+        parser.add_argument('--queue-size', type=int, default=IngestPipeline._QUEUE_SIZE,
+                            help="Max number of products fetched in advance of the DB writes")
+        parser.add_argument('--workers', type=int, default=1,
+                            help="Number of processes sharing the categories (or the codes with --by-code), API only")
+        # The cached responses are only used once revalidated, an update must see the upstream changes
+        add_api_arguments(parser, cache_ttl=0)
+        add_report_argument(parser)
 
     def handle(self, *args, **options):
-        number_updated = 0
+        number_categories = Category.objects.count()
+        number_products = Product.objects.count()
 
-        categories = Category.objects.all()
-        products = Product.objects.all()
-
-        if not products or not categories:
+        if not number_products or not number_categories:
             print("There is no product in the database. Please "
                   "do a 'python manage.py db_init -c X -p Y' first.")
 
-        api = OpenFoodFactsAPI(len(categories), len(products))
+        if options['by_code'] and (options['dump'] or options['incremental']):
+            raise CommandError("--by-code can't be used with --dump or --incremental")
+
+        if options['workers'] > 1 and options['dump']:
+            raise CommandError("--workers can't be used with --dump")
+
+        if options['by_code']:
+            # Read before the products are fetched, only the writer thread uses the DB
+            codes = list(self.get_codes(options['categories']))
+            # No category is searched, giving them saves the categories request
+            options['categories'] = list(Category.objects.values_list('name', flat=True))
+
+        sync_state = SyncState.objects.filter(name=self._SYNC_NAME).first()
+        modified_since = sync_state.last_modified_t if options['incremental'] and sync_state else None
+
+        # No limit by category with a dump or since a watermark, every modified product is looked up
+        if options['dump']:
+            number_products_by_category = None
+        elif modified_since is not None:
+            number_products_by_category = float('inf')
+        else:
+            number_products_by_category = number_products
+        api = get_source(options, number_categories, number_products_by_category, modified_since=modified_since)
 
         date_begin = dt.datetime.now()
         date_fmt = date_begin.strftime("%A %d %B %Y at %H:%M:%S")
 
         print(f"Beginning : {date_fmt}")
-        print("Updating products...")
-
-        for api_product in api.get_products():
-            # Looking if the product is already in the db
-            try:
-                db_product = products.get(pk=api_product['code'])
-            except Product.DoesNotExist:
-                # print(f"Product not found in the db. {api_product}")
-                # No corresponding product found. As we only update but not add, we pass
-                continue
-
-            # Updating the product
-            db_product_updated = False
-            for api_prod_attr in api_product.keys():
-                if api_prod_attr in {"code", "category"}:
-                    continue
-
-                if hasattr(db_product, api_prod_attr) \
-                        and getattr(db_product, api_prod_attr) != api_product[api_prod_attr]:
-                    setattr(db_product, api_prod_attr, api_product[api_prod_attr])
-                    db_product_updated = True
-
-            if db_product_updated:
-                try:
-                    db_product.save()
-                # One product has changed it's name to one already existing in the db
-                # with a different code...
-                except IntegrityError:
-                    continue
-
-                number_updated += 1
+        if modified_since is not None:
+            print(f"Updating products modified since {dt.datetime.fromtimestamp(modified_since):%d/%m/%Y %H:%M:%S}...")
+        else:
+            print("Updating products...")
+
+        if options['workers'] > 1:
+            shards = split(codes if options['by_code'] else api.categories, options['workers'])
+            print(f"Sharing the {'products' if options['by_code'] else 'categories'} between {len(shards)} processes")
+            results = run_in_processes(update_shard, shards, get_worker_options(options),
+                                       number_products_by_category, modified_since, workers=options['workers'])
+        else:
+            api_products = api.get_products_by_code(codes) if options['by_code'] else api.get_products()
+            results = [self.update(api, api_products, options)]
+
+        # The next incremental run starts from the most recent product seen by this one, but not after
+        # the start of this one: a product of a category already read may have changed during the run
+        last_modified_t = max((result['last_modified_t'] or 0 for result in results), default=0)
+        last_modified_t = min(last_modified_t, int(date_begin.timestamp()) - self._WATERMARK_MARGIN)
+        if options['incremental'] and last_modified_t:
+            SyncState.objects.update_or_create(name=self._SYNC_NAME,
+                                               defaults={'last_modified_t': max(last_modified_t, modified_since or 0)})
 
         time_end = dt.datetime.now()
         time_end = time_end - date_begin
 
-        print(f"Successfully updated {number_updated} products of the {len(products)} present "
-              f"in the database. Took {time_end.seconds} seconds.")
+        number_updated = sum(result['updated'] for result in results)
+        number_unchanged = sum(result['unchanged'] for result in results)
+        name_conflicts = sum(result['name_conflicts'] for result in results)
+        if number_updated:
+            CatalogVersion.bump()
+        number_compared = number_updated + number_unchanged
+        print(f"Successfully updated {number_updated} products of the {number_products} present "
+              f"in the database ({number_unchanged} unchanged). Took {time_end.seconds} seconds "
+              f"({number_compared / (time_end.total_seconds() or 1):.0f} products/s).")
+        if name_conflicts:
+            print(f"{name_conflicts} new names were already taken by another product and were not applied.")
+
+        for number, result in enumerate(results, start=1):
+            if len(results) > 1:
+                print(f"Process {number} :")
+            for line in result['report']:
+                print(line)
+
+        if options['report']:
+            write_report(options['report'], 'db_update', date_begin, number_compared, results,
+                         updated=number_updated, unchanged=number_unchanged, name_conflicts=name_conflicts,
+                         incremental=options['incremental'], by_code=options['by_code'],
+                         batch_size=options['batch_size'], queue_size=options['queue_size'])
+            print(f"Report written to {options['report']}")
+
+    def update(self, api, api_products, options: dict) -> dict:
+        """
+        Update the products of the DB from api_products
+
+        :param api: OpenFoodFactsAPI or OpenFoodFactsDump giving api_products
+        :param api_products: iterator of products dict
+        :param options: options of the command
+        :return: dict with the updated, unchanged, name_conflicts and last_modified_t numbers,
+                 the report lines and the metrics of the run
+
+        """
+        # Products not in the DB are ignored, as we only update but not add
+        # The products are fetched in another thread while the previous ones are compared to the DB
+        updater = ProductUpdater(options['batch_size'])
+        pipeline = IngestPipeline(options['queue_size'])
+        pipeline.run(api_products, updater.add)
+        updater.flush()
+        metrics = get_run_metrics(api, pipeline, updater)
+
+        report = [f"Pipeline : {pipeline.get_stats()}",
+                  f"Stages : {api.metrics.get_stats()}"]
+
+        if getattr(api, 'cache', None) is not None:
+            report.append(f"OpenFoodFacts cache : {api.cache.get_stats()}")
+
+        if getattr(api, 'scheduler', None) is not None:
+            report.append(f"OpenFoodFacts requests : {api.scheduler.get_stats()}")
+
+        return {
+            'updated': updater.updated,
+            'unchanged': updater.unchanged,
+            'name_conflicts': updater.name_conflicts,
+            'last_modified_t': api.last_modified_t,
+            'report': report,
+            'metrics': metrics,
+        }
+
+    @staticmethod
+    def get_codes(categories=None):
+        """
+        Get generator of the codes of the products in the DB, the most recently favorited ones first
+
+        :param categories: names of the categories of the products, all if None
+        :return: int - code
+
+        """
+        products = Product.objects.all()
+        favorites = Favorite.objects.order_by('-date').values_list('new_product_id', 'ancient_product_id')
+
+        if categories:
+            products = products.filter(category__name__in=categories)
+
+        favorite_codes = list(dict.fromkeys(code for favorite in favorites for code in favorite))
+        if categories:
+            in_categories = set(products.filter(code__in=favorite_codes).values_list('code', flat=True))
+            favorite_codes = [code for code in favorite_codes if code in in_categories]
+
+        yield from favorite_codes
+
+        favorite_codes = set(favorite_codes)
+        for code in products.values_list('code', flat=True).iterator():
+            if code not in favorite_codes:
+                yield code
+
+
+def update_shard(shard: list, options: dict, number_products_by_category, modified_since) -> dict:
+    """
+    Update the products of some categories, or of some codes with --by-code, from a worker process
+
+    :param shard: names of the categories or codes of the worker
+    :param options: options of the command
+    :param number_products_by_category: max number of products by category
+    :param modified_since: watermark of an incremental run, None otherwise
+    :return: dict returned by Command.update()
 
+    """
+    if options['by_code']:
+        api = get_source(options, len(options['categories']), 0)
+        return Command().update(api, api.get_products_by_code(shard), options)
 
+    api = get_source(dict(options, categories=shard), len(shard), number_products_by_category,
+                     modified_since=modified_since)
 
+    return Command().update(api, api.get_products(), options)
@@ -0,0 +1,143 @@
+import contextlib
+import json
+import os
+import resource
+import time
+
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from products.models import Category, Product
+from products.loaders import LOADERS
+from openfoodfacts.openfoodfacts_api import OpenFoodFactsAPI
+from openfoodfacts.stub_server import OFFStubServer, make_synthetic_fixtures, record_fixtures
+
+
+class QueryTimer:
+    """
+    connection.execute_wrapper() summing the time spent in the DB
+
+    """
+    def __init__(self):
+        self.seconds = 0.0
+        self.queries = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.seconds += time.perf_counter() - start
+            self.queries += 1
+
+
+class Command(BaseCommand):
+    help = "Benchmark the ingestion (OpenFoodFactsAPI.get_products, db_init and db_update) " \
+           "against a local server replaying recorded or generated OpenFoodFacts responses"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--fixtures', help="Fixtures file recorded with --record, generated fixtures if none")
+        parser.add_argument('--record', metavar="PATH",
+                            help="Record the live OpenFoodFacts responses in PATH and exit")
+        parser.add_argument('-c', type=int, default=10, help="Number of categories")
+        parser.add_argument('-p', type=int, default=100, help="Number of products by category")
+        parser.add_argument('--raw-products', type=int, default=300,
+                            help="Raw products by category generated or recorded, before the filters")
+        parser.add_argument('--latency', type=float, default=0.05, help="Seconds added to every replayed response")
+        parser.add_argument('--changed', type=float, default=0.1,
+                            help="Share of the products changed upstream before db_update")
+        parser.add_argument('--loader', choices=sorted(LOADERS), default='orm', help="Products loader of db_init")
+        parser.add_argument('--output', help="Write the results in this JSON file")
+
+    def handle(self, *args, **options):
+        if options['record']:
+            record_fixtures(options['record'], options['c'], options['raw_products'])
+            print(f"Recorded {options['c']} categories in {options['record']}")
+            return
+
+        if options['fixtures']:
+            server = OFFStubServer.from_fixtures(options['fixtures'], latency=options['latency'])
+        else:
+            fixtures = make_synthetic_fixtures(options['c'], options['raw_products'])
+            server = OFFStubServer(fixtures['categories'], fixtures['products'], latency=options['latency'])
+
+        if Category.objects.exists():
+            raise CommandError("The benchmark fills the database, run it on an empty one "
+                               "(e.g. with a dedicated DB_NAME).")
+
+        results = []
+        with server:
+            results.append(self.bench_get_products(server, options))
+            results.append(self.bench_command(server, "db_init", c=options['c'], p=options['p'],
+                                              loader=options['loader']))
+            self.change_products(server, options['changed'])
+            results.append(self.bench_command(server, "db_update"))
+
+        Category.objects.all().delete()
+
+        print(f"{'Stage':<14}{'products/s':>12}{'requests/s':>12}{'seconds':>10}{'DB seconds':>12}{'peak RSS MB':>13}")
+        for result in results:
+            print(f"{result['stage']:<14}{result['products_per_second']:>12.1f}{result['requests_per_second']:>12.1f}"
+                  f"{result['seconds']:>10.2f}{result['db_seconds']:>12.2f}{result['peak_rss_mb']:>13.1f}")
+
+        if options['output']:
+            with open(options['output'], "w", encoding="utf-8") as f:
+                json.dump(results, f, indent=2)
+
+    def bench_get_products(self, server, options) -> dict:
+        requests_before = server.requests_count
+        start = time.perf_counter()
+
+        api = OpenFoodFactsAPI(options['c'], options['p'], off_url=server.url)
+        number_products = sum(1 for _ in api.get_products())
+
+        return self.get_result("get_products", start, number_products, server.requests_count - requests_before)
+
+    def bench_command(self, server, command, **options) -> dict:
+        products_before = Product.objects.count()
+        requests_before = server.requests_count
+        query_timer = QueryTimer()
+        start = time.perf_counter()
+
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull), \
+                connection.execute_wrapper(query_timer):
+            call_command(command, off_url=server.url, no_cache=True, **options)
+
+        if command == "db_init":
+            number_products = Product.objects.count() - products_before
+        else:
+            number_products = products_before
+
+        return self.get_result(command, start, number_products, server.requests_count - requests_before,
+                               query_timer)
+
+    @staticmethod
+    def change_products(server, share: float) -> None:
+        """
+        Change the nutriscore of a share of the replayed products, for db_update to have something to write
+
+        """
+        for products in server.products.values():
+            for product in products[:int(len(products) * share)]:
+                try:
+                    product['nutriscore_score'] = int(product['nutriscore_score']) + 1
+                except (KeyError, TypeError, ValueError):
+                    continue
+
+    @staticmethod
+    def get_result(stage: str, start: float, number_products: int, number_requests: int, query_timer=None) -> dict:
+        seconds = time.perf_counter() - start
+
+        return {
+            'stage': stage,
+            'seconds': seconds,
+            'products': number_products,
+            'requests': number_requests,
+            'products_per_second': number_products / seconds,
+            'requests_per_second': number_requests / seconds,
+            'db_seconds': query_timer.seconds if query_timer else 0.0,
+            'db_queries': query_timer.queries if query_timer else 0,
+            # Linux gives kilobytes
+            'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        }
@@ -0,0 +1,68 @@
+from django.conf import settings
+
+from openfoodfacts.http_cache import HTTPCache
+from openfoodfacts.openfoodfacts_api import OpenFoodFactsAPI
+from openfoodfacts.openfoodfacts_dump import OpenFoodFactsDump
+
+
+def add_api_arguments(parser, cache_ttl=None):
+    """
+    Add the options choosing and configuring the products source of a command
+
+    :param parser: parser of the command
+    :param cache_ttl: default of --cache-ttl, settings.OPENFOODFACTS_CACHE_TTL if None.
+        0 for the commands updating the database, always sending conditional requests
+    :return: None
+
+    """
+    if cache_ttl is None:
+        cache_ttl = settings.OPENFOODFACTS_CACHE_TTL
+
+    parser.add_argument('--no-cache', action='store_true', help="Don't use the OpenFoodFacts responses cache")
+    parser.add_argument('--cache-ttl', type=int, default=cache_ttl,
+                        help=f"Seconds before a cached response is revalidated (default {cache_ttl})")
+    parser.add_argument('--stream-json', action='store_true',
+                        help="Decode the OpenFoodFacts responses while they are downloaded")
+    parser.add_argument('--off-url', help="Url of the OpenFoodFacts API, e.g. a local replay server")
+    parser.add_argument('--dump', help="Read the products from a local OpenFoodFacts export "
+                                       "(.jsonl or .csv, optionally .gz/.bz2) instead of the API")
+    parser.add_argument('--category', action='append', dest='categories',
+                        help="Only use this category, can be repeated")
+
+
+def get_api_kwargs(options):
+    """
+    Get the OpenFoodFactsAPI keyword arguments matching the options of a command
+
+    :param options: options of the command
+    :return: dict of kwargs
+
+    """
+    cache = None
+    if not options['no_cache']:
+        cache = HTTPCache(settings.OPENFOODFACTS_CACHE_DIR, ttl=options['cache_ttl'],
+                          max_size=settings.OPENFOODFACTS_CACHE_MAX_SIZE)
+
+    return {
+        'cache': cache,
+        'stream_json': options['stream_json'],
+        'off_url': options['off_url'],
+    }
+
+
+def get_source(options, number_categories, number_products_by_category, **kwargs):
+    """
+    Get the products source of a command: the OpenFoodFacts API or a local export
+
+    :param options: options of the command
+    :param number_categories: number of categories asked to the API
+    :param number_products_by_category: max number of products by category, None for no limit with a dump
+    :param kwargs: other arguments of the source, e.g. modified_since
+    :return: OpenFoodFactsAPI or OpenFoodFactsDump
+
+    """
+    if options['dump']:
+        return OpenFoodFactsDump(options['dump'], options['categories'], number_products_by_category, **kwargs)
+
+    return OpenFoodFactsAPI(number_categories, number_products_by_category, categories=options['categories'],
+                            **get_api_kwargs(options), **kwargs)
@@ -0,0 +1,63 @@
+import datetime as dt
+import json
+
+from openfoodfacts.metrics import Metrics
+
+
+def add_report_argument(parser):
+    parser.add_argument('--report', metavar='PATH',
+                        help="Write the metrics of the run (stages timings, HTTP latency, rejections...) "
+                             "to this JSON file")
+
+
+def get_run_metrics(api, pipeline, writer) -> dict:
+    """
+    Get the metrics of the products source of a run, along with the DB writes and the waits of the pipeline
+
+    :param api: OpenFoodFactsAPI or OpenFoodFactsDump
+    :param pipeline: IngestPipeline of the run, once over
+    :param writer: loader or updater, with its seconds and batches
+    :return: dict given by Metrics.to_dict()
+
+    """
+    metrics = api.metrics
+    metrics.add_time('db_write', writer.seconds, writer.batches)
+    # Writer waiting for the products, and fetching waiting for the writer
+    metrics.add_time('pipeline_writer_wait', pipeline.consumer_wait)
+    metrics.add_time('pipeline_fetch_wait', pipeline.producer_wait)
+    metrics.count('products_fetched', pipeline.produced)
+
+    return metrics.to_dict()
+
+
+def write_report(path: str, command: str, date_begin: dt.datetime, products: int, results: list, **values) -> None:
+    """
+    Write the JSON report of a run, the metrics of its processes being merged
+
+    :param path: path of the JSON file
+    :param command: name of the command
+    :param date_begin: datetime when the run began
+    :param products: number of products written by the run
+    :param results: dicts with the 'metrics' of each process
+    :param values: other values of the report, e.g. the options tuned
+    :return: None
+
+    """
+    seconds = (dt.datetime.now() - date_begin).total_seconds()
+    metrics = Metrics()
+    for result in results:
+        metrics.merge(result['metrics'])
+
+    report = {
+        'command': command,
+        'started_at': date_begin.isoformat(),
+        'seconds': seconds,
+        'processes': len(results),
+        'products': products,
+        'products_per_second': products / seconds if seconds else 0.0,
+        **values,
+        **metrics.to_dict(),
+    }
+
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
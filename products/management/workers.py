@@ -0,0 +1,62 @@
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+from django import db
+
+
+def split(items: list, number_shards: int) -> list:
+    """
+    Split items in number_shards lists of about the same length, in round robin
+    so that the first items (e.g. the most popular categories) are spread over every shard
+
+    :param items: list to split
+    :param number_shards: number of shards
+    :return: list of the non empty shards
+
+    """
+    return [shard for shard in (items[index::number_shards] for index in range(number_shards)) if shard]
+
+
+def get_worker_options(options: dict) -> dict:
+    """
+    Get the options of a command that can be sent to a worker process (not stdout, stderr...)
+
+    :param options: options of the command
+    :return: dict of options
+
+    """
+    return {key: value for key, value in options.items()
+            if value is None or isinstance(value, (str, int, float, bool, list, tuple))}
+
+
+def run_in_processes(function, shards: list, *args, workers=None) -> list:
+    """
+    Call function(shard, *args) for every shard, each in its own forked process with its own
+    DB connection and HTTP session. An exception in a worker is raised once every worker is over.
+
+    :param function: module level function, called with a shard and args
+    :param shards: list of shards, e.g. empty for an empty DB
+    :param args: other picklable arguments of function
+    :param workers: maximum number of processes, one by shard if None
+    :return: list of the results, in the order of the shards
+
+    """
+    if not shards:
+        return []
+
+    # Forked processes must not share the connections of the parent
+    db.connections.close_all()
+
+    context = multiprocessing.get_context("fork")
+    max_workers = min(len(shards), workers or len(shards))
+    with ProcessPoolExecutor(max_workers=max_workers, mp_context=context) as executor:
+        futures = [executor.submit(_run_worker, function, shard, *args) for shard in shards]
+
+    return [future.result() for future in futures]
+
+
+def _run_worker(function, shard, *args):
+    try:
+        return function(shard, *args)
+    finally:
+        db.connections.close_all()
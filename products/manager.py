@@ -1,23 +1,90 @@
+from django.contrib.postgres.search import SearchQuery, SearchRank
 from django.db import models
+from django.db.models.functions import Length
+
+from products.text import normalize
 
 
 class ProductManager(models.Manager):
+    # Shorter searches can't use the trigram index and match most of the catalog
+    AUTOCOMPLETE_MIN_LENGTH = 3
+    AUTOCOMPLETE_LIMIT = 10
+
     def search_autocomplete(self, user_search):
-        results = super().get_queryset().filter(name__icontains=user_search) \
-                      .order_by('-nutriscore')[:10]
+        """
+        Get the names of the products with a word starting with a search, accents, case and punctuation aside,
+        through the indexes on the search keys. Same matches and order as the in memory AutocompleteIndex:
+        the names starting with the search come first, then the most similar ones: the shortest,
+        as the search shares all its trigrams with every name containing it, then the worst nutriscores
+
+        :param user_search: text typed, nothing is searched under AUTOCOMPLETE_MIN_LENGTH characters
+        :return: list of names
+
+        """
+        search_key = normalize(user_search)
+        if len(search_key) < self.AUTOCOMPLETE_MIN_LENGTH:
+            return []
 
-        results = [product.name for product in results]
+        is_prefix = models.Case(models.When(search_key__startswith=search_key, then=0), default=1,
+                                output_field=models.IntegerField())
+        # Normalized words are separated by single spaces
+        is_word_prefix = models.Q(search_key__startswith=search_key) | models.Q(search_key__contains=f" {search_key}")
+        results = super().get_queryset().filter(is_word_prefix) \
+                                        .order_by(is_prefix, Length('name'), '-nutriscore', 'code') \
+                                        .values_list('name', flat=True)[:self.AUTOCOMPLETE_LIMIT]
 
-        return results
+        return list(results)
 
     def get_old_product(self, user_search):
-        old_product = super().get_queryset().filter(models.Q(name=user_search) |
-                                                    models.Q(name__icontains=user_search) |
-                                                    models.Q(name__icontains=user_search.capitalize()))\
-                                            .first()
+        """
+        Get the product of this name, accents, case and punctuation aside, else the best ranked
+        by the French full text search on the names of the products and of their categories,
+        each word of the search being a prefix. Products of the same rank are ordered by the length
+        of their name then by code
+
+        :param user_search: text searched
+        :return: Product or None
+
+        """
+        products = super().get_queryset()
+        search_key = normalize(str(user_search))
+        if not search_key:
+            return None
+
+        # The product of the exact name first, e.g. picked in the autocomplete
+        is_exact = models.Case(models.When(name=user_search, then=0), default=1, output_field=models.IntegerField())
+        old_product = products.filter(search_key=search_key).order_by(is_exact, 'code').first()
+        if old_product is not None:
+            return old_product
+
+        # Only the words, the other characters are operators of a raw tsquery
+        words = search_key.split()
+
+        query = SearchQuery(" & ".join(f"{word}:*" for word in words), config='french', search_type='raw')
+        old_product = products.filter(search_vector=query) \
+                              .annotate(rank=SearchRank(models.F('search_vector'), query)) \
+                              .order_by('-rank', Length('name'), 'code') \
+                              .first()
 
         return old_product
 
+    def get_content_hashes(self, category=None, codes=None):
+        """
+        Get the content hashes of some products with a single narrow query
+
+        :param category: Category of the products, all if None
+        :param codes: codes of the products, all if None
+        :return: dict of code -> content_hash
+
+        """
+        products = super().get_queryset()
+        if category is not None:
+            products = products.filter(category=category)
+        if codes is not None:
+            products = products.filter(code__in=codes)
+
+        return dict(products.values_list('code', 'content_hash'))
+
     def get_better_products(self, old_product):
         # product_category = Product.objects.filter(name=user_search).first().category
         product_category = old_product.category
@@ -0,0 +1,25 @@
+# Generated by Django 2.2.28 on 2026-10-18 06:47
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0004_auto_20191023_1436'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IngestCheckpoint',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('position', models.PositiveIntegerField()),
+                ('offset', models.PositiveIntegerField(default=0)),
+                ('products_added', models.PositiveIntegerField(default=0)),
+                ('completed', models.BooleanField(default=False)),
+                ('category', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='checkpoint', to='products.Category')),
+            ],
+        ),
+    ]
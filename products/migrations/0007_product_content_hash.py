@@ -0,0 +1,49 @@
+# Generated by Django 2.2.28 on 2026-10-18 09:12
+
+import hashlib
+import json
+
+from django.db import migrations, models
+
+
+CONTENT_FIELDS = ('name', 'image_url', 'nutriscore', 'nutriscore_grade', 'ingredients_image')
+BATCH_SIZE = 2000
+
+
+def fill_content_hash(apps, schema_editor):
+    # Same digest as Product.get_content_hash()
+    Product = apps.get_model('products', 'Product')
+    products = []
+
+    for product in Product.objects.only(*CONTENT_FIELDS).iterator(chunk_size=BATCH_SIZE):
+        content = json.dumps([getattr(product, field) for field in CONTENT_FIELDS], ensure_ascii=False)
+        product.content_hash = hashlib.md5(content.encode()).hexdigest()
+        products.append(product)
+
+        if len(products) == BATCH_SIZE:
+            Product.objects.bulk_update(products, ['content_hash'])
+            products = []
+
+    Product.objects.bulk_update(products, ['content_hash'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0006_syncstate'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='content_hash',
+            field=models.CharField(default='', editable=False, max_length=32),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.RunPython(fill_content_hash, migrations.RunPython.noop),
+    ]
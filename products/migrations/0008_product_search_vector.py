@@ -0,0 +1,50 @@
+# Generated by Django 2.2.28 on 2026-10-18 11:40
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.db import migrations
+
+
+# The vector is set by the DB, so that every write path (ORM, COPY, upserts, bulk updates) keeps it up to date
+CREATE_TRIGGER = """
+CREATE FUNCTION products_product_search_vector() RETURNS trigger AS $$
+BEGIN
+    NEW.search_vector :=
+        setweight(to_tsvector('french', coalesce(NEW.name, '')), 'A') ||
+        setweight(to_tsvector('french', coalesce((SELECT name FROM products_category
+                                                   WHERE id = NEW.category_id), '')), 'B');
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER products_product_search_vector
+    BEFORE INSERT OR UPDATE OF name, category_id ON products_product
+    FOR EACH ROW EXECUTE PROCEDURE products_product_search_vector();
+
+UPDATE products_product SET name = name;
+"""
+
+DROP_TRIGGER = """
+DROP TRIGGER IF EXISTS products_product_search_vector ON products_product;
+DROP FUNCTION IF EXISTS products_product_search_vector();
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0007_product_content_hash'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.RunSQL(CREATE_TRIGGER, DROP_TRIGGER),
+        migrations.AddIndex(
+            model_name='product',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='products_search_vector_gin'),
+        ),
+    ]
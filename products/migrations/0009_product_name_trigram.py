@@ -0,0 +1,36 @@
+# Generated by Django 2.2.28 on 2026-10-18 12:25
+
+from django.db import migrations
+
+
+def create_trigram_index(apps, schema_editor):
+    # pg_trgm ships with the PostgreSQL contrib modules, without them autocomplete scans the table
+    connection = schema_editor.connection
+    if connection.vendor != 'postgresql':
+        return
+
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT 1 FROM pg_available_extensions WHERE name = 'pg_trgm'")
+        if cursor.fetchone() is None:
+            return
+
+        cursor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+        # Serves the UPPER(name) LIKE UPPER('%...%') of name__icontains
+        cursor.execute("CREATE INDEX IF NOT EXISTS products_name_trgm ON products_product "
+                       "USING gin (UPPER(name) gin_trgm_ops)")
+
+
+def drop_trigram_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute("DROP INDEX IF EXISTS products_name_trgm")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0008_product_search_vector'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_trigram_index, drop_trigram_index),
+    ]
@@ -0,0 +1,87 @@
+# Generated by Django 2.2.28 on 2026-10-18 14:05
+
+import re
+import unicodedata
+
+from django.db import migrations, models
+
+
+BATCH_SIZE = 2000
+
+
+def normalize(text):
+    # Same as products.text.normalize()
+    text = text.lower()
+    if not text.isascii():
+        text = unicodedata.normalize('NFKD', text)
+        text = "".join(char for char in text if not unicodedata.combining(char))
+
+    return re.sub(r"[\W_]+", " ", text).strip()
+
+
+def fill_search_key(apps, schema_editor):
+    Product = apps.get_model('products', 'Product')
+    products = []
+
+    for product in Product.objects.only('name').iterator(chunk_size=BATCH_SIZE):
+        product.search_key = normalize(product.name)
+        products.append(product)
+
+        if len(products) == BATCH_SIZE:
+            Product.objects.bulk_update(products, ['search_key'])
+            products = []
+
+    Product.objects.bulk_update(products, ['search_key'])
+
+
+def has_trigram(connection):
+    if connection.vendor != 'postgresql':
+        return False
+
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT 1 FROM pg_available_extensions WHERE name = 'pg_trgm'")
+        return cursor.fetchone() is not None
+
+
+def create_trigram_index(apps, schema_editor):
+    # The autocomplete now searches the search keys, the index on UPPER(name) of 0009 is replaced
+    if not has_trigram(schema_editor.connection):
+        return
+
+    schema_editor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    schema_editor.execute("DROP INDEX IF EXISTS products_name_trgm")
+    schema_editor.execute("CREATE INDEX IF NOT EXISTS products_search_key_trgm ON products_product "
+                          "USING gin (search_key gin_trgm_ops)")
+
+
+def drop_trigram_index(apps, schema_editor):
+    if not has_trigram(schema_editor.connection):
+        return
+
+    schema_editor.execute("DROP INDEX IF EXISTS products_search_key_trgm")
+    schema_editor.execute("CREATE INDEX IF NOT EXISTS products_name_trgm ON products_product "
+                          "USING gin (UPPER(name) gin_trgm_ops)")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0010_catalogversion'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='search_key',
+            field=models.TextField(default='', editable=False),
+            preserve_default=False,
+        ),
+        migrations.RunPython(fill_search_key, migrations.RunPython.noop),
+        # Indexed once filled
+        migrations.AlterField(
+            model_name='product',
+            name='search_key',
+            field=models.TextField(db_index=True, editable=False),
+        ),
+        migrations.RunPython(create_trigram_index, drop_trigram_index),
+    ]
@@ -0,0 +1,60 @@
+# Generated by Django 2.2.28 on 2026-10-18 18:20
+
+from django.db import migrations
+
+
+# get_old_product() searches the words of the normalized search (accents, case and punctuation aside),
+# so the vector is built from the search key of the name. Categories have no search key: their name is
+# lowered and stripped of the accents of the Latin letters, as products.text.normalize() does
+# (unaccent is a contrib extension, not always available)
+UPDATE_TRIGGER = """
+CREATE OR REPLACE FUNCTION products_product_search_vector() RETURNS trigger AS $$
+BEGIN
+    NEW.search_vector :=
+        setweight(to_tsvector('french', coalesce(NEW.search_key, '')), 'A') ||
+        setweight(to_tsvector('french', translate(lower(coalesce((SELECT name FROM products_category
+                                                                   WHERE id = NEW.category_id), '')),
+                                                  'àâäáãåçéèêëíìîïñóòôöõúùûüýÿ',
+                                                  'aaaaaaceeeeiiiinooooouuuuyy')), 'B');
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS products_product_search_vector ON products_product;
+CREATE TRIGGER products_product_search_vector
+    BEFORE INSERT OR UPDATE OF name, search_key, category_id ON products_product
+    FOR EACH ROW EXECUTE PROCEDURE products_product_search_vector();
+
+UPDATE products_product SET search_key = search_key;
+"""
+
+# Same as 0008
+RESTORE_TRIGGER = """
+CREATE OR REPLACE FUNCTION products_product_search_vector() RETURNS trigger AS $$
+BEGIN
+    NEW.search_vector :=
+        setweight(to_tsvector('french', coalesce(NEW.name, '')), 'A') ||
+        setweight(to_tsvector('french', coalesce((SELECT name FROM products_category
+                                                   WHERE id = NEW.category_id), '')), 'B');
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS products_product_search_vector ON products_product;
+CREATE TRIGGER products_product_search_vector
+    BEFORE INSERT OR UPDATE OF name, category_id ON products_product
+    FOR EACH ROW EXECUTE PROCEDURE products_product_search_vector();
+
+UPDATE products_product SET name = name;
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0011_product_search_key'),
+    ]
+
+    operations = [
+        migrations.RunSQL(UPDATE_TRIGGER, RESTORE_TRIGGER),
+    ]
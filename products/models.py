@@ -1,6 +1,13 @@
+import hashlib
+import json
+
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
 from django.db import models
+from django.utils import timezone
 
 from products.manager import ProductManager
+from products.text import normalize
 
 
 class Category(models.Model):
@@ -11,6 +18,9 @@ class Category(models.Model):
 
 
 class Product(models.Model):
+    # Fields of the product coming from OFF, its category aside
+    CONTENT_FIELDS = ('name', 'image_url', 'nutriscore', 'nutriscore_grade', 'ingredients_image')
+
     code = models.BigIntegerField(primary_key=True)
     name = models.CharField(max_length=150, unique=True)
     image_url = models.CharField(max_length=200)
@@ -18,12 +28,42 @@ class Product(models.Model):
     nutriscore_grade = models.CharField(max_length=1)
     ingredients_image = models.CharField(max_length=200)
     category = models.ForeignKey(Category, on_delete=models.CASCADE, related_name='products')
+    # Digest of the CONTENT_FIELDS, equal hashes meaning unchanged products
+    content_hash = models.CharField(max_length=32, editable=False)
+    updated_at = models.DateTimeField(auto_now=True)
+    # French full text of the names of the product and of its category, set by a trigger on every write
+    search_vector = SearchVectorField(null=True, editable=False)
+    # normalize() of the name, set with content_hash by save() and the loaders
+    search_key = models.TextField(db_index=True, editable=False)
 
     objects = ProductManager()
 
+    class Meta:
+        indexes = [
+            GinIndex(fields=['search_vector'], name='products_search_vector_gin'),
+        ]
+
     def __str__(self):
         return self.name
 
+    def save(self, *args, **kwargs):
+        self.content_hash = self.get_content_hash(self.__dict__)
+        self.search_key = normalize(self.name)
+        super().save(*args, **kwargs)
+
+    @classmethod
+    def get_content_hash(cls, values: dict) -> str:
+        """
+        Get the digest of the CONTENT_FIELDS of a product
+
+        :param values: product dict, or __dict__ of a Product
+        :return: str - 32 hexadecimal characters
+
+        """
+        content = json.dumps([values[field] for field in cls.CONTENT_FIELDS], ensure_ascii=False)
+
+        return hashlib.md5(content.encode()).hexdigest()
+
     @property
     def nutriscore_img(self):
         """
@@ -57,3 +97,58 @@ class Product(models.Model):
         return product_url
 
 
+class IngestCheckpoint(models.Model):
+    """
+    Progress of db_init in one of its categories, saved after each page so that a failed run can be resumed
+
+    """
+    category = models.OneToOneField(Category, on_delete=models.CASCADE, related_name='checkpoint')
+    position = models.PositiveIntegerField()
+    offset = models.PositiveIntegerField(default=0)
+    products_added = models.PositiveIntegerField(default=0)
+    completed = models.BooleanField(default=False)
+
+    def __str__(self):
+        return f"{self.category} : {self.products_added} products, offset {self.offset}"
+
+
+class SyncState(models.Model):
+    """
+    Watermark of an incremental sync: the most recent OFF last_modified_t already synced
+
+    """
+    name = models.CharField(max_length=50, unique=True)
+    last_modified_t = models.BigIntegerField()
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.name} : {self.last_modified_t}"
+
+
+class CatalogVersion(models.Model):
+    """
+    Counter bumped by the commands writing the products, so that the processes serving the site
+    know when to rebuild what they derive from the catalog, e.g. the autocomplete index
+
+    """
+    version = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Catalog version {self.version}"
+
+    @classmethod
+    def get_version(cls) -> int:
+        return cls.objects.filter(pk=1).values_list('version', flat=True).first() or 0
+
+    @classmethod
+    def bump(cls) -> None:
+        """
+        Increment the version of the catalog, once the products have been written
+
+        :return: None
+
+        """
+        _, created = cls.objects.get_or_create(pk=1, defaults={'version': 1})
+        if not created:
+            cls.objects.filter(pk=1).update(version=models.F('version') + 1, updated_at=timezone.now())
@@ -0,0 +1,142 @@
+import queue
+import threading
+import time
+from collections import namedtuple
+
+# Markers sent by the producer thread along with the products
+_Deferred = namedtuple('_Deferred', ['callback', 'args'])
+_Failure = namedtuple('_Failure', ['exception'])
+_END = object()
+
+
+class IngestPipeline:
+    """
+    Runs the products source (fetch, parsing, validation and deduplication of get_products())
+    in a producer thread and the DB writes in the calling thread, overlapping both.
+
+    They are linked by a queue of queue_size products: when the DB is slower than the network, the producer
+    blocks on the full queue and stops requesting pages, so the memory used stays bounded.
+    Only the calling thread touches the DB. The progress is printed every report_interval seconds.
+
+    """
+    _QUEUE_SIZE = 1000
+    _REPORT_INTERVAL = 10.0
+
+    def __init__(self, queue_size=_QUEUE_SIZE, report_interval=_REPORT_INTERVAL):
+        self.queue_size = queue_size
+        self.report_interval = report_interval
+        self.produced = 0
+        self.consumed = 0
+        self.max_depth = 0
+        # Backpressure: time the producer waited for the writer, and the writer for the producer
+        self.producer_wait = 0.0
+        self.consumer_wait = 0.0
+        self.seconds = 0.0
+        self._start = None
+        self._queue = None
+        self._stop = threading.Event()
+
+    def run(self, products, consume) -> None:
+        """
+        Call consume() with each product of products, in order, until the end of products
+
+        :param products: iterator of products, iterated in the producer thread
+        :param consume: callable writing one product
+        :return: None
+        :raise: the exception raised by products, if any
+
+        """
+        self._queue = queue.Queue(self.queue_size)
+        self._stop.clear()
+        producer = threading.Thread(target=self._produce, args=(products,), name="ingest-producer", daemon=True)
+
+        self._start = time.perf_counter()
+        next_report = self._start + self.report_interval
+        producer.start()
+
+        try:
+            while True:
+                item = self._get()
+                if item is _END:
+                    break
+                if isinstance(item, _Failure):
+                    raise item.exception
+                if isinstance(item, _Deferred):
+                    item.callback(*item.args)
+                    continue
+
+                consume(item)
+                self.consumed += 1
+
+                if time.perf_counter() >= next_report:
+                    print(f"... {self.get_stats()}")
+                    next_report += self.report_interval
+        finally:
+            # The producer may be blocked on a full queue if the writer failed
+            self._stop.set()
+            producer.join()
+            self.seconds = time.perf_counter() - self._start
+
+    def defer(self, callback, *args) -> None:
+        """
+        From the producer thread, call callback(*args) in the writer thread once the products
+        produced until now are consumed, e.g. the on_progress callback of get_products()
+
+        :return: None
+
+        """
+        self._put(_Deferred(callback, args))
+
+    def _produce(self, products) -> None:
+        try:
+            for product in products:
+                if not self._put(product):
+                    break
+                self.produced += 1
+        except Exception as e:
+            self._put(_Failure(e))
+        else:
+            self._put(_END)
+        finally:
+            # Cancels the pending requests of a source stopped early
+            if hasattr(products, 'close'):
+                products.close()
+
+    def _put(self, item) -> bool:
+        """
+        Wait for a free slot in the queue, unless the pipeline is stopped
+
+        :param item: product or marker
+        :return: bool - item queued
+
+        """
+        start = time.perf_counter()
+
+        try:
+            while not self._stop.is_set():
+                try:
+                    self._queue.put(item, timeout=0.1)
+                except queue.Full:
+                    continue
+
+                self.max_depth = max(self.max_depth, self._queue.qsize())
+                return True
+
+            return False
+        finally:
+            self.producer_wait += time.perf_counter() - start
+
+    def _get(self):
+        start = time.perf_counter()
+        item = self._queue.get()
+        self.consumer_wait += time.perf_counter() - start
+
+        return item
+
+    def get_stats(self) -> str:
+        seconds = self.seconds or (time.perf_counter() - self._start if self._start is not None else 0.0)
+        rate = self.consumed / seconds if seconds else 0.0
+
+        return f"{self.produced} products fetched, {self.consumed} written ({rate:.0f}/s), " \
+               f"queue {self._queue.qsize() if self._queue else 0}/{self.queue_size} (max {self.max_depth}), " \
+               f"fetching waited {self.producer_wait:.1f}s for the writes, writes waited {self.consumer_wait:.1f}s"
@@ -0,0 +1,178 @@
+import copy
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+
+from products.models import CatalogVersion, Product
+from products.text import normalize
+
+_MISSING = object()
+
+
+class LRUCache:
+    """
+    Thread-safe dict of at most max_size items, the least recently used one being evicted first
+
+    """
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            value = self._items.get(key, _MISSING)
+            if value is _MISSING:
+                self.misses += 1
+                return default
+
+            self._items.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value) -> None:
+        with self._lock:
+            self._items[key] = value
+            self._items.move_to_end(key)
+            if len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._items.clear()
+
+    def __len__(self):
+        return len(self._items)
+
+
+class ResultCache:
+    """
+    Results of the product searches, in an LRU of the process then, if shared_alias is set,
+    in a cache of settings.CACHES shared by the processes (e.g. memcached or redis).
+
+    Keys hold the version of the catalog: once db_init, db_update or catalog_sync bumped it,
+    the results of the previous version are never read again and age out of the caches.
+    The version itself is read from the DB at most every version_ttl seconds,
+    so that repeated searches cost no query.
+
+    """
+    def __init__(self, max_size: int, shared_alias=None, timeout=None, version_ttl=5.0):
+        """
+        :param max_size: number of results kept by the process
+        :param shared_alias: alias of settings.CACHES, None for the process cache only
+        :param timeout: seconds a result is kept by the shared cache, None for its default
+        :param version_ttl: seconds the version of the catalog is trusted
+
+        """
+        self.lru = LRUCache(max_size)
+        self.shared = caches[shared_alias] if shared_alias else None
+        self.timeout = timeout
+        self.version_ttl = version_ttl
+        self._version = None
+        self._version_expires = 0.0
+
+    def get_version(self) -> int:
+        now = time.monotonic()
+        if self._version is None or now >= self._version_expires:
+            self._version = CatalogVersion.get_version()
+            self._version_expires = now + self.version_ttl
+
+        return self._version
+
+    def get_or_compute(self, name: str, key: str, compute):
+        """
+        Get the cached result of a search, computed and cached on a miss
+
+        :param name: name of the search, e.g. 'autocomplete'
+        :param key: key of the search, e.g. the normalized text searched
+        :param compute: function computing the result, a picklable value for the shared cache
+        :return: a copy of the result, so that the callers may change it (e.g. Product.is_favorite)
+
+        """
+        # Fixed length and no spaces, as memcached requires
+        cache_key = f"products:{name}:{self.get_version()}:{hashlib.md5(key.encode()).hexdigest()}"
+
+        value = self.lru.get(cache_key, _MISSING)
+        if value is _MISSING and self.shared is not None:
+            value = self.shared.get(cache_key, _MISSING)
+            if value is not _MISSING:
+                self.lru.set(cache_key, value)
+
+        if value is _MISSING:
+            value = compute()
+            self.lru.set(cache_key, value)
+            if self.shared is not None:
+                self.shared.set(cache_key, value, self.timeout)
+
+        return copy.deepcopy(value)
+
+    def clear(self) -> None:
+        """
+        Forget the results of the process and the version read, not the ones of the shared cache
+
+        :return: None
+
+        """
+        self.lru.clear()
+        self._version = None
+
+    def get_stats(self) -> str:
+        requests = self.lru.hits + self.lru.misses
+        hit_rate = self.lru.hits / requests if requests else 0.0
+        return f"{len(self.lru)} results, {self.lru.hits} hits, {self.lru.misses} misses ({hit_rate:.0%})"
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache() -> ResultCache:
+    """
+    Get the cache of the process, created from the settings the first time
+
+    :return: ResultCache
+
+    """
+    global _cache
+
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = ResultCache(settings.PRODUCTS_CACHE_SIZE, settings.PRODUCTS_CACHE_ALIAS,
+                                     settings.PRODUCTS_CACHE_TIMEOUT, settings.PRODUCTS_CACHE_VERSION_TTL)
+
+    return _cache
+
+
+def search_autocomplete(user_search: str) -> list:
+    """
+    Cached ProductManager.search_autocomplete(), its results only depend on the normalized search
+
+    """
+    return get_cache().get_or_compute('autocomplete', normalize(user_search),
+                                      lambda: Product.objects.search_autocomplete(user_search))
+
+
+def get_old_product(user_search):
+    """
+    Cached ProductManager.get_old_product(). Keyed on the search as typed rather than normalized,
+    the product of the exact name being preferred among the ones of a search key
+
+    """
+    return get_cache().get_or_compute('old_product', str(user_search).strip(),
+                                      lambda: Product.objects.get_old_product(user_search))
+
+
+def get_better_products(old_product: Product) -> list:
+    """
+    Cached ProductManager.get_better_products()
+
+    """
+    return get_cache().get_or_compute('better_products', str(old_product.code),
+                                      lambda: list(Product.objects.get_better_products(old_product)))
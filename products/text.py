@@ -0,0 +1,21 @@
+import re
+import unicodedata
+
+_SEPARATORS = re.compile(r"[\W_]+")
+
+
+def normalize(text: str) -> str:
+    """
+    Get a text lowercased, without accents and with its punctuation folded to single spaces,
+    e.g. "Crème brûlée, L'Œuf" -> "creme brulee l œuf"
+
+    :param text: e.g. a product name or a search
+    :return: str
+
+    """
+    text = text.lower()
+    if not text.isascii():
+        text = unicodedata.normalize('NFKD', text)
+        text = "".join(char for char in text if not unicodedata.combining(char))
+
+    return _SEPARATORS.sub(" ", text).strip()
@@ -3,6 +3,7 @@ from django.http import HttpResponse, JsonResponse
 from django.core.exceptions import ObjectDoesNotExist
 from django.contrib import messages
 
+from . import autocomplete, result_cache
 from .forms import SearchForm
 from .models import Product, Category
 from favorites.models import Favorite
@@ -18,7 +19,12 @@ def product_autocomplete(request):
     user_search = request.GET.get('term')
 
     if user_search is not None:
-        results = Product.objects.search_autocomplete(user_search)
+        # The DB is only used until the in memory index of the process is built
+        index = autocomplete.get_index()
+        if index is not None:
+            results = index.search(user_search)
+        else:
+            results = result_cache.search_autocomplete(user_search)
 
         return JsonResponse(results, safe=False)
 
@@ -28,13 +34,13 @@ def product_search(request):
 
     if form.is_valid():
         user_search = form.cleaned_data["search"]
-        old_product = Product.objects.get_old_product(user_search)
+        old_product = result_cache.get_old_product(user_search)
 
         if old_product is None:
             messages.add_message(request, messages.INFO, f"Désolé ! Nous n'avons rien trouvé pour remplacer {user_search}.")
             return redirect("products:index")
 
-        better_products = Product.objects.get_better_products(old_product)
+        better_products = result_cache.get_better_products(old_product)
 
         if request.user.is_authenticated:
             for product in better_products:
@@ -135,3 +135,20 @@ STATIC_URL = '/static/'
 
 # User model
 AUTH_USER_MODEL = "users.User"
+
+
+# OpenFoodFacts responses cache used by db_init and db_update
+OPENFOODFACTS_CACHE_DIR = os.getenv("OFF_CACHE_DIR", os.path.join(BASE_DIR, ".off_cache"))
+OPENFOODFACTS_CACHE_TTL = 24 * 60 * 60
+OPENFOODFACTS_CACHE_MAX_SIZE = 500 * 1024 * 1024
+
+
+# In memory autocomplete index of each WSGI process, rebuilt when db_init, db_update or catalog_sync change the catalog
+AUTOCOMPLETE_INDEX = os.getenv("AUTOCOMPLETE_INDEX", "1") == "1"
+AUTOCOMPLETE_INDEX_REFRESH_INTERVAL = 60
+
+# Results of the product searches by catalog version, kept by each process and, if set, by this entry of CACHES
+PRODUCTS_CACHE_SIZE = 5000
+PRODUCTS_CACHE_ALIAS = os.getenv("PRODUCTS_CACHE_ALIAS")
+PRODUCTS_CACHE_TIMEOUT = 24 * 60 * 60
+PRODUCTS_CACHE_VERSION_TTL = 5
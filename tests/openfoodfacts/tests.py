@@ -1,10 +1,22 @@
 from unittest import mock
+import asyncio
 import json
 import copy
+import os
+import gzip
+import time
+import tempfile
 
 from django.test import TestCase, tag
 
-from openfoodfacts.openfoodfacts_api import OpenFoodFactsAPI, OpenFoodFactsException
+from openfoodfacts.openfoodfacts_api import OpenFoodFactsAPI, OpenFoodFactsException, Progress
+from openfoodfacts.openfoodfacts_async_api import AsyncOpenFoodFactsAPI
+from openfoodfacts.http_cache import HTTPCache
+from openfoodfacts.json_stream import iter_array
+from openfoodfacts.metrics import Histogram, Metrics
+from openfoodfacts.openfoodfacts_dump import OpenFoodFactsDump
+from openfoodfacts.scheduler import RequestScheduler, CircuitBreaker
+from openfoodfacts.stub_server import OFFStubServer, make_synthetic_fixtures, record_fixtures
 
 
 class TestOpenFoodFactsAPI(TestCase):
@@ -61,7 +73,7 @@ class TestOpenFoodFactsAPI(TestCase):
                 }
             ]
         })
-        patcher = mock.patch("openfoodfacts.openfoodfacts_api.requests.get")
+        patcher = mock.patch("openfoodfacts.openfoodfacts_api.requests.Session.get")
         self.addCleanup(patcher.stop)
         self.mock_requests = patcher.start()
         self.mock_requests.return_value = self.mock_response = mock.Mock()
@@ -244,6 +256,40 @@ class TestOpenFoodFactsAPI(TestCase):
 
         self.assertEqual(new_prod['code'], products[1]['code'])
 
+    @mock.patch("openfoodfacts.openfoodfacts_api.OpenFoodFactsAPI._check_product_is_fr",
+                return_value=True)
+    def test_get_products_concurrent_keeps_categories_order_and_unicity(self, mock_is_fr):
+        # First page of each category holds its own product plus one shared with all the others,
+        # next pages are empty
+        def fake_get(url, params=None, **kwargs):
+            response = mock.Mock(status_code=200)
+            products = json.loads(self.response_content_prod)['products']
+            if params['page'] != "1":
+                products = []
+            else:
+                products[1]['product_name_fr'] = f"Saucisson {params['tag_2']}"
+            response.content = json.dumps({"products": products[::-1]})
+            return response
+
+        self.mock_requests.side_effect = fake_get
+        categories = ["Boissons", "Charcuterie", "Fromages", "Desserts", "Snacks"]
+
+        api = OpenFoodFactsAPI(len(categories), 2, categories, max_workers=3)
+        products = list(api.get_products())
+
+        names = [product['name'] for product in products]
+        expected = ["Saucisson Boissons", "Saucisson sec"] + [f"Saucisson {category}" for category in categories[1:]]
+        self.assertEqual(expected, names)
+        self.assertEqual(categories[0], products[1]['category'])
+
+    def test_get_products_stops_when_category_is_empty(self):
+        self.mock_response.content = json.dumps({"products": []})
+        self.mock_response.status_code = 200
+
+        api = OpenFoodFactsAPI(1, 5, ['Boissons'])
+
+        self.assertEqual([], list(api.get_products()))
+
     # _check_product_is_fr()
     def test_check_fr_is_true(self):
         prod = json.loads(self.response_content_prod)['products'][0]
@@ -260,3 +306,631 @@ class TestOpenFoodFactsAPI(TestCase):
         is_fr = api._check_product_is_fr(prod)
 
         self.assertFalse(is_fr, msg="A \"Foreign\" product is taken as a French one.")
+
+    def test_session_pool_sized_from_scheduler(self):
+        api = OpenFoodFactsAPI(1, 1, ["Boissons"], max_workers=3)
+
+        self.assertEqual(4, api.scheduler.max_concurrency)
+        self.assertEqual(4, api._session.get_adapter(api._PRODUCTS_URL)._pool_maxsize)
+
+    # _validate_page()
+    def test_validate_page_keeps_order_and_rules(self):
+        product = json.loads(self.response_content_prod)['products'][0]
+        products = [
+            dict(product, countries_lc="en"),
+            dict(product, code=1, product_name_fr="Saucisson &amp; jambon"),
+            dict(product, image_url=""),
+            dict(product, nutriscore_grade="z", countries_lc="en"),
+            dict(product, product_name_fr="z" * 151),
+            dict(product, code=2, nutriscore_score=-3),
+        ]
+
+        results = OpenFoodFactsAPI._validate_page(products, ["Charcuterie"] * len(products))
+
+        self.assertEqual(["not_french", None, "missing_field", "bad_grade", "name_too_long", None],
+                         [reason for _, reason in results])
+        self.assertEqual("Saucisson & jambon", results[1][0]['name'])
+        self.assertEqual((2, -3, "Charcuterie"), (results[5][0]['code'], results[5][0]['nutriscore'],
+                                                  results[5][0]['category']))
+        self.assertEqual([results[1], results[5]],
+                         [(OpenFoodFactsAPI._get_product_dict(product, "Charcuterie"), None)
+                          for product in (products[1], products[5])])
+
+
+class TestAsyncOpenFoodFactsAPI(TestCase):
+
+    def setUp(self) -> None:
+        self.products = [
+            {
+                "code": code,
+                "product_name_fr": name,
+                "image_url": "http://www.saucissonsec.com",
+                "nutriscore_score": "10",
+                "nutriscore_grade": grade,
+                "countries_lc": "fr",
+                "categories_lc": "fr",
+                "labels_lc": "fr",
+                "selected_images": {"ingredients": {"display": {'fr': "http://www.image.com"}}}
+            }
+            for code, name, grade in [(1, "Saucisson sec", "a"), (2, "Saucisson sec", "b"),
+                                      (3, "Jambon", "z"), (4, "Rillettes", "c"), (5, "z" * 160, "a")]
+        ]
+
+    def fake_content(self, params):
+        if params.get('page') == "1":
+            return json.dumps({"products": self.products})
+        if 'page' in params:
+            return json.dumps({"products": []})
+        return json.dumps({"tags": [{"name": "Charcuterie"}, {"name": "Boissons"}]})
+
+    def collect(self, api):
+        async def consume():
+            return [product async for product in api.get_products()]
+
+        return asyncio.run(consume())
+
+    def test_get_categories_when_none_given(self):
+        async def fake_fetch(url, params):
+            return 200, self.fake_content(params)
+
+        api = AsyncOpenFoodFactsAPI(1, 2)
+        with mock.patch.object(api, "_fetch", side_effect=fake_fetch):
+            self.collect(api)
+
+        self.assertEqual(["Charcuterie"], api.categories)
+
+    def test_get_products_same_as_sync_client(self):
+        async def fake_fetch(url, params):
+            return 200, self.fake_content(params)
+
+        def fake_get(url, params=None, **kwargs):
+            return mock.Mock(status_code=200, content=self.fake_content(params))
+
+        categories = ["Charcuterie", "Boissons", "Fromages"]
+
+        api = AsyncOpenFoodFactsAPI(3, 3, list(categories), concurrency=2)
+        with mock.patch.object(api, "_fetch", side_effect=fake_fetch):
+            async_products = self.collect(api)
+
+        with mock.patch("openfoodfacts.openfoodfacts_api.requests.Session.get", side_effect=fake_get):
+            sync_products = list(OpenFoodFactsAPI(3, 3, list(categories)).get_products())
+
+        self.assertEqual(sync_products, async_products)
+        self.assertEqual([1, 4], [product['code'] for product in async_products])
+
+    def test_get_products_status_code_not_200(self):
+        async def fake_fetch(url, params):
+            return 503, self.fake_content(params)
+
+        api = AsyncOpenFoodFactsAPI(1, 1, ["Boissons"])
+
+        with mock.patch.object(api, "_fetch", side_effect=fake_fetch):
+            with self.assertRaises(OpenFoodFactsException):
+                self.collect(api)
+
+
+class TestHTTPCache(TestCase):
+
+    def setUp(self) -> None:
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self.cache = HTTPCache(tmp_dir.name)
+
+        self.categories = json.dumps({"tags": [{"name": "Charcuterie"}]}).encode()
+        patcher = mock.patch("openfoodfacts.openfoodfacts_api.requests.Session.get")
+        self.addCleanup(patcher.stop)
+        self.mock_requests = patcher.start()
+        self.mock_requests.return_value = mock.Mock(status_code=200, content=self.categories,
+                                                    headers={"ETag": '"v1"'})
+
+    def test_fresh_response_served_without_request(self):
+        OpenFoodFactsAPI(1, 1, cache=self.cache)
+        api = OpenFoodFactsAPI(1, 1, cache=self.cache)
+
+        self.assertEqual(["Charcuterie"], api.categories)
+        self.assertEqual(1, self.mock_requests.call_count)
+        self.assertEqual((1, 1, 0), (self.cache.hits, self.cache.misses, self.cache.revalidated))
+
+    def test_stale_response_revalidated_with_etag(self):
+        OpenFoodFactsAPI(1, 1, cache=self.cache)
+        self.cache.ttl = 0
+        self.mock_requests.return_value = mock.Mock(status_code=304, content=b"", headers={})
+
+        api = OpenFoodFactsAPI(1, 1, cache=self.cache)
+
+        self.assertEqual(["Charcuterie"], api.categories)
+        self.assertEqual({"If-None-Match": '"v1"'}, self.mock_requests.call_args[1]['headers'])
+        self.assertEqual(1, self.cache.revalidated)
+
+    def test_error_response_not_cached(self):
+        self.mock_requests.return_value = mock.Mock(status_code=404, content=b"error", headers={})
+
+        with self.assertRaises(OpenFoodFactsException):
+            OpenFoodFactsAPI(1, 1, cache=self.cache)
+
+        self.assertIsNone(self.cache.get("https://fr.openfoodfacts.org/categories", {"json": "true"}))
+
+    def test_least_recently_used_evicted(self):
+        self.cache.max_size = 500
+        for number in range(3):
+            self.cache.set("http://off", {"page": number}, b"x" * 100, {})
+            os.utime(os.path.join(self.cache.directory, self.cache._get_key("http://off", {"page": number})),
+                     (number, number))
+
+        self.cache.set("http://off", {"page": 3}, b"x" * 100, {})
+
+        self.assertIsNone(self.cache.get("http://off", {"page": 0}))
+        self.assertIsNotNone(self.cache.get("http://off", {"page": 3}))
+
+
+class TestJSONStream(TestCase):
+
+    @staticmethod
+    def split(content: bytes, size: int):
+        return [content[i:i + size] for i in range(0, len(content), size)]
+
+    def test_iter_array_small_chunks(self):
+        data = {"count": 12345, "page": {"nested": [1, 2]},
+                "products": [{"name": "Crème brûlée", "score": 10}, {"name": "Pâté", "score": -1.5}],
+                "skip": 0}
+        content = json.dumps(data, ensure_ascii=False).encode("utf-8")
+
+        for size in (1, 3, 7, len(content)):
+            self.assertEqual(data['products'], list(iter_array(self.split(content, size), "products")))
+
+    def test_iter_array_numbers_split_by_chunks(self):
+        self.assertEqual([1500.5, 2], list(iter_array([b'{"products": [1500.', b'5, 2]}'], "products")))
+        self.assertEqual([12e3], list(iter_array([b'{"products": [12e', b'3]}'], "products")))
+
+        data = {"products": [{"energy": 1500.25, "salt": 1.2e-05, "fat": -3E+2, "sugars": 0.0, "count": 10}]}
+        content = json.dumps(data).encode("utf-8")
+        for size in range(1, 12):
+            self.assertEqual(data['products'], list(iter_array(self.split(content, size), "products")))
+
+    def test_iter_array_stops_reading_after_array(self):
+        content = json.dumps({"tags": [{"name": "Charcuterie"}, {"name": "Boissons"}],
+                              "other": "x" * 100}).encode("utf-8")
+        chunks = iter(self.split(content, 10))
+
+        tags = iter_array(chunks, "tags")
+        self.assertEqual({"name": "Charcuterie"}, next(tags))
+        self.assertLess(len(b"".join(chunks)), len(content) - 30)
+
+    def test_iter_array_missing_key(self):
+        with self.assertRaises(KeyError):
+            list(iter_array([b'{"count": 1}'], "products"))
+
+    def test_iter_array_malformed(self):
+        with self.assertRaises(ValueError):
+            list(iter_array([b'{"products": [{"name": 1}'], "products"))
+
+    @mock.patch("openfoodfacts.openfoodfacts_api.requests.Session.get")
+    def test_api_categories_stop_download_once_collected(self, mock_get):
+        content = json.dumps({"count": 3, "tags": [{"name": f"Category {i}"} for i in range(1000)]}).encode()
+        chunks = iter(self.split(content, 64))
+        mock_get.return_value = mock.Mock(status_code=200)
+        mock_get.return_value.iter_content.return_value = chunks
+
+        api = OpenFoodFactsAPI(2, 1, stream_json=True, cache=None)
+
+        self.assertEqual(["Category 0", "Category 1"], api.categories)
+        self.assertTrue(mock_get.call_args[1]['stream'])
+        self.assertTrue(list(chunks), msg="The whole categories list was downloaded")
+
+    @mock.patch("openfoodfacts.openfoodfacts_api.OpenFoodFactsAPI._check_product_is_fr", return_value=True)
+    @mock.patch("openfoodfacts.openfoodfacts_api.requests.Session.get")
+    def test_api_products_streamed(self, mock_get, mock_is_fr):
+        product = {
+            "code": 1, "product_name_fr": "Saucisson sec", "image_url": "http://www.saucissonsec.com",
+            "nutriscore_score": "10", "nutriscore_grade": "a",
+            "selected_images": {"ingredients": {"display": {'fr': "http://www.image.com"}}}
+        }
+        products = [dict(product, code=code, product_name_fr=f"Saucisson {code}") for code in range(3)]
+
+        def fake_get(url, params=None, **kwargs):
+            response = mock.Mock(status_code=200)
+            page = products if params['page'] == "1" else []
+            response.iter_content.return_value = self.split(json.dumps({"products": page}).encode(), 16)
+            return response
+
+        mock_get.side_effect = fake_get
+
+        api = OpenFoodFactsAPI(1, 5, ["Charcuterie"], stream_json=True)
+
+        self.assertEqual([0, 1, 2], [product['code'] for product in api.get_products()])
+
+    @mock.patch("openfoodfacts.openfoodfacts_api.OpenFoodFactsAPI._check_product_is_fr", return_value=True)
+    @mock.patch("openfoodfacts.openfoodfacts_api.requests.Session.get")
+    def test_api_page_validated_while_streamed(self, mock_get, mock_is_fr):
+        product = {
+            "code": 1, "product_name_fr": "Saucisson sec", "image_url": "http://www.saucissonsec.com",
+            "nutriscore_score": "10", "nutriscore_grade": "a",
+            "selected_images": {"ingredients": {"display": {'fr': "http://www.image.com"}}}
+        }
+        products = [dict(product, code=code, product_name_fr=f"Saucisson {code}") for code in range(250)]
+        chunks = iter(self.split(json.dumps({"products": products}).encode(), 64))
+        mock_get.return_value = mock.Mock(status_code=200)
+        mock_get.return_value.iter_content.return_value = chunks
+
+        api = OpenFoodFactsAPI(1, 250, ["Charcuterie"], stream_json=True, cache=None)
+
+        self.assertEqual(0, next(api.get_products())['code'])
+        # Only the first batch of the page was read
+        self.assertTrue(list(chunks), msg="The whole page was read before the first product")
+
+
+class TestOpenFoodFactsDump(TestCase):
+
+    def setUp(self) -> None:
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self.tmp_dir = tmp_dir.name
+
+        product = {
+            "code": "12345",
+            "product_name_fr": "Saucisson sec",
+            "image_url": "http://www.saucissonsec.com",
+            "nutriscore_score": 10,
+            "nutriscore_grade": "a",
+            "countries_lc": "fr",
+            "categories_lc": "fr",
+            "labels_lc": "fr",
+            "categories": "Viandes, Charcuteries, Saucissons secs",
+            "selected_images": {"ingredients": {"display": {'fr': "http://www.image.com"}}}
+        }
+        self.products = [
+            product,
+            dict(product, code="2", product_name_fr="Saucisson sec"),
+            dict(product, code="3", product_name_fr="Jambon", categories="Viandes, Jambons"),
+            dict(product, code="4", product_name_fr="Cola", categories="Boissons", countries_lc="en"),
+            dict(product, code="not a code", product_name_fr="Rillettes"),
+            dict(product, code="6", product_name_fr="Rosette"),
+        ]
+
+    def write_jsonl(self, name, compress=False):
+        path = os.path.join(self.tmp_dir, name)
+        lines = "\n".join(json.dumps(product) for product in self.products) + "\n"
+        with (gzip.open(path, "wt", encoding="utf-8") if compress else open(path, "w", encoding="utf-8")) as f:
+            f.write(lines)
+        return path
+
+    def test_jsonl_gz_filters_and_unicity(self):
+        dump = OpenFoodFactsDump(self.write_jsonl("products.jsonl.gz", compress=True))
+
+        products = list(dump.get_products())
+
+        self.assertEqual([12345, 3, 6], [int(product['code']) for product in products])
+        self.assertEqual(["Saucissons secs", "Jambons"], dump.categories)
+        self.assertEqual({'rejected_not_french': 1, 'rejected_duplicate': 1}, dump.metrics.counters)
+
+    def test_category_filters_and_quota(self):
+        dump = OpenFoodFactsDump(self.write_jsonl("products.jsonl"), categories=["charcuteries", "Jambons"],
+                                 number_products_by_category=1)
+
+        products = list(dump.get_products())
+
+        self.assertEqual([("12345", "charcuteries"), ("3", "Jambons")],
+                         [(product['code'], product['category']) for product in products])
+
+    def test_csv(self):
+        path = os.path.join(self.tmp_dir, "products.csv")
+        header = ["code", "product_name", "lang", "countries_tags", "categories", "image_url",
+                  "image_ingredients_url", "nutriscore_score", "nutriscore_grade"]
+        rows = [
+            ["12345", "Saucisson sec", "fr", "en:france,en:belgium", "Viandes,Charcuteries", "http://img",
+             "http://ingredients", "10", "b"],
+            ["999", "Cola", "en", "en:united-states", "Boissons", "http://img", "http://ingredients", "15", "e"],
+        ]
+        with open(path, "w", encoding="utf-8") as f:
+            f.write("\n".join("\t".join(row) for row in [header] + rows) + "\n")
+
+        products = list(OpenFoodFactsDump(path).get_products())
+
+        self.assertEqual(1, len(products))
+        self.assertEqual({'code': "12345", 'name': "Saucisson sec", 'image_url': "http://img", 'nutriscore': 10,
+                          'nutriscore_grade': "b", 'ingredients_image': "http://ingredients",
+                          'category': "Charcuteries"}, products[0])
+
+    def test_invalid_jsonl(self):
+        path = os.path.join(self.tmp_dir, "products.jsonl")
+        with open(path, "w", encoding="utf-8") as f:
+            f.write("{not json}\n")
+
+        with self.assertRaises(OpenFoodFactsException):
+            list(OpenFoodFactsDump(path).get_products())
+
+
+class TestRequestScheduler(TestCase):
+
+    def setUp(self) -> None:
+        product = {
+            "code": "1",
+            "product_name_fr": "Saucisson sec",
+            "image_url": "http://www.saucissonsec.com",
+            "nutriscore_score": 10,
+            "nutriscore_grade": "a",
+            "countries_lc": "fr",
+            "categories_lc": "fr",
+            "labels_lc": "fr",
+            "selected_images": {"ingredients": {"display": {'fr': "http://www.image.com"}}}
+        }
+        self.categories = ["Charcuterie", "Boissons", "Fromages"]
+        self.products = {
+            category: [dict(product, code=str(index * 10 + number), product_name_fr=f"{category} {number}")
+                       for number in range(5)]
+            for index, category in enumerate(self.categories)
+        }
+
+    @staticmethod
+    def get_scheduler(**kwargs):
+        return RequestScheduler(max_concurrency=4, backoff_base=0.001,
+                                circuit_breaker=CircuitBreaker(reset_timeout=0.01), **kwargs)
+
+    def test_retry_on_server_errors(self):
+        with OFFStubServer(self.categories, fail_first=2) as server:
+            scheduler = self.get_scheduler()
+            api = OpenFoodFactsAPI(3, 1, off_url=server.url, scheduler=scheduler)
+
+        self.assertEqual(self.categories, api.categories)
+        self.assertEqual(3, server.requests_count)
+        self.assertEqual(2, scheduler.retries)
+
+    def test_retry_on_too_many_requests(self):
+        with OFFStubServer(self.categories, fail_first=1, error_status=429) as server:
+            api = OpenFoodFactsAPI(3, 1, off_url=server.url, scheduler=self.get_scheduler())
+
+        self.assertEqual(self.categories, api.categories)
+
+    def test_give_up_after_max_retries(self):
+        with OFFStubServer(self.categories, fail_first=10) as server:
+            with self.assertRaises(OpenFoodFactsException):
+                OpenFoodFactsAPI(3, 1, off_url=server.url, scheduler=self.get_scheduler(max_retries=2))
+
+        self.assertEqual(3, server.requests_count)
+
+    def test_not_found_not_retried(self):
+        with OFFStubServer(self.categories) as server:
+            api = OpenFoodFactsAPI(1, 1, self.categories[:1], off_url=server.url + "missing/",
+                                   scheduler=self.get_scheduler())
+            with self.assertRaises(OpenFoodFactsException):
+                next(api.get_products())
+
+        self.assertEqual(1, server.requests_count)
+
+    def test_products_with_random_errors_and_latency(self):
+        with OFFStubServer(self.categories, self.products, latency=0.01, error_rate=0.3,
+                           error_status=502, seed=1) as server:
+            api = OpenFoodFactsAPI(3, 5, self.categories, off_url=server.url,
+                                   scheduler=self.get_scheduler(max_retries=10))
+            products = list(api.get_products())
+
+        self.assertGreater(server.errors_count, 0)
+        self.assertEqual([f"{category} {number}" for category in self.categories for number in range(5)],
+                         [product['name'] for product in products])
+
+    def test_aimd_limit(self):
+        scheduler = RequestScheduler(max_concurrency=8, circuit_breaker=CircuitBreaker(failure_threshold=100))
+
+        scheduler.acquire()
+        scheduler.release(success=False)
+        self.assertEqual(4, scheduler.limit)
+
+        for _ in range(4):
+            scheduler.acquire()
+            scheduler.release(success=True)
+        self.assertAlmostEqual(5, scheduler.limit, delta=0.2)
+
+        for _ in range(10):
+            scheduler.acquire()
+            scheduler.release(success=False)
+        self.assertEqual(scheduler.min_concurrency, scheduler.limit)
+
+    def test_circuit_breaker(self):
+        circuit_breaker = CircuitBreaker(failure_threshold=2, reset_timeout=0.05)
+
+        circuit_breaker.record(False)
+        self.assertFalse(circuit_breaker.is_open())
+        circuit_breaker.record(False)
+        self.assertTrue(circuit_breaker.is_open())
+        self.assertGreater(circuit_breaker.get_wait(), 0)
+
+        time.sleep(0.06)
+        self.assertEqual(0, circuit_breaker.get_wait())
+        circuit_breaker.record(True)
+        self.assertFalse(circuit_breaker.is_open())
+
+
+class TestPageSizing(TestCase):
+
+    def setUp(self) -> None:
+        product = {
+            "product_name_fr": "Saucisson sec",
+            "image_url": "http://www.saucissonsec.com",
+            "nutriscore_score": 10,
+            "nutriscore_grade": "a",
+            "countries_lc": "fr",
+            "categories_lc": "fr",
+            "labels_lc": "fr",
+            "selected_images": {"ingredients": {"display": {'fr': "http://www.image.com"}}}
+        }
+        # One product out of two is not French
+        self.products = [dict(product, code=str(code), product_name_fr=f"Saucisson {code}",
+                              countries_lc="fr" if code % 2 == 0 else "en")
+                         for code in range(600)]
+
+    def get_products(self, server, number_products):
+        api = OpenFoodFactsAPI(1, number_products, ["Charcuterie"], off_url=server.url)
+        return [int(product['code']) for product in api.get_products()]
+
+    def test_small_quota_small_page(self):
+        with OFFStubServer(products={"Charcuterie": self.products}) as server:
+            codes = self.get_products(server, 10)
+
+        self.assertEqual(list(range(0, 20, 2)), codes)
+        self.assertEqual([("Charcuterie", 1, 25)], server.search_requests)
+
+    def test_page_shrinks_near_quota_and_is_prefetched(self):
+        with OFFStubServer(products={"Charcuterie": self.products}) as server:
+            codes = self.get_products(server, 140)
+
+        self.assertEqual(list(range(0, 280, 2)), codes)
+        # Second page of 50 products starting at the 250th
+        self.assertEqual([("Charcuterie", 1, 250), ("Charcuterie", 6, 50)], sorted(server.search_requests))
+
+    def test_last_page_not_full_ends_category(self):
+        with OFFStubServer(products={"Charcuterie": self.products[:260]}) as server:
+            codes = self.get_products(server, 1000)
+
+        self.assertEqual(list(range(0, 260, 2)), codes)
+        self.assertEqual([("Charcuterie", 1, 250), ("Charcuterie", 2, 250)], sorted(server.search_requests))
+
+    def test_progress_after_each_page(self):
+        progress = []
+        with OFFStubServer(products={"Charcuterie": self.products[:260]}) as server:
+            api = OpenFoodFactsAPI(1, 1000, ["Charcuterie"], off_url=server.url)
+            list(api.get_products(on_progress=lambda category, step: progress.append(step)))
+
+        self.assertEqual([Progress(250, 125, False), Progress(500, 130, True)], progress)
+
+    def test_resume_from_progress(self):
+        resume = {"Charcuterie": Progress(250, 125, False)}
+        with OFFStubServer(products={"Charcuterie": self.products[:260]}) as server:
+            api = OpenFoodFactsAPI(1, 130, ["Charcuterie"], off_url=server.url)
+            codes = [int(product['code']) for product in api.get_products(resume=resume)]
+
+        self.assertEqual(list(range(250, 260, 2)), codes)
+        self.assertEqual([("Charcuterie", 11, 25)], server.search_requests)
+
+    def test_resume_skips_completed_and_known_names(self):
+        resume = {"Charcuterie": Progress(0, 10, True)}
+        with OFFStubServer(products={"Charcuterie": self.products, "Fromages": self.products}) as server:
+            api = OpenFoodFactsAPI(2, 5, ["Charcuterie", "Fromages"], off_url=server.url)
+            products = list(api.get_products(resume=resume, known_names={"Saucisson 0"}))
+
+        self.assertEqual({"Fromages"}, {product['category'] for product in products})
+        self.assertEqual(list(range(2, 12, 2)), [int(product['code']) for product in products])
+
+
+class TestModifiedSince(TestCase):
+
+    def setUp(self) -> None:
+        fixtures = make_synthetic_fixtures(1, 600, invalid_rate=0)
+        self.category = fixtures['categories'][0]
+        self.products = fixtures['products'][self.category]
+        for number, product in enumerate(self.products):
+            product['last_modified_t'] = 1000 + number
+
+    def test_only_products_modified_since(self):
+        with OFFStubServer(products={self.category: self.products}) as server:
+            api = OpenFoodFactsAPI(1, float('inf'), [self.category], off_url=server.url, modified_since=1300)
+            products = list(api.get_products())
+
+        self.assertEqual(299, len(products))
+        self.assertEqual(1599, api.last_modified_t)
+        # Paging stops at the first product not modified, the next page may have been prefetched
+        pages = {page for _, page, _ in server.search_requests}
+        self.assertTrue({1, 2} <= pages <= {1, 2, 3})
+
+    def test_no_page_requested_after_the_last_one(self):
+        with OFFStubServer(products={self.category: self.products}) as server:
+            api = OpenFoodFactsAPI(1, float('inf'), [self.category], off_url=server.url, modified_since=0)
+            products = list(api.get_products())
+
+        self.assertEqual(600, len(products))
+        # The third page is not full, the fourth one is never requested
+        self.assertEqual([1, 2, 3], sorted(page for _, page, _ in server.search_requests))
+
+    def test_dump_modified_since(self):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        path = os.path.join(tmp_dir.name, "products.jsonl")
+        with open(path, "w", encoding="utf-8") as f:
+            f.write("\n".join(json.dumps(dict(product, categories=self.category)) for product in self.products))
+
+        dump = OpenFoodFactsDump(path, modified_since=1590)
+
+        self.assertEqual(9, len(list(dump.get_products())))
+        self.assertEqual(1599, dump.last_modified_t)
+
+
+class TestProductsByCode(TestCase):
+
+    def test_products_by_code(self):
+        fixtures = make_synthetic_fixtures(2, 10, invalid_rate=0)
+        fixtures['products'][fixtures['categories'][0]][1]['countries_lc'] = "en"
+        codes = ["12", "2", "999", "1", "3"]
+
+        with OFFStubServer(fixtures['categories'], fixtures['products']) as server:
+            api = OpenFoodFactsAPI(2, 0, fixtures['categories'], off_url=server.url, max_workers=2)
+            products = list(api.get_products_by_code(iter(codes)))
+
+        # Not found and not French products are skipped, the order is kept
+        self.assertEqual(["12", "1", "3"], [product['code'] for product in products])
+        self.assertEqual(len(codes), server.requests_count)
+        self.assertIsNone(products[0]['category'])
+
+
+class TestMetrics(TestCase):
+
+    def test_histogram_percentiles(self):
+        histogram = Histogram()
+        for value in [3] * 90 + [40] * 9 + [20000]:
+            histogram.add(value)
+
+        self.assertEqual(5, histogram.get_percentile(50))
+        self.assertEqual(50, histogram.get_percentile(95))
+        self.assertEqual(20000, histogram.get_percentile(100))
+
+    def test_merge(self):
+        metrics, other = Metrics(), Metrics()
+        metrics.add_time('http', 1.0)
+        metrics.count('rejected_not_french')
+        other.add_http_latency(0.5)
+        other.count('rejected_not_french', 2)
+
+        metrics.merge(other.to_dict())
+
+        data = metrics.to_dict()
+        self.assertEqual({'seconds': 1.5, 'count': 2}, data['stages']['http'])
+        self.assertEqual({'rejected_not_french': 3}, data['counters'])
+        self.assertEqual(1, data['http_latency_ms']['count'])
+
+    def test_rejections_by_rule(self):
+        products = make_synthetic_fixtures(1, 6, invalid_rate=0)['products']
+        category = list(products)[0]
+        rejected = products[category]
+        rejected[0]['countries_lc'] = "en"
+        del rejected[1]['image_url']
+        rejected[2]['nutriscore_grade'] = "z"
+        rejected[3]['product_name_fr'] = "z" * 160
+        rejected[5]['product_name_fr'] = rejected[4]['product_name_fr']
+
+        with OFFStubServer([category], products) as server:
+            api = OpenFoodFactsAPI(1, 10, [category], off_url=server.url)
+            self.assertEqual(1, len(list(api.get_products())))
+
+        data = api.metrics.to_dict()
+        self.assertEqual({'rejected_not_french': 1, 'rejected_missing_field': 1, 'rejected_bad_grade': 1,
+                          'rejected_name_too_long': 1, 'rejected_duplicate': 1}, data['counters'])
+        self.assertEqual(6, data['stages']['validate']['count'])
+        self.assertEqual(1, data['stages']['parse']['count'])
+        self.assertEqual(1, data['http_latency_ms']['count'])
+
+
+class TestReplayFixtures(TestCase):
+
+    def test_record_and_replay(self):
+        fixtures = make_synthetic_fixtures(3, 40, invalid_rate=0.5)
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        path = os.path.join(tmp_dir.name, "fixtures.json.gz")
+
+        with OFFStubServer(fixtures['categories'], fixtures['products']) as server:
+            record_fixtures(path, 2, 30, off_url=server.url)
+            live_products = list(OpenFoodFactsAPI(2, 10, off_url=server.url).get_products())
+
+        with OFFStubServer.from_fixtures(path) as server:
+            replayed_products = list(OpenFoodFactsAPI(2, 10, off_url=server.url).get_products())
+
+        self.assertEqual(20, len(live_products))
+        self.assertEqual(live_products, replayed_products)
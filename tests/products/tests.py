@@ -1,12 +1,29 @@
 import os
+import io
 import json
+import tempfile
+import time
+from contextlib import redirect_stdout
 from unittest import mock, skip
 
-from django.test import TestCase, tag
+from django.db import connection
+from django.test import TestCase, TransactionTestCase, override_settings, tag
 from django.shortcuts import reverse
 from django.contrib.messages import get_messages
-
-from products.models import Product, Category
+from django.core.management import call_command, CommandError
+from model_bakery import baker
+
+from products import autocomplete, result_cache
+from products.result_cache import LRUCache, ResultCache
+from products.autocomplete import AutocompleteIndex
+from products.text import normalize
+from products.models import Product, Category, IngestCheckpoint, SyncState, CatalogVersion
+from products.loaders import ProductLoader, CopyProductLoader, ProductUpdater, ProductUpserter
+from products.pipeline import IngestPipeline
+from products.management.workers import run_in_processes
+from products.management.commands.db_update import Command as DbUpdateCommand
+from openfoodfacts.stub_server import OFFStubServer, make_synthetic_fixtures
+from favorites.models import Favorite
 
 
 class ProductModelTests(TestCase):
@@ -48,10 +65,66 @@ class ProductModelTests(TestCase):
     def test_search_autocomplete_ten_products(self):
         self.assertEqual(10, len(Product.objects.search_autocomplete("Sauciss")))
 
-    def test_search_autocomplete_order_by_nutriscore_desc(self):
-        products = Product.objects.search_autocomplete("Sauciss")
-        worst_prod = Product.objects.get(code=98765)
-        self.assertEqual(worst_prod.name, products[0], msg="The first product is not the worst")
+    def test_search_autocomplete_order_by_similarity_then_nutriscore_desc(self):
+        Product.objects.create(code=4, name="Saucisson sec 4", image_url="", nutriscore=50, nutriscore_grade="e",
+                               ingredients_image="", category=Category.objects.get(name="Charcuterie"))
+
+        products = Product.objects.search_autocomplete("sauciss")
+
+        # Names starting with the search, the shortest first, then the worst nutriscore
+        self.assertEqual(["Saucisson sec", "Saucisson sec 4", "Saucisson sec 2"], products[:3])
+        # Then the names containing it, "Worst Saucisson sec" being cut by the limit
+        self.assertEqual(10, len(products))
+        self.assertEqual("Best Saucisson sec", products[-1])
+
+    def test_search_autocomplete_min_length(self):
+        self.assertEqual([], Product.objects.search_autocomplete(" sa "))
+        self.assertEqual(["Best Saucisson sec"], Product.objects.search_autocomplete("bes"))
+
+    def test_search_autocomplete_accents_and_punctuation(self):
+        Product.objects.create(code=5, name="Crème d'Isigny", image_url="", nutriscore=20, nutriscore_grade="d",
+                               ingredients_image="", category=Category.objects.get(name="Charcuterie"))
+
+        self.assertEqual(["Crème d'Isigny"], Product.objects.search_autocomplete("CREME D ISI"))
+        self.assertEqual(["Best Saucisson sec"], Product.objects.search_autocomplete("best-saucisson"))
+
+    def test_search_key_saved(self):
+        self.best_prod.name = "Saucisson à l'ail"
+        self.best_prod.save()
+
+        self.assertEqual("saucisson a l ail", Product.objects.get(code=12345).search_key)
+
+    def test_get_old_product_exact_name(self):
+        self.assertEqual("Best Saucisson sec", Product.objects.get_old_product("Best Saucisson sec").name)
+
+    def test_get_old_product_search_key(self):
+        self.assertEqual("Best Saucisson sec", Product.objects.get_old_product("BEST saucisson-sec").name)
+        # The exact name before the other names of the same search key
+        Product.objects.create(code=1, name="best saucisson sec", image_url="", nutriscore=20, nutriscore_grade="d",
+                               ingredients_image="", category=Category.objects.get(name="Charcuterie"))
+        self.assertEqual(1, Product.objects.get_old_product("Best saucisson, sec").code)
+        self.assertEqual(self.best_prod, Product.objects.get_old_product("Best Saucisson sec"))
+
+    def test_get_old_product_ranked_by_full_text(self):
+        # Every product matches, the shortest name comes first among the best ranked ones
+        self.assertEqual("Saucisson sec", Product.objects.get_old_product("sauciss").name)
+        self.assertEqual("Worst Saucisson sec", Product.objects.get_old_product("saucissons worst").name)
+        # Category names are searched too, with a lower weight
+        self.assertEqual("Saucisson sec", Product.objects.get_old_product("charcuteries").name)
+
+    def test_get_old_product_full_text_accents(self):
+        category = Category.objects.create(name="Céréales au chocolat")
+        Product.objects.create(code=6, name="Crème brûlée à la vanille", image_url="", nutriscore=20,
+                               nutriscore_grade="d", ingredients_image="", category=category)
+
+        # The words of the search are unaccented, as the vector
+        self.assertEqual(6, Product.objects.get_old_product("creme brulee").code)
+        self.assertEqual(6, Product.objects.get_old_product("Crème brûl").code)
+        self.assertEqual(6, Product.objects.get_old_product("cereales chocolat").code)
+
+    def test_get_old_product_not_found(self):
+        self.assertIsNone(Product.objects.get_old_product("jambon"))
+        self.assertIsNone(Product.objects.get_old_product("&|!"))
 
     def test_better_products_first_six(self):
         product = Product.objects.get(code=98765)
@@ -80,6 +153,10 @@ class ProductViewTests(TestCase):
         }
         Product.objects.create(**prod)
 
+    def setUp(self) -> None:
+        # Results cached by the other tests, of the same catalog version
+        result_cache.get_cache().clear()
+
     # index()
     def test_index_online(self):
         response = self.client.get(reverse('products:index'))
@@ -96,8 +173,9 @@ class ProductViewTests(TestCase):
                              '</td></tr>', str(response.context['form']))
 
     # product_autocomplete()
+    @mock.patch("products.views.autocomplete.get_index", return_value=None)
     @mock.patch("products.views.Product.objects.search_autocomplete", return_value=["Saucisson"]*10)
-    def test_product_autocomplete_return_list(self, autocomplete):
+    def test_product_autocomplete_return_list(self, autocomplete, get_index):
 
         response = self.client.get(reverse('products:product_autocomplete'), {'term': "saucisson"})
 
@@ -105,6 +183,28 @@ class ProductViewTests(TestCase):
         self.assertEqual(10, len(response.json()))
         self.assertListEqual(["Saucisson"]*10, response.json())
 
+    @mock.patch("products.views.Product.objects.search_autocomplete")
+    def test_product_autocomplete_memory_index(self, search_autocomplete):
+        index = AutocompleteIndex([("Saucisson sec", 10, 1), ("Jambon", 5, 2)])
+
+        with mock.patch("products.views.autocomplete.get_index", return_value=index):
+            response = self.client.get(reverse('products:product_autocomplete'), {'term': "sec"})
+
+        self.assertListEqual(["Saucisson sec"], response.json())
+        search_autocomplete.assert_not_called()
+
+    @mock.patch("products.views.autocomplete.get_index", return_value=None)
+    def test_product_search_cached(self, get_index):
+        self.client.get(reverse('products:product_search'), {'search': "saucisson sec"})
+        self.client.get(reverse('products:product_autocomplete'), {'term': "sauciss"})
+
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse('products:product_search'), {'search': "saucisson sec"})
+            self.assertEqual(12345, response.context['old_product'].code)
+            self.assertEqual([12345], [product.code for product in response.context['better_products']])
+            response = self.client.get(reverse('products:product_autocomplete'), {'term': "SAUCISS "})
+            self.assertListEqual(["Saucisson sec"], response.json())
+
     def test_product_autocomplete_no_user_search(self):
         with self.assertRaises(ValueError):
             self.client.get(reverse('products:product_autocomplete'))
@@ -157,3 +257,651 @@ class ProductViewTests(TestCase):
         response = self.client.get(reverse("products:product_details", args=[99999]))
 
         self.assertRedirects(response, reverse("products:index"))
+
+
+class DbInitCommandTests(TestCase):
+
+    def setUp(self) -> None:
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self.dump_path = os.path.join(tmp_dir.name, "products.jsonl")
+
+        product = {
+            "code": "12345",
+            "product_name_fr": "Saucisson sec",
+            "image_url": "http://www.saucissonsec.com",
+            "nutriscore_score": 10,
+            "nutriscore_grade": "a",
+            "countries_lc": "fr",
+            "categories_lc": "fr",
+            "labels_lc": "fr",
+            "categories": "Viandes, Charcuteries",
+            "selected_images": {"ingredients": {"display": {'fr': "http://www.image.com"}}}
+        }
+        products = [
+            product,
+            dict(product, code="123451", product_name_fr="Saucisson sec 2", nutriscore_score=15),
+            dict(product, code="2", product_name_fr="Cola", categories="Boissons", nutriscore_grade="e"),
+        ]
+        with open(self.dump_path, "w", encoding="utf-8") as f:
+            f.write("\n".join(json.dumps(product) for product in products))
+
+    def call_command(self, *args, **options):
+        with redirect_stdout(io.StringIO()) as stdout:
+            call_command(*args, **options)
+        return stdout.getvalue()
+
+    def test_db_init_from_dump(self):
+        self.call_command("db_init", dump=self.dump_path)
+
+        self.assertEqual(3, Product.objects.count())
+        self.assertEqual({"Charcuteries", "Boissons"}, set(Category.objects.values_list("name", flat=True)))
+        self.assertEqual("Boissons", Product.objects.get(code=2).category.name)
+
+    def test_db_init_from_dump_with_filter_and_quota(self):
+        self.call_command("db_init", dump=self.dump_path, categories=["Charcuteries"], p=1)
+
+        self.assertEqual([12345], list(Product.objects.values_list("code", flat=True)))
+
+    def test_db_init_skips_conflicts_by_batch(self):
+        category = Category.objects.create(name="Charcuteries")
+        # Same name as the second product of the dump, different code
+        Product.objects.create(code=1, name="Saucisson sec 2", image_url="", nutriscore=0, nutriscore_grade="a",
+                               ingredients_image="", category=category)
+
+        output = self.call_command("db_init", dump=self.dump_path, batch_size=2)
+
+        self.assertEqual({1, 12345, 2}, set(Product.objects.values_list("code", flat=True)))
+        self.assertIn("Successfully added 2 products", output)
+        self.assertIn("2 rows written in 1 batches", output)
+
+    def test_db_init_copy_loader(self):
+        self.call_command("db_init", dump=self.dump_path, loader="copy")
+
+        self.assertEqual({12345, 123451, 2}, set(Product.objects.values_list("code", flat=True)))
+        self.assertEqual("Boissons", Product.objects.get(code=2).category.name)
+
+    def test_db_init_report(self):
+        report_path = os.path.join(os.path.dirname(self.dump_path), "report.json")
+
+        self.call_command("db_init", dump=self.dump_path, report=report_path)
+
+        with open(report_path, encoding="utf-8") as f:
+            report = json.load(f)
+        self.assertEqual("db_init", report['command'])
+        self.assertEqual(3, report['products'])
+        self.assertEqual(1000, report['batch_size'])
+        self.assertEqual(1, report['stages']['db_write']['count'])
+        self.assertEqual(3, report['stages']['validate']['count'])
+        self.assertEqual(3, report['counters']['products_fetched'])
+
+    def test_db_init_bumps_catalog_version(self):
+        self.call_command("db_init", dump=self.dump_path)
+
+        self.assertEqual(1, CatalogVersion.get_version())
+
+    def test_db_init_api_requires_numbers(self):
+        with self.assertRaises(CommandError):
+            self.call_command("db_init", c=1)
+
+    def test_db_init_resumes_from_checkpoints(self):
+        fixtures = make_synthetic_fixtures(3, 20, invalid_rate=0)
+        # Previous run stopped in its second category
+        for position, name in enumerate(fixtures['categories'][:2]):
+            category = Category.objects.create(name=name)
+            IngestCheckpoint.objects.create(category=category, position=position, completed=position == 0)
+
+        with OFFStubServer(fixtures['categories'], fixtures['products']) as server:
+            self.call_command("db_init", c=3, p=5, off_url=server.url, no_cache=True)
+
+        self.assertEqual([fixtures['categories'][1]], [request[0] for request in server.search_requests])
+        self.assertEqual(5, Product.objects.count())
+        self.assertFalse(IngestCheckpoint.objects.exists())
+
+    def test_db_init_resume_ignores_products_of_other_runs(self):
+        fixtures = make_synthetic_fixtures(1, 20, invalid_rate=0)
+        category = Category.objects.create(name=fixtures['categories'][0])
+        IngestCheckpoint.objects.create(category=category, position=0, offset=5, products_added=2)
+        for code in range(900001, 900004):
+            Product.objects.create(code=code, name=f"Produit d'un autre import {code}", image_url="", nutriscore=0,
+                                   nutriscore_grade="a", ingredients_image="", category=category)
+
+        with OFFStubServer(fixtures['categories'], fixtures['products']) as server:
+            self.call_command("db_init", c=1, p=5, off_url=server.url, no_cache=True)
+
+        # 2 products added before the checkpoint, 3 more to reach the 5 of the category
+        self.assertEqual(3, Product.objects.exclude(code__gte=900001).count())
+
+
+class DbUpdateCommandTests(TestCase):
+
+    def setUp(self) -> None:
+        fixtures = make_synthetic_fixtures(1, 20, invalid_rate=0)
+        self.category = fixtures['categories'][0]
+        self.products = fixtures['products'][self.category]
+        for number, product in enumerate(self.products):
+            product['last_modified_t'] = 1000 + number
+
+    def call_command(self, *args, **options):
+        with OFFStubServer([self.category], {self.category: self.products}) as server, \
+                redirect_stdout(io.StringIO()):
+            call_command(*args, off_url=server.url, no_cache=True, **options)
+        return server
+
+    def test_db_update_incremental(self):
+        self.call_command("db_init", c=1, p=20)
+        self.call_command("db_update", incremental=True)
+        self.assertEqual(1019, SyncState.objects.get(name="db_update").last_modified_t)
+
+        self.products[3].update(nutriscore_score=40, last_modified_t=2000)
+        server = self.call_command("db_update", incremental=True)
+
+        self.assertEqual(40, Product.objects.get(code=self.products[3]['code']).nutriscore)
+        self.assertEqual(2000, SyncState.objects.get(name="db_update").last_modified_t)
+        # The first page holds the only modified product, the second one may have been prefetched
+        self.assertIn((self.category, 1, 250), server.search_requests)
+        self.assertLessEqual(len(server.search_requests), 2)
+
+    def test_db_update_incremental_revalidates_cached_pages(self):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self.call_command("db_init", c=1, p=20)
+
+        with override_settings(OPENFOODFACTS_CACHE_DIR=tmp_dir.name), \
+                OFFStubServer([self.category], {self.category: self.products}) as server, \
+                redirect_stdout(io.StringIO()):
+            call_command("db_update", incremental=True, off_url=server.url, cache_ttl=3600)
+            # Caches the page of the most recently modified products
+            call_command("db_update", incremental=True, off_url=server.url, cache_ttl=3600)
+            self.products[3].update(nutriscore_score=40, last_modified_t=2000)
+            call_command("db_update", incremental=True, off_url=server.url, cache_ttl=3600)
+
+        self.assertEqual(40, Product.objects.get(code=self.products[3]['code']).nutriscore)
+
+    def test_db_update_revalidates_cached_pages(self):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+
+        with override_settings(OPENFOODFACTS_CACHE_DIR=tmp_dir.name), \
+                OFFStubServer([self.category], {self.category: self.products}) as server, \
+                redirect_stdout(io.StringIO()):
+            call_command("db_init", c=1, p=20, off_url=server.url)
+            self.products[3]['nutriscore_score'] = 40
+            requests_count = len(server.search_requests)
+            # The pages cached by db_init are fresh for its TTL but not for db_update
+            call_command("db_update", off_url=server.url)
+
+        self.assertGreater(len(server.search_requests), requests_count)
+        self.assertEqual(40, Product.objects.get(code=self.products[3]['code']).nutriscore)
+
+    def test_db_update_watermark_before_run_start(self):
+        self.call_command("db_init", c=1, p=20)
+        self.products[3].update(last_modified_t=int(time.time()) + 3600)
+        self.call_command("db_update", incremental=True)
+
+        # A product changed during the run, in a category already read, is looked up by the next run
+        self.assertLessEqual(SyncState.objects.get(name="db_update").last_modified_t,
+                             int(time.time()) - DbUpdateCommand._WATERMARK_MARGIN)
+
+    def test_db_update_by_code_favorites_first(self):
+        self.call_command("db_init", c=1, p=20)
+        favorite = baker.make("Favorite", new_product=Product.objects.get(code=15),
+                              ancient_product=Product.objects.get(code=7))
+        self.products[6]['nutriscore_score'] = 40
+
+        codes = list(DbUpdateCommand.get_codes())
+        self.assertEqual([15, 7], codes[:2])
+        self.assertEqual(set(range(1, 21)), set(codes))
+
+        server = self.call_command("db_update", by_code=True)
+
+        self.assertEqual(20, server.requests_count)
+        self.assertEqual([], server.search_requests)
+        self.assertEqual(40, Product.objects.get(code=7).nutriscore)
+        self.assertTrue(Favorite.objects.filter(pk=favorite.pk).exists())
+
+
+class CatalogSyncCommandTests(TestCase):
+    # Same dump as db_init
+    setUp = DbInitCommandTests.setUp
+    call_command = DbInitCommandTests.call_command
+
+    def test_catalog_sync_idempotent(self):
+        first = self.call_command("catalog_sync", dump=self.dump_path)
+        second = self.call_command("catalog_sync", dump=self.dump_path)
+
+        self.assertIn("Inserted 3, updated 0, unchanged 0 and rejected 0", first)
+        self.assertIn("Inserted 0, updated 0, unchanged 3 and rejected 0", second)
+        self.assertEqual(3, Product.objects.count())
+
+    def test_upserter_counts(self):
+        self.call_command("catalog_sync", dump=self.dump_path)
+        product = {"code": "12345", "name": "Saucisson sec", "image_url": "http://www.saucissonsec.com",
+                   "nutriscore": 10, "nutriscore_grade": "a", "ingredients_image": "http://www.image.com",
+                   "category": "Charcuteries"}
+
+        upserter = ProductUpserter()
+        upserter.add(dict(product, nutriscore=12))
+        upserter.add(dict(product, code="3", name="Pâté", category="Pâtés"))
+        upserter.add(dict(product, code="4", name="Cola"))
+        upserter.add(dict(product, code="123451", name="Saucisson sec 2", nutriscore=15))
+        upserter.flush()
+
+        self.assertEqual((1, 1, 1, 1), (upserter.inserted, upserter.updated, upserter.unchanged, upserter.rejected))
+        self.assertEqual(12, Product.objects.get(code=12345).nutriscore)
+        self.assertEqual("Pâtés", Product.objects.get(code=3).category.name)
+        self.assertFalse(Product.objects.filter(code=4).exists())
+        self.assertEqual("pate", Product.objects.get(code=3).search_key)
+
+    def test_upserter_retries_names_taken_concurrently(self):
+        category = Category.objects.create(name="Charcuteries")
+        # Saved by another writer after the check of the names
+        Product.objects.create(code=1, name="Saucisson sec", image_url="", nutriscore=0, nutriscore_grade="a",
+                               ingredients_image="", category=category)
+        reject_taken_names = ProductUpserter._reject_taken_names
+        checks = []
+
+        def racy_check(upserter, products):
+            checks.append(len(products))
+            return products if len(checks) == 1 else reject_taken_names(upserter, products)
+
+        upserter = ProductUpserter()
+        with mock.patch.object(ProductUpserter, "_reject_taken_names", racy_check):
+            upserter.add({"code": "2", "name": "Saucisson sec", "image_url": "", "nutriscore": 10,
+                          "nutriscore_grade": "a", "ingredients_image": "", "category": "Charcuteries"})
+            upserter.add({"code": "3", "name": "Jambon", "image_url": "", "nutriscore": 10,
+                          "nutriscore_grade": "a", "ingredients_image": "", "category": "Jambons"})
+            upserter.flush()
+
+        self.assertEqual([2, 2], checks)
+        self.assertEqual((1, 0, 1), (upserter.inserted, upserter.updated, upserter.rejected))
+        self.assertEqual({1, 3}, set(Product.objects.values_list("code", flat=True)))
+        self.assertEqual("Jambons", Product.objects.get(code=3).category.name)
+
+
+class WorkersCommandTests(TransactionTestCase):
+
+    def test_db_init_and_db_update_with_workers(self):
+        fixtures = make_synthetic_fixtures(4, 30, invalid_rate=0)
+        # Same name in two categories of two different workers
+        fixtures['products'][fixtures['categories'][1]][0]['product_name_fr'] = \
+            fixtures['products'][fixtures['categories'][0]][0]['product_name_fr']
+
+        with OFFStubServer(fixtures['categories'], fixtures['products']) as server, redirect_stdout(io.StringIO()):
+            call_command("db_init", c=4, p=10, workers=2, off_url=server.url, no_cache=True)
+            products_count = Product.objects.count()
+            fixtures['products'][fixtures['categories'][3]][0]['nutriscore_score'] = 40
+            call_command("db_update", workers=2, by_code=True, off_url=server.url, no_cache=True)
+
+        self.assertEqual(4, Category.objects.count())
+        # The duplicated name is skipped by the insert of one of the workers
+        self.assertEqual(39, products_count)
+        self.assertEqual(4, len(set(Product.objects.values_list("category", flat=True))))
+        self.assertFalse(IngestCheckpoint.objects.exists())
+        self.assertEqual(40, Product.objects.get(code=fixtures['products'][fixtures['categories'][3]][0]['code'])
+                         .nutriscore)
+
+    def test_db_update_with_workers_empty_db(self):
+        fixtures = make_synthetic_fixtures(2, 5, invalid_rate=0)
+
+        with OFFStubServer(fixtures['categories'], fixtures['products']) as server:
+            output = io.StringIO()
+            with redirect_stdout(output):
+                call_command("db_update", workers=2, by_code=True, off_url=server.url, no_cache=True)
+
+        self.assertIn("Successfully updated 0 products", output.getvalue())
+        self.assertEqual([], run_in_processes(print, []))
+
+
+class AutocompleteBenchmarkTests(TestCase):
+
+    def test_autocomplete_benchmark(self):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        output = os.path.join(tmp_dir.name, "results.json")
+
+        with redirect_stdout(io.StringIO()):
+            call_command("autocomplete_benchmark", products=300, queries=20, index_sizes="500", output=output)
+
+        with open(output, encoding="utf-8") as f:
+            results = json.load(f)
+        self.assertEqual(["icontains", "trigram", "memory"], [result['query'] for result in results['queries']])
+        self.assertEqual(20, results['queries'][1]['searches'])
+        self.assertEqual(500, results['index_builds'][0]['products'])
+        self.assertGreater(results['index_builds'][0]['memory_mb'], 0)
+        # The generated catalog is rolled back
+        self.assertFalse(Product.objects.exists())
+
+    def test_trigram_index(self):
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT 1 FROM pg_available_extensions WHERE name = 'pg_trgm'")
+            if cursor.fetchone() is None:
+                self.skipTest("pg_trgm is not available")
+            cursor.execute("SELECT indexdef FROM pg_indexes WHERE indexname = 'products_search_key_trgm'")
+            self.assertIn("gin_trgm_ops", cursor.fetchone()[0])
+
+
+class ResultCacheTests(TestCase):
+
+    def test_lru_eviction(self):
+        lru = LRUCache(max_size=2)
+        lru.set("a", 1)
+        lru.set("b", 2)
+        lru.get("a")
+        lru.set("c", 3)
+
+        self.assertEqual((1, None, 3), (lru.get("a"), lru.get("b"), lru.get("c")))
+        self.assertEqual((3, 1), (lru.hits, lru.misses))
+
+    def test_none_result_cached(self):
+        cache = ResultCache(max_size=10)
+        compute = mock.Mock(return_value=None)
+
+        self.assertIsNone(cache.get_or_compute("old_product", "jambon", compute))
+        self.assertIsNone(cache.get_or_compute("old_product", "jambon", compute))
+        compute.assert_called_once_with()
+
+    def test_results_copied(self):
+        cache = ResultCache(max_size=10)
+        cache.get_or_compute("better_products", "1", lambda: [{"is_favorite": False}])[0]["is_favorite"] = True
+
+        self.assertEqual([{"is_favorite": False}], cache.get_or_compute("better_products", "1", list))
+
+    def test_catalog_version_invalidates(self):
+        cache = ResultCache(max_size=10, version_ttl=0)
+        compute = mock.Mock(side_effect=[["Saucisson"], ["Saucisson", "Saucisse"]])
+
+        self.assertEqual(["Saucisson"], cache.get_or_compute("autocomplete", "sau", compute))
+        self.assertEqual(["Saucisson"], cache.get_or_compute("autocomplete", "sau", compute))
+        CatalogVersion.bump()
+        self.assertEqual(["Saucisson", "Saucisse"], cache.get_or_compute("autocomplete", "sau", compute))
+
+    def test_version_read_once_by_ttl(self):
+        cache = ResultCache(max_size=10, version_ttl=60)
+        cache.get_version()
+
+        with self.assertNumQueries(0):
+            self.assertEqual(0, cache.get_version())
+
+    @override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+                               'products': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+                                            'LOCATION': 'products-tests'}})
+    def test_shared_cache(self):
+        compute = mock.Mock(return_value=["Saucisson"])
+        ResultCache(max_size=10, shared_alias='products').get_or_compute("autocomplete", "sau", compute)
+
+        # Another process, with an empty LRU
+        cache = ResultCache(max_size=10, shared_alias='products')
+        self.assertEqual(["Saucisson"], cache.get_or_compute("autocomplete", "sau", compute))
+        compute.assert_called_once_with()
+        self.assertEqual(1, len(cache.lru))
+
+
+@override_settings(AUTOCOMPLETE_INDEX=False)
+class AutocompleteIndexTests(TestCase):
+
+    def setUp(self) -> None:
+        self.rows = [
+            ("Saucisson sec", 10, 1),
+            ("Saucisson sec pur porc", 20, 2),
+            ("Best Saucisson sec", 30, 3),
+            ("Crème brûlée", 5, 4),
+            ("Pâté de campagne", 5, 5),
+            ("Pâte à tartiner", 15, 6),
+        ]
+
+    def test_normalize(self):
+        self.assertEqual("creme brulee l oeuf co", normalize(" Crème Brûlée, L'oeuf & Co_!"))
+
+    def test_search_order(self):
+        index = AutocompleteIndex(self.rows)
+
+        # Names starting with the search, then the shortest ones, then the worst nutriscores
+        self.assertEqual(["Saucisson sec", "Saucisson sec pur porc", "Best Saucisson sec"], index.search("sauciss"))
+        self.assertEqual(["Saucisson sec", "Best Saucisson sec", "Saucisson sec pur porc"], index.search("sec"))
+
+    def test_search_word_prefix_without_accents(self):
+        index = AutocompleteIndex(self.rows)
+
+        self.assertEqual(["Crème brûlée"], index.search("brulé"))
+        self.assertEqual(["Pâte à tartiner", "Pâté de campagne"], index.search("PATE"))
+        # Inside a word
+        self.assertEqual([], index.search("isson"))
+
+    def test_search_min_length_and_limit(self):
+        index = AutocompleteIndex(self.rows, limit=2)
+
+        self.assertEqual([], index.search(" sa "))
+        self.assertEqual(2, len(index.search("sau")))
+
+    def test_search_ranked_prefix(self):
+        rows = [(f"Saucisson {code}", code % 7, code) for code in range(1, 1001)]
+        index = AutocompleteIndex(rows)
+        expected = [name for name, _, _ in sorted(rows, key=lambda row: (len(row[0]), -row[1], row[2]))[:10]]
+
+        self.assertIn("sau", index._top)
+        self.assertEqual(expected, index.search("Sau"))
+        # Same result as a scan of the entries
+        self.assertEqual(expected, [index._names[number] for number in index._rank(*index._get_range("sau"))])
+        self.assertEqual(["Saucisson 999"], index.search("saucisson 999"))
+
+    def test_refresh_on_catalog_version(self):
+        self.addCleanup(setattr, autocomplete, "_current", (None, None))
+        baker.make(Product, name="Saucisson sec", nutriscore=10)
+
+        self.assertTrue(autocomplete.refresh())
+        first_index = autocomplete.get_index()
+        self.assertEqual(["Saucisson sec"], first_index.search("sau"))
+        self.assertFalse(autocomplete.refresh())
+
+        baker.make(Product, name="Saucisse", nutriscore=10)
+        CatalogVersion.bump()
+
+        self.assertTrue(autocomplete.refresh())
+        self.assertIsNot(first_index, autocomplete.get_index())
+        self.assertEqual(["Saucisse", "Saucisson sec"], autocomplete.get_index().search("sau"))
+
+    def test_same_results_as_db(self):
+        category = Category.objects.create(name="Desserts")
+        for code, (name, nutriscore, _) in enumerate(self.rows + [("Tarte aux pâtes", 5, 7), ("Pastis", 5, 8)]):
+            Product.objects.create(code=code + 1, name=name, image_url="", nutriscore=nutriscore,
+                                   nutriscore_grade="a", ingredients_image="", category=category)
+        index = AutocompleteIndex.from_db()
+
+        for user_search in ("sau", "sec", "pate", "PÂTÉ de", "isson", "ast", "tar", "creme br", "pas"):
+            self.assertEqual(Product.objects.search_autocomplete(user_search), index.search(user_search),
+                             msg=user_search)
+
+    @override_settings(AUTOCOMPLETE_INDEX=True)
+    @mock.patch("products.autocomplete.threading.Thread")
+    def test_thread_started_once_by_process(self, thread):
+        self.addCleanup(setattr, autocomplete, "_started_pid", None)
+
+        autocomplete.get_index()
+        autocomplete.get_index()
+        thread.return_value.start.assert_called_once_with()
+
+        # Forked process, e.g. a worker of gunicorn --preload
+        with mock.patch("products.autocomplete.os.getpid", return_value=-1):
+            autocomplete.get_index()
+        self.assertEqual(2, thread.return_value.start.call_count)
+
+    def test_catalog_version_bump(self):
+        self.assertEqual(0, CatalogVersion.get_version())
+        CatalogVersion.bump()
+        CatalogVersion.bump()
+        self.assertEqual(2, CatalogVersion.get_version())
+
+
+class ProductLoaderTests(TestCase):
+    loader_class = ProductLoader
+
+    def setUp(self) -> None:
+        self.product = {
+            "code": 1,
+            "name": "Saucisson sec",
+            "image_url": "http://www.saucissonsec.com",
+            "nutriscore": 10,
+            "nutriscore_grade": "a",
+            "ingredients_image": "http://www.image.com",
+            "category": "Charcuterie",
+        }
+
+    def test_flush_by_batch_size(self):
+        loader = self.loader_class(batch_size=2)
+        for code in range(1, 6):
+            loader.add(dict(self.product, code=code, name=f"Saucisson {code}"))
+
+        self.assertEqual(4, Product.objects.count())
+        loader.flush()
+        self.assertEqual(5, Product.objects.count())
+        self.assertEqual(3, loader.batches)
+        self.assertEqual(1, Category.objects.count())
+
+    def test_conflicts_skipped(self):
+        loader = self.loader_class()
+        loader.add(self.product)
+        loader.add(dict(self.product, code=2))
+        loader.add(dict(self.product, name="Saucisson 2"))
+        loader.flush()
+
+        self.assertEqual([1], list(Product.objects.values_list("code", flat=True)))
+        product = Product.objects.get(code=1)
+        self.assertEqual(Product.get_content_hash(self.product), product.content_hash)
+        self.assertEqual("saucisson sec", product.search_key)
+        self.assertIsNotNone(product.updated_at)
+        # The skipped rows are not counted as written
+        self.assertEqual((1, 3), (loader.rows, loader.sent))
+        self.assertIn("1 rows written in 1 batches, 2 skipped", loader.get_stats())
+
+    def test_after_flush(self):
+        loader = self.loader_class()
+        callback = mock.Mock(side_effect=lambda: self.assertEqual(1, Product.objects.count()))
+        loader.add(self.product)
+        loader.after_flush(callback)
+
+        callback.assert_not_called()
+        loader.flush()
+        callback.assert_called_once_with()
+
+
+class CopyProductLoaderTests(ProductLoaderTests):
+    loader_class = CopyProductLoader
+
+
+class ProductUpdaterTests(TestCase):
+
+    def setUp(self) -> None:
+        category = Category.objects.create(name="Charcuterie")
+        for code in range(1, 4):
+            Product.objects.create(code=code, name=f"Saucisson {code}", image_url="http://www.saucissonsec.com",
+                                   nutriscore=10, nutriscore_grade="a", ingredients_image="http://www.image.com",
+                                   category=category)
+
+    def update(self, *products):
+        updater = ProductUpdater(batch_size=2)
+        for product in products:
+            # Values of the products of the DB by default, like a full product dict of get_products()
+            updater.add(dict({"image_url": "http://www.saucissonsec.com", "nutriscore": 10, "nutriscore_grade": "a",
+                              "ingredients_image": "http://www.image.com", "category": "Charcuterie"}, **product))
+        updater.flush()
+        return updater
+
+    def test_only_changed_products_updated(self):
+        updater = self.update({"code": "1", "name": "Saucisson 1", "nutriscore": 12, "nutriscore_grade": "b"},
+                              {"code": "2", "name": "Saucisson 2", "nutriscore": 10},
+                              {"code": "9", "name": "Saucisson 9", "nutriscore": 1})
+
+        self.assertEqual(1, updater.updated)
+        self.assertEqual(1, updater.unchanged)
+        self.assertEqual((12, "b"), Product.objects.values_list("nutriscore", "nutriscore_grade").get(code=1))
+        self.assertFalse(Product.objects.filter(code=9).exists())
+
+    def test_content_hash_follows_updates(self):
+        updated_at = Product.objects.get(code=1).updated_at
+        self.update({"code": "1", "name": "Saucisson 2", "nutriscore": 12})
+        product = Product.objects.get(code=1)
+
+        self.assertEqual(Product.get_content_hash(product.__dict__), product.content_hash)
+        self.assertEqual("Saucisson 1", product.name)
+        self.assertGreater(product.updated_at, updated_at)
+        self.assertEqual({1: product.content_hash},
+                         Product.objects.get_content_hashes(category=product.category, codes=[1]))
+
+    def test_search_key_follows_rename(self):
+        self.update({"code": "3", "name": "Saucisson fumé"})
+
+        self.assertEqual("saucisson fume", Product.objects.get(code=3).search_key)
+
+    def test_stale_hash_rewritten_without_update(self):
+        Product.objects.filter(code=1).update(content_hash="")
+        updater = self.update({"code": "1", "name": "Saucisson 1"})
+
+        self.assertEqual(0, updater.updated)
+        self.assertEqual(32, len(Product.objects.get(code=1).content_hash))
+
+    def test_name_taken_not_applied(self):
+        updater = self.update({"code": "1", "name": "Saucisson 2", "nutriscore": 12},
+                              {"code": "3", "name": "Saucisson 4"},
+                              {"code": "2", "name": "Saucisson 4"})
+
+        self.assertEqual(2, updater.updated)
+        self.assertEqual(2, updater.name_conflicts)
+        self.assertEqual(("Saucisson 1", 12), Product.objects.values_list("name", "nutriscore").get(code=1))
+        self.assertEqual(["Saucisson 1", "Saucisson 2", "Saucisson 4"],
+                         list(Product.objects.order_by("code").values_list("name", flat=True)))
+
+    def test_name_taken_meanwhile_only_conflicting_rows_dropped(self):
+        # The names are taken by a concurrent writer after the check of the batch
+        with mock.patch.object(ProductUpdater, '_drop_name_conflicts'):
+            updater = self.update({"code": "1", "name": "Saucisson 2"},
+                                  {"code": "3", "name": "Saucisson 5"})
+
+        self.assertEqual(1, updater.updated)
+        self.assertEqual(1, updater.name_conflicts)
+        self.assertEqual(["Saucisson 1", "Saucisson 2", "Saucisson 5"],
+                         list(Product.objects.order_by("code").values_list("name", flat=True)))
+
+
+class IngestPipelineTests(TestCase):
+
+    def test_products_and_deferred_callbacks_in_order(self):
+        pipeline = IngestPipeline(queue_size=2)
+        consumed = []
+
+        def products():
+            for number in range(10):
+                yield number
+                if number % 3 == 2:
+                    pipeline.defer(consumed.append, f"after {number}")
+
+        pipeline.run(products(), consumed.append)
+
+        self.assertEqual([0, 1, 2, "after 2", 3, 4, 5, "after 5", 6, 7, 8, "after 8", 9], consumed)
+        self.assertEqual(10, pipeline.consumed)
+        self.assertLessEqual(pipeline.max_depth, 2)
+
+    def test_producer_failure_raised(self):
+        def products():
+            yield 1
+            raise ValueError("Bad page")
+
+        with self.assertRaises(ValueError):
+            IngestPipeline().run(products(), lambda product: None)
+
+    def test_writer_failure_stops_producer(self):
+        produced = []
+
+        def products():
+            for number in range(1000):
+                produced.append(number)
+                yield number
+
+        def consume(product):
+            raise RuntimeError("DB down")
+
+        with self.assertRaises(RuntimeError):
+            IngestPipeline(queue_size=5).run(products(), consume)
+
+        # Backpressure: the producer stopped at the full queue
+        self.assertLess(len(produced), 10)